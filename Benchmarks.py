@@ -0,0 +1,473 @@
+import logging, sys, re, time, random, argparse, json, os, platform, tracemalloc
+import numpy as np
+from nltk import collocations
+
+# Configure logging
+logging.basicConfig(stream=sys.stdout, format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
+
+# The functions used here are defined in the separate file Functions.py
+from Functions import *
+
+# A few Romanian words, with and without diacritics, plus punctuation, digits and unicode punctuation,
+# used by the comparisons with the legacy functions and with NLTK (--compare) when no corpus file is supplied
+ctSampleWords = [u'bucurie', u'ţară', u'țară', u'frumoasă', u'școală', u'şcoală', u'admiraţie', u'maşină',
+                 u'România', u'Guvernul', u'întâlnire', u'„spune', u'anul”', u'2018', u'10,5', u'...', u'(',
+                 u')', u'--', u'–', u'dl.', u'ştiri', u'…', u'’', u'preşedinte', u'agasant', u'x']
+
+
+# --------------------------------------------------------------------------------------------------
+# The pre-processing, exactly as it was implemented before the single-pass normalizer
+# We keep it here only as a reference, both for the results and for the throughput
+# --------------------------------------------------------------------------------------------------
+def removeUnicodePunctuationLegacy(text):
+    res = text
+    res = res.replace(u'”', ' ')
+    res = res.replace(u'’', ' ')
+    res = res.replace(u'…', ' ')
+    res = res.replace(u'„', ' ')
+    res = res.replace(u'“', ' ')
+    res = res.replace(u',', ' ')
+    return res
+
+
+def removeDiacriticsLegacy(text):
+    res = text
+    res = res.replace(u'ț', 't')
+    res = res.replace(u'ă', 'a')
+    res = res.replace(u'î', 'i')
+    res = res.replace(u'ș', 's')
+    res = res.replace(u'â', 'a')
+    res = res.replace(u'ţ', 't')
+    res = res.replace(u'ş', 's')
+    res = res.replace(u'à', 'a')
+    return res
+
+
+def preProcessLegacy(document, lowercase=True, unicode=True, diacritics=True, punctuation=True, digits=True):
+    if lowercase:
+        document = [word.lower() for word in document]
+    if unicode:
+        document = [removeUnicodePunctuationLegacy(word) for word in document]
+    if diacritics:
+        document = [removeDiacriticsLegacy(word) for word in document]
+    if punctuation:
+        document = [word for word in document if word not in ctPunctuationTokens]
+        document = [re.sub('[' + ctPunctuation + ']', '', word) for word in document]
+    if digits:
+        document = [re.sub('[' + ctDigits + ']', '', word) for word in document]
+    document = [word for word in document if word.strip() != '']
+    return document
+
+
+# --------------------------------------------------------------------------------------------------
+# The stopwords removal, exactly as it was implemented before the stopwords were loaded as a set
+# (the stopwords are the list returned by loadWords, so every lookup scans the list)
+# --------------------------------------------------------------------------------------------------
+def removeStopwordsLegacy(words, stopwords):
+    return [x for x in words if x not in stopwords]
+
+
+# ---------------------------------------------------------------------
+# A function to time a function call (best of several runs)
+# ---------------------------------------------------------------------
+def timeIt(function, *args, repeat=3, **kwargs):
+    """
+    :param function: the function to be timed
+    :param repeat: number of runs
+    :return: (result of the last run, best wall time in seconds)
+    """
+    best = None
+    result = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return result, best
+
+
+# ---------------------------------------------------------------------
+# Compare the single-pass normalizer with the legacy pre-processing
+# ---------------------------------------------------------------------
+def benchmarkPreProcess(words):
+    logging.disable(logging.INFO)
+    try:
+        for flags in [(True, True, True, True, True), (True, False, True, False, True), (False, True, False, True, False)]:
+            legacy, legacyTime = timeIt(preProcessLegacy, words, *flags)
+            fused, fusedTime = timeIt(preProcess, words, *flags)
+            logging.disable(logging.NOTSET)
+            logging.info('preProcess %s: legacy %10s words/s | single-pass %10s words/s | speed-up x%.1f | same output: %s',
+                         flags,
+                         '{:,.0f}'.format(len(words) / legacyTime),
+                         '{:,.0f}'.format(len(words) / fusedTime),
+                         legacyTime / fusedTime,
+                         legacy == fused)
+            logging.disable(logging.INFO)
+    finally:
+        logging.disable(logging.NOTSET)
+
+
+# ---------------------------------------------------------------------
+# Compare the stopwords removal (set, encoded corpus, while streaming) with the legacy list scan
+# ---------------------------------------------------------------------
+def benchmarkStopwords(words, stopwordsFile, corpus=None):
+    logging.disable(logging.INFO)
+    try:
+        stopwordList = loadWords(stopwordsFile)
+        stopwordSet = loadStopwords(stopwordsFile)
+        legacy, legacyTime = timeIt(removeStopwordsLegacy, words, stopwordList, repeat=1)
+        filtered, setTime = timeIt(removeStopwords, words, stopwordSet)
+        encoded = encodeWords(words)
+        filteredEncoded, encodedTime = timeIt(removeStopwords, encoded, stopwordSet)
+        logging.disable(logging.NOTSET)
+        logging.info('stopwords (%s): legacy list %10s words/s | set %10s words/s (x%.1f) | '
+                     'encoded corpus %10s words/s (x%.1f) | same output: %s',
+                     '{:,}'.format(len(stopwordList)),
+                     '{:,.0f}'.format(len(words) / legacyTime),
+                     '{:,.0f}'.format(len(words) / setTime), legacyTime / setTime,
+                     '{:,.0f}'.format(len(words) / encodedTime), legacyTime / encodedTime,
+                     legacy == filtered == list(filteredEncoded))
+        if corpus:
+            # Reading the corpus, then removing the stopwords, against removing them while reading it
+            logging.disable(logging.INFO)
+            separate, separateTime = timeIt(lambda: removeStopwords(list(loadWords(corpus, stream=True)), stopwordSet))
+            fused, fusedTime = timeIt(lambda: list(loadWords(corpus, stream=True, stopwords=stopwordSet)))
+            logging.disable(logging.NOTSET)
+            logging.info('stopwords while streaming: stream then remove %.3fs | fused %.3fs | speed-up x%.1f | '
+                         'same output: %s', separateTime, fusedTime, separateTime / fusedTime, separate == fused)
+    finally:
+        logging.disable(logging.NOTSET)
+
+
+# ---------------------------------------------------------------------
+# Compare the NumPy bi-gram scoring with NLTK's BigramCollocationFinder
+# ---------------------------------------------------------------------
+def nltkBigrams(words):
+    finder = collocations.BigramCollocationFinder.from_words(words=words, window_size=2)
+    finder.apply_freq_filter(2)
+    return finder.score_ngrams(collocations.BigramAssocMeasures().pmi)
+
+
+def benchmarkBigrams(words):
+    logging.disable(logging.INFO)
+    try:
+        corpus = encodeWords(words)
+        reference, nltkTime = timeIt(nltkBigrams, words, repeat=1)
+        (keys, counts, scores), numpyTime = timeIt(scoreEncodedBigrams, corpus)
+        numTypes = len(corpus.vocabulary)
+        bigrams = [(corpus.vocabulary[key // numTypes], corpus.vocabulary[key % numTypes]) for key in keys.tolist()]
+        sameOrder = bigrams == [bigram for bigram, score in reference]
+        maxError = max([abs(a - b[1]) for a, b in zip(scores.tolist(), reference)] or [0])
+        logging.disable(logging.NOTSET)
+        logging.info('bi-grams: NLTK %.3fs | NumPy %.3fs | speed-up x%.1f | %s bi-grams, same bi-grams and order: %s, '
+                     'max. PMI difference %.2e', nltkTime, numpyTime, nltkTime / numpyTime,
+                     '{:,}'.format(len(bigrams)), sameOrder, maxError)
+    finally:
+        logging.disable(logging.NOTSET)
+
+
+# ---------------------------------------------------------------------
+# Compare the sentences loaded in parallel with the sentences loaded by one process: the shards end on
+# sentence ends, so the words and the sentence boundaries must be the same with any number of processes
+# ---------------------------------------------------------------------
+def benchmarkSentences(corpus, processes=None):
+    processes = processes or max(os.cpu_count() or 1, 2)
+    logging.disable(logging.INFO)
+    try:
+        reference, serialTime = timeIt(loadSentenceCorpus, corpus, 0, repeat=1)
+        parallel, parallelTime = timeIt(loadSentenceCorpus, corpus, processes, repeat=1)
+        numSentences = np.count_nonzero(corpusIds(reference) == reference.index.get(ctSentenceBoundary, -1))
+        logging.disable(logging.NOTSET)
+        logging.info('sentences: 1 process %.3fs | %s processes %.3fs | speed-up x%.1f | %s words, %s sentences, '
+                     'same output: %s', serialTime, processes, parallelTime, serialTime / parallelTime,
+                     '{:,}'.format(len(reference) - numSentences), '{:,}'.format(numSentences),
+                     list(reference) == list(parallel))
+    finally:
+        logging.disable(logging.NOTSET)
+
+
+# The vocabularies of the synthetic corpora: the most frequent (function) words first, then stems which get
+# inflected with the suffixes of the language (some of them also matching the sentiment lexicon)
+ctFunctionWords = {
+    'ro': [u'și', u'în', u'de', u'la', u'a', u'cu', u'pe', u'că', u'nu', u'se', u'din', u'o', u'un', u'care',
+           u'mai', u'este', u'sunt', u'pentru', u'fost', u'sau', u'dar', u'ce', u'au', u'acest', u'lui'],
+    'en': [u'the', u'of', u'and', u'to', u'a', u'in', u'is', u'that', u'for', u'it', u'was', u'on', u'with',
+           u'as', u'be', u'by', u'at', u'this', u'have', u'from', u'or', u'not', u'but', u'are', u'which']
+}
+ctStems = {
+    'ro': [u'bucur', u'admirați', u'trist', u'frumoas', u'școal', u'țar', u'guvern', u'președinț', u'întâlnir',
+           u'speranț', u'dragost', u'furi', u'fric', u'linișt', u'mulțum', u'agasant', u'ministr', u'partid',
+           u'lege', u'orașul', u'copil', u'părint', u'drum', u'spital', u'medic', u'profesor', u'elev', u'muncitor',
+           u'fabric', u'câmp', u'pădur', u'râu', u'munt', u'mașin', u'tren', u'avion', u'casă', u'familie',
+           u'prieten', u'dușman', u'calm', u'delici', u'durer', u'enerv', u'entuziasm', u'plăcer', u'știr',
+           u'televiziun', u'ziar', u'jurnalist', u'alegeri', u'vot', u'primar', u'consiliu', u'buget', u'tax'],
+    'en': [u'happi', u'admir', u'sad', u'beauti', u'school', u'countr', u'govern', u'presid', u'meet', u'hope',
+           u'love', u'anger', u'fear', u'calm', u'thank', u'annoy', u'minist', u'parti', u'law', u'citi', u'child',
+           u'parent', u'road', u'hospit', u'doctor', u'teach', u'student', u'worker', u'factori', u'field', u'forest',
+           u'river', u'mountain', u'car', u'train', u'plane', u'hous', u'famili', u'friend', u'enemi', u'delight',
+           u'pain', u'nerv', u'enthusiasm', u'pleasur', u'news', u'televis', u'paper', u'journalist', u'elect',
+           u'vote', u'mayor', u'council', u'budget', u'tax']
+}
+ctSuffixes = {
+    'ro': [u'', u'ul', u'ului', u'a', u'ei', u'ii', u'ile', u'ilor', u'ă', u'ește', u'ând', u'ată', u'ați', u'iei'],
+    'en': [u'', u's', u'ed', u'ing', u'er', u'ers', u'ly', u'ness', u'ful', u'y', u'ies', u'ment']
+}
+ctSizes = {'KB': 1024, 'MB': 1024 * 1024, 'GB': 1024 * 1024 * 1024}
+
+
+# ---------------------------------------------------------------------
+# A function to convert a size (e.g. 10MB) to a number of bytes
+# ---------------------------------------------------------------------
+def parseSize(size):
+    size = size.strip().upper()
+    for unit in ctSizes:
+        if size.endswith(unit):
+            return int(float(size[:-len(unit)]) * ctSizes[unit])
+    return int(size)
+
+
+# --------------------------------------------------------------------------------------------------
+# A function to generate a synthetic corpus: words drawn from a Zipf distribution over a vocabulary
+# of function words and inflected stems, with both forms of the Romanian diacritics (ș/ş, ț/ţ),
+# capitals, digits, punctuation and unicode punctuation; the same seed always gives the same corpus
+# --------------------------------------------------------------------------------------------------
+def generateCorpus(fileName, size, language='ro', seed=0, exponent=1.1, blockSize=10000):
+    """
+    :param fileName: The corpus file to be written
+    :param size: size of the corpus, in bytes
+    :param language: ro or en
+    :param seed: seed of the random generator
+    :param exponent: exponent of the Zipf distribution
+    :param blockSize: number of words generated at once
+    """
+    rng = np.random.default_rng(seed)
+    vocabulary = [stem + suffix for stem in ctStems[language] for suffix in ctSuffixes[language]]
+    rng.shuffle(vocabulary)
+    if language == 'ro':
+        # The same words, written with the old (cedilla) diacritics
+        vocabulary += [word.translate(str.maketrans(u'șț', u'şţ')) for word in vocabulary if u'ș' in word or u'ț' in word]
+    vocabulary = np.array(ctFunctionWords[language] + vocabulary, dtype=object)
+    probabilities = 1.0 / np.arange(1, len(vocabulary) + 1) ** exponent
+    probabilities /= probabilities.sum()
+
+    logging.info('Generating a %s corpus of %s bytes (%s distinct words) in file %s',
+                 language, '{:,}'.format(size), '{:,}'.format(len(vocabulary)), fileName)
+    written = 0
+    with open(fileName, mode='w', encoding='utf-8') as f:
+        while written < size:
+            words = vocabulary[rng.choice(len(vocabulary), size=blockSize, p=probabilities)]
+            draws = rng.random(blockSize)
+            text = []
+            capital = True
+            for word, draw in zip(words, draws):
+                if capital:
+                    word = word.capitalize()
+                    capital = False
+                if draw < 0.01:
+                    word = str(int(draw * 100000) + 1900)
+                elif draw < 0.02:
+                    word = u'„' + word + u'”'
+                elif draw < 0.07:
+                    word += ','
+                elif draw < 0.14:
+                    word += '.'
+                    capital = True
+                text.append(word)
+                if capital and draw < 0.09:
+                    text.append('\n')
+            block = ' '.join(text).replace('\n ', '\n') + ' '
+            if written + len(block) > size:
+                # Stop at the last word fitting in the requested size
+                block = block[:block.rfind(' ', 0, size - written) + 1] or block
+            f.write(block)
+            written += len(block.encode('utf-8'))
+
+
+# ---------------------------------------------------------------------
+# A function to time a function call and to measure its peak memory
+# (in a separate run, since tracemalloc slows the code down)
+# ---------------------------------------------------------------------
+def measure(function, *args, repeat=1, memory=True, **kwargs):
+    """
+    :return: (result of the last run, best wall time in seconds, peak memory allocated in bytes or None)
+    """
+    result, seconds = timeIt(function, *args, repeat=repeat, **kwargs)
+    peak = None
+    if memory:
+        result = None
+        tracemalloc.start()
+        try:
+            result = function(*args, **kwargs)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result, seconds, peak
+
+
+def copyCorpus(corpus):
+    """
+    :return: a copy of the EncodedCorpus (findCollocations adds the collocations to its vocabulary)
+    """
+    return EncodedCorpus(corpus.vocabulary, array('I', corpus.ids))
+
+
+def compressCorpus(corpus, compression):
+    """ Compress a copy of the corpus (reused if present)
+    :param compression: gzip, bz2 or xz
+    :return: the compressed file name
+    """
+    fileName = corpus + {'gzip': '.gz', 'bz2': '.bz2', 'xz': '.xz'}[compression]
+    if not os.path.exists(fileName):
+        module = {'gzip': gzip, 'bz2': bz2, 'xz': lzma}[compression]
+        with open(corpus, mode='rb') as source, module.open(fileName + '.tmp', mode='wb') as target:
+            while True:
+                block = source.read(ctChunkSize)
+                if not block:
+                    break
+                target.write(block)
+        os.replace(fileName + '.tmp', fileName)
+    return fileName
+
+
+def corpusSize(words):
+    """
+    :return: number of words of a corpus, or of entries of a dictionary
+    """
+    return len(words) if words is not None else 0
+
+
+# --------------------------------------------------------------------------------------------------
+# Time and memory-profile every stage of the pipeline on a corpus file
+# --------------------------------------------------------------------------------------------------
+def benchmarkStages(corpus, language, stopwords, lexicon, repeat=1, memory=True, methods=(0, 1, 2, 3),
+                    maxSlowWords=20000, compressions=()):
+    """
+    :param corpus: Corpus of text, as txt file
+    :param language: stemmer language (english, romanian)
+    :param stopwords: Stopwords file
+    :param lexicon: Lexicon, as csv file
+    :param methods: the bigramMethods of findCollocations to benchmark
+    :param maxSlowWords: REGEX and FULL SCAN are skipped on corpora with more words than this
+    :param compressions: the corpus is also loaded compressed with these (gzip, bz2, xz)
+    :return: list of records (stage, seconds, peak memory, items in / out)
+    """
+    records = []
+
+    def stage(name, function, *args, items=None, **kwargs):
+        logging.info('Benchmarking %s on %s...', name, corpus)
+        record = collections.OrderedDict([('corpus', corpus), ('bytes', os.path.getsize(corpus)), ('stage', name),
+                                          ('seconds', None), ('peakMemory', None), ('itemsIn', items), ('itemsOut', 0)])
+        records.append(record)
+        logging.disable(logging.INFO)
+        try:
+            result, record['seconds'], record['peakMemory'] = measure(function, *args, repeat=repeat, memory=memory,
+                                                                      **kwargs)
+        except Exception as e:
+            logging.disable(logging.NOTSET)
+            logging.info(repr(e))
+            record['error'] = repr(e)
+            return None
+        finally:
+            logging.disable(logging.NOTSET)
+        seconds, peak = record['seconds'], record['peakMemory']
+        record['itemsOut'] = corpusSize(result)
+        logging.info('%-25s %10.3fs %12s bytes %12s -> %s items', name, seconds,
+                     '{:,}'.format(peak) if peak is not None else '-', '{:,}'.format(items or 0),
+                     '{:,}'.format(record['itemsOut']))
+        return result
+
+    size = os.path.getsize(corpus)
+    stage('loadWords', loadWords, corpus, items=size)
+    words = stage('loadWords (stream, encoded)', lambda: encodeWords(loadWords(corpus, stream=True)), items=size)
+    for compression in compressions:
+        compressed = compressCorpus(corpus, compression)
+        stage('loadWords (stream, encoded, %s)' % compression,
+              lambda: encodeWords(loadWords(compressed, stream=True)), items=os.path.getsize(compressed))
+    stopwordSet = loadStopwords(stopwords)
+    filtered = stage('removeStopwords', removeStopwords, words, stopwordSet, items=len(words))
+    stage('loadWords (stream, encoded, stopwords)',
+          lambda: encodeWords(loadWords(corpus, stream=True, stopwords=stopwordSet)), items=size)
+    preprocessed = stage('preProcess', preProcess, filtered, items=len(filtered))
+    stemmed = stage('doStemming', doStemming, preprocessed, language=language, items=len(preprocessed))
+    for method in methods:
+        if method in (1, 2) and len(stemmed) > maxSlowWords:
+            logging.info('findCollocations (method %s) skipped: %s words > %s', method,
+                         '{:,}'.format(len(stemmed)), '{:,}'.format(maxSlowWords))
+            continue
+        stage('findCollocations (method %s)' % method,
+              lambda: findCollocations(copyCorpus(stemmed), method), items=len(stemmed))
+    stage('buildDictionary', buildDictionary, stemmed, items=len(stemmed))
+    matcher = LexiconMatcher(loadLexicon(lexicon), ctExcluded)
+    stage('scoreSentiment', lambda: scoreSentiment(corpus, matcher=LexiconMatcher(matcher.lexicon, ctExcluded))[0],
+          items=size)
+    return records
+
+
+# --------------------------------------------------------
+# Here we go - this is where the actual execution starts !
+# --------------------------------------------------------
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the stages of the pipeline (time and peak memory), '
+                                                 'on a corpus file or on generated corpora of several sizes')
+    parser.add_argument('corpus', nargs='?', default=None, help='corpus file (default: generated corpora)')
+    parser.add_argument('--sizes', default='1MB,10MB', help='sizes of the generated corpora, e.g. 1MB,10MB,100MB,1GB')
+    parser.add_argument('--language', choices=['ro', 'en'], default='ro', help='language of the generated corpora')
+    parser.add_argument('--folder', default='benchmarks', help='folder of the generated corpora (reused if present)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the corpus generator')
+    parser.add_argument('--methods', default='0,1,2,3', help='bigramMethods of findCollocations to benchmark')
+    parser.add_argument('--max-slow-words', type=int, default=20000,
+                        help='REGEX and FULL SCAN are skipped on corpora with more words than this')
+    parser.add_argument('--repeat', type=int, default=1, help='runs per stage (the best time is kept)')
+    parser.add_argument('--no-memory', action='store_true', help='do not measure the peak memory (tracemalloc)')
+    parser.add_argument('--stopwords', default='stopwords.txt', help='stopwords file')
+    parser.add_argument('--lexicon', default='lexicon.csv', help='sentiment lexicon file')
+    parser.add_argument('--compressed', default='',
+                        help='also load the corpus compressed with these, e.g. gzip,bz2,xz (compressed next to it)')
+    parser.add_argument('--output', default='benchmarks.json', help='JSON file with the results')
+    parser.add_argument('--compare', action='store_true',
+                        help='also compare preProcess with the legacy pre-processing, the stopwords removal with '
+                             'the legacy list scan, the bi-grams with NLTK and the sentences loaded in parallel '
+                             'with the sentences loaded by one process')
+    parser.add_argument('--words', type=int, default=1000000, help='size of the synthetic corpus of --compare, in words')
+    args = parser.parse_args()
+
+    language = 'romanian' if args.language == 'ro' else 'english'
+    corpora = [args.corpus] if args.corpus else []
+    if not corpora:
+        if not os.path.exists(args.folder):
+            os.makedirs(args.folder)
+        for size in args.sizes.split(','):
+            fileName = os.path.join(args.folder, 'corpus_%s_%s_%s.txt' % (args.language, size.strip(), args.seed))
+            if not os.path.exists(fileName):
+                generateCorpus(fileName, parseSize(size), args.language, args.seed)
+            corpora.append(fileName)
+
+    records = []
+    for corpus in corpora:
+        records += benchmarkStages(corpus, language, args.stopwords, args.lexicon, repeat=args.repeat,
+                                   memory=not args.no_memory,
+                                   methods=[int(method) for method in args.methods.split(',')],
+                                   maxSlowWords=args.max_slow_words,
+                                   compressions=[compression for compression in args.compressed.split(',')
+                                                 if compression])
+
+    report = collections.OrderedDict([('python', platform.python_version()), ('platform', platform.platform()),
+                                      ('processor', platform.processor()), ('cpus', os.cpu_count()),
+                                      ('time', time.strftime('%Y-%m-%d %H:%M:%S')), ('seed', args.seed),
+                                      ('records', records)])
+    with open(args.output, mode='w', encoding='utf-8') as f:
+        json.dump(report, f, indent=1)
+    logging.info('Results saved to file %s', args.output)
+
+    if args.compare:
+        words = loadWords(args.corpus) if args.corpus else []
+        if not words:
+            random.seed(0)
+            words = random.choices(ctSampleWords, k=args.words)
+            logging.info('Using a synthetic corpus of %s words', '{:,}'.format(len(words)))
+
+        benchmarkPreProcess(words)
+        benchmarkStopwords(words, args.stopwords, corpora[0])
+        benchmarkBigrams(words)
+        benchmarkSentences(corpora[0])
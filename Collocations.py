@@ -11,96 +11,93 @@ from Functions import *
 # --------------------------------------------------------
 
 # Let's ask our user to supply the corpus file name
+# (only in the main process: the worker processes loading the sentences and counting the bi-grams
+# in parallel import this file too)
 corpus = None
-corpus = stringOption('Corpus file? [corpus.txt]: ', None, 'corpus.txt')
+if __name__ == '__main__':
+    corpus = stringOption('Corpus file, folder, pattern (e.g. news/*.txt) or manifest? [corpus.txt]: ',
+                          None, 'corpus.txt')
 if corpus:
 
-    # Let's load the individual words in memory
-    words = []
-    words = loadWords(corpus)
-    if words:
-
-        # Do we want to remove stopwords?
-        flagRemoveStopWords = boolOption('Do you want to remove the stopwords from corpus? ')
-        if flagRemoveStopWords == 1:
-
-            # Let's ask our user to supply the stopwords file name
-            stopWordsFile = None
-            stopWordsFile = stringOption('Stopwords file? [stopwords.txt]: ', None, 'stopwords.txt')
-            if stopWordsFile:
-
-                # Load the stopwords from the provided file
-                stopwords = None
-                stopwords = loadWords(stopWordsFile)
-                if stopwords:
-                    # Remove the stopwords from the original corpus
-                    words = removeStopwords(words, stopwords)
-
-        # Do we want to apply the general pre-processing? (convert all to lowercase,
-        # remove unicode characters, remove diacritics, remove punctuation, remove digits?)
-        flagPreProcess = boolOption('Do you want to pre-process text (convert to lowercase, '
-                                    'remove unicode characters, remove diacritics, remove punctuation, remove digits) ? ')
-        if flagPreProcess == 1:
-            words = preProcess(words)
-
-        # Do we want to apply stemming?
-        flagApplyStemming = boolOption('Do you want to apply stemming (remove morphological affixes) on corpus ? ')
-        if flagApplyStemming == 1:
-            # Apply the Snowball stemmer
-            words = doStemming(words)
-
-        # Which method to apply collocations ?
-        bigramMethod = -1
-        while bigramMethod not in [0, 1, 2]:
-            bigramMethod = int_option('Which method to apply collocations to corpus ? '
-                                      '(0=''DICTIONARY'', 1=''REGEX'', 2=''FULL SCAN'' (default 0) ')
-        flagProceed = 1
-        if bigramMethod in [1, 2]:
-            flagProceed = boolOption('This method is VERY slow and it will take a long time on '
-                                     'large corpora of text. Are you sure you want to proceed? ')
-
-        if flagProceed == 1:
-
-            # Results
-            results = {}
-
-            for i in range(10):
-
-                results[i] = []
-                logging.info('FINDING COLLOCATIONS ----> STEP %s' % (i + 1))
-
-                # Now let's find collocations
-                words = findCollocations(words, bigramMethod)
-
-                # Save the new text, after applying the bi-grams found in this step
-                # saveToFile(text=' '.join(words),
-                saveToFile(text=words,
-                           folderName=corpus.split('.')[0],
-                           fileName=corpus.split('.')[0] + '_step_' + str(i + 1),
-                           suffix='')
-
-                # collocations = [word for word in words if word.count('_') == i+1]
-                collocations = [word for word in words if word.count('_') > 0]
-
-                # Now let's find the relative frequencies
-                dictionary = None
-                dictionary = buildDictionary(collocations, freqType=1)
-                if dictionary:
-                    results[i] = [len([word[0] for word in dictionary.most_common() if word[0].count('_') == j + 1]) for
-                                  j in range(10)]
-                    results[i].append([len([word[0] for word in dictionary.most_common() if word[0].count('_') > 10])])
-
-                    # Let's display the 100 most frequent words
-                    showMostFrequent(dictionary, 100, type=1)
-
-                    # Let's save the dictionary to disk
-                    # We create a new folder named after the corpus and store the resulting files there
-                    saveToCSVFile(text='\n'.join('%s\t%s' % word for word in dictionary.most_common()),
-                                  # saveToFile(text=[word for word in dictionary.most_common()],
-                                  folderName=corpus.split('.')[0],
-                                  fileName=corpus.split('.')[0] + '_collocations_step_' + str(i + 1),
-                                  suffix='')
-
-            logging.info('========== SUMMARY ==========')
-            for i in range(10):
-                logging.info('Step %s: \t%s' % (i + 1, results[i]))
+    # Do we want to remove stopwords?
+    stopWordsFile = None
+    flagRemoveStopWords = boolOption('Do you want to remove the stopwords from corpus? ')
+    if flagRemoveStopWords == 1:
+
+        # Let's ask our user to supply the stopwords file name
+        stopWordsFile = stringOption('Stopwords file? [stopwords.txt]: ', None, 'stopwords.txt')
+
+    # Do we want to apply the general pre-processing? (convert all to lowercase,
+    # remove unicode characters, remove diacritics, remove punctuation, remove digits?)
+    flagPreProcess = boolOption('Do you want to pre-process text (convert to lowercase, '
+                                'remove unicode characters, remove diacritics, remove punctuation, remove digits) ? ')
+
+    # Do we want to apply stemming?
+    # (the Snowball stemmer: the stems are cached on disk and reused by the next runs)
+    flagApplyStemming = boolOption('Do you want to apply stemming (remove morphological affixes) on corpus ? ')
+    stemCacheSize = ctStemCacheSize
+    if flagApplyStemming == 1:
+        stemCacheSize = int_option('Maximum number of cached stems ? (default {:,}) '.format(ctStemCacheSize),
+                                   ctStemCacheSize)
+
+    # Which method to apply collocations ?
+    bigramMethod = -1
+    while bigramMethod not in [0, 1, 2, 3]:
+        bigramMethod = int_option('Which method to apply collocations to corpus ? '
+                                  '(0=''DICTIONARY'', 1=''REGEX'', 2=''FULL SCAN'', '
+                                  '3=''RANKED MERGE'' (same as FULL SCAN, fast) (default 0) ')
+
+    # Do we want the bi-grams within sentences only ? (the sentences are loaded, and the bi-grams counted,
+    # by several processes in parallel)
+    flagSentences = 0
+    processes = 0
+    if bigramMethod in [0, 3]:
+        flagSentences = boolOption('Do you want to find the collocations within sentences only ? ')
+        processes = int_option('How many processes ? (default 0 = none) ', 0)
+
+    # How many bi-grams to select at every step ?
+    topK = int_option('Maximum number of bi-grams applied at every step ? (default all) ', ctTopBigrams)
+    minPMI = float_option('Minimum PMI of a bi-gram ? (default none) ', None)
+    minCount = int_option('Minimum frequency of a bi-gram ? (default 2) ', 2)
+
+    # When do we stop ? (after a maximum number of steps, or as soon as a step finds no new collocations,
+    # or when the share of new collocations found by a step drops below a threshold)
+    maxSteps = int_option('Maximum number of steps ? (default 10) ', 10)
+    minGain = float_option('Minimum share of new collocations for going on to the next step ? (default 0) ', 0.0)
+
+    # The text of every step is always saved as word ids (binary): do we also want it as text ?
+    textOutput = int_option('Do you also want the text of every step ? '
+                            '(0 = no, binary only, 1 = text, 2 = compressed text) (default 0) ', 0)
+
+    flagProceed = 1
+    if bigramMethod in [1, 2]:
+        flagProceed = boolOption('This method is VERY slow and it will take a long time on '
+                                 'large corpora of text. Are you sure you want to proceed? ')
+
+    if flagProceed == 1:
+
+        # Every stage is measured (RELATIVEFREQ_MEMORY=1 also measures its peak memory), and one stage can be
+        # profiled (RELATIVEFREQ_PROFILE=stage for cProfile, or stage:line for line_profiler)
+        resources = PipelineResources(instrumentation=environmentInstrumentation(), stemCacheSize=stemCacheSize)
+
+        # Now let's find collocations, step after step: the text of every step and its collocations
+        # are saved in a new folder named after the corpus
+        runCollocations(corpus,
+                        resources=resources,
+                        stopwords=stopWordsFile,
+                        preprocess=flagPreProcess == 1,
+                        stemming=flagApplyStemming == 1,
+                        bigramMethod=bigramMethod,
+                        topK=topK,
+                        minPMI=minPMI,
+                        minCount=minCount,
+                        maxSteps=maxSteps,
+                        minGain=minGain,
+                        textOutput=textOutput,
+                        sentences=flagSentences == 1,
+                        processes=processes)
+
+        # Let's display the time and memory of every stage, and save them (and the profile) next to the results
+        reportRun(resources.instrumentation,
+                  folderName=corpusName(corpus),
+                  fileName=os.path.basename(corpusName(corpus)) + '_collocations')
@@ -1,20 +1,71 @@
 # First, import the python libraries we're going to use
-import logging, os, collections, sys, re, csv
+import logging, os, collections, sys, re, csv, itertools, random, pickle, multiprocessing, heapq, time, json, hashlib, glob, struct, gzip, io, mmap, fnmatch
+import collections.abc, contextlib, tracemalloc, cProfile, pstats, bz2, lzma, threading, queue, concurrent.futures
+from array import array
 import regex
+import numpy as np
 # import gensim
-from nltk import tokenize, collocations, stem
+from nltk import tokenize, stem
 from langdetect import detect
 
-# import line_profiler
-# import atexit
-# profile = line_profiler.LineProfiler()
-# atexit.register(profile.print_stats)
+
+# Optional: the peak RSS and the CPU time of the child processes (not available on Windows)
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Optional: line-level profiling of a stage (pip install line_profiler)
+try:
+    import line_profiler
+except ImportError:
+    line_profiler = None
 
 # Constants
 ctPunctuationTokens = ['.', '..', '...', ',', ';', ':', '(', ')', '"', '\'', '[', ']', '{', '}',
                        '?', '!', '-', u'–', '+', '*', '--', '\'\'', '``']
 ctPunctuation = '?.!/;:()&+%'
 ctDigits = '0123456789'
+ctUnicodePunctuationTable = dict.fromkeys(map(ord, u'”’…„“,'), ' ')
+ctDiacriticsTable = str.maketrans(u'țăîșâţşà', 'taisatsa')
+ctNormalizerCacheSize = 1000000
+ctWordRegex = re.compile(r'\w+')
+ctSentenceRegex = re.compile(r'(\w+)|[.!?…]+(?=["”’»)\]]*(?:\s|$))|\n[ \t\r\f\v]*\n')
+ctSentenceBoundary = '</s>'
+ctWordStartRegex = re.compile(r'\b\w')
+ctRegexSpecials = '.^$*+?{}[]\\|()'
+ctSpanningRegex = re.compile(r'\?|\[\^|\s')
+ctChunkSize = 4 * 1024 * 1024
+ctWhitespaceBytes = b' \n\t\r\f\v'
+ctLineEndBytes = b'\n\r'
+ctCompressionMagic = collections.OrderedDict([('gzip', b'\x1f\x8b'), ('bz2', b'BZh'), ('xz', b'\xfd7zXZ\x00')])
+ctReadAheadBlocks = 4
+ctCorpusPatterns = ['*.txt', '*.txt.gz', '*.txt.bz2', '*.txt.xz']
+ctManifestSuffixes = ('.manifest', '.lst')
+ctReaderThreads = 8
+ctBatchSize = 4 * 1024 * 1024
+ctLanguageSampleSize = 10000
+ctTopBigrams = 10000000
+ctIncrementalRatio = 0.02
+ctCacheFolder = '.cache'
+ctStemCacheFolder = os.path.join(ctCacheFolder, 'stems')
+ctStemCacheSize = 1000000
+ctLexiconCacheFolder = os.path.join(ctCacheFolder, 'lexicon')
+ctLexiconCacheVersion = 1
+ctStageCacheFolder = os.path.join(ctCacheFolder, 'stages')
+ctStageCacheSize = 1024 * 1024 * 1024
+ctEncodedCorpusHeader = struct.Struct('<4sIIQ')
+ctEncodedCorpusMagic = b'RFEC'
+ctEncodedCorpusVersion = 1
+ctWriteBlockSize = 65536
+ctCSVBufferSize = 1024 * 1024
+ctFrequencyIndexHeader = struct.Struct('<4sIQQ')
+ctFrequencyIndexMagic = b'RFFI'
+ctFrequencyIndexVersion = 1
+ctProfileLines = 50
+ctProfileVariable = 'RELATIVEFREQ_PROFILE'
+ctMemoryVariable = 'RELATIVEFREQ_MEMORY'
+ctStageColumns = ['task', 'corpus', 'stage', 'itemsIn', 'itemsOut', 'seconds', 'cpuSeconds', 'peakMemory', 'peakRSS']
 ctLanguages = {
     'de': 'german',
     'en': 'english',
@@ -47,10 +98,13 @@ def loadCorpus(fileName):
     if fileName:
         logging.info("Loading corpus...")
         try:
-            text = open(fileName, mode='r', encoding='utf-8').read().lower()
+            text = readText(fileName)
+            # The size of the text (decompressed), not of the file
+            size = len(text.encode('utf-8')) if detectCompression(fileName) else os.path.getsize(fileName)
+            text = text.lower()
             logging.info("Corpus loaded from file %s [%0.3f Mb].",
                          fileName,
-                         os.path.getsize(fileName) / (1024 * 1024))
+                         size / (1024 * 1024))
         except Exception as e:
             logging.info(repr(e))
     else:
@@ -59,28 +113,50 @@ def loadCorpus(fileName):
 
 
 # --------------------------------------------------------------------------------------------------
-# A function to load all sentences from a text file (any text file)
-# We'll use it for loading in memory all sentences from the supplied corpus
+# A generator yielding the sentences of a text file (any text file), one chunk of text at a time
+# A sentence ends with . ! ? or … followed by whitespace (closing quotes and brackets may come between them),
+# or with an empty line. We'll use it for counting the bi-grams within sentences only (see loadSentenceCorpus)
 # --------------------------------------------------------------------------------------------------
-def loadSentences(fileName):
+def loadSentences(fileName, start=0, end=None, chunkSize=ctChunkSize):
     """ Split corpus in sentences
     :param fileName: File containing corpus body
-    :return:
+    :param start: first byte read (see shardFile)
+    :param end: byte at which the reading stops (None = end of file)
+    :param chunkSize: Number of bytes read from disk at once
+    :return: generator of sentences (lists of words, in lowercase); the last one may be incomplete,
+             if the text does not end with a sentence end
     """
-    originalSentences = list()
     if fileName:
-        logging.info("Loading corpus sentences...")
+        sentence = []
+        numSentences = 0
         try:
-            originalSentences = tokenize.sent_tokenize(
-                text=open(fileName, mode='r', encoding='utf-8').read().lower(), language='english')
-            logging.info("%s sentences loaded from file %s [%0.3f Mb].",
-                         '{:,}'.format(len(originalSentences)), fileName,
-                         os.path.getsize(fileName) / (1024 * 1024))
+            # A chunk (or a shard) may start on the second line end of an empty line: the line end before it
+            # is added back in front of it, so that the empty line is still found
+            lineEnd = False
+            if start and not detectCompression(fileName):
+                with open(fileName, mode='rb') as f:
+                    f.seek(start - 1)
+                    lineEnd = f.read(1) in ctLineEndBytes
+            for chunk in streamText(fileName, chunkSize, start, end, separators=ctLineEndBytes):
+                text = '\n' + chunk.lower() if lineEnd else chunk.lower()
+                lineEnd = chunk.endswith('\n')
+                for match in ctSentenceRegex.finditer(text):
+                    word = match.group(1)
+                    if word:
+                        sentence.append(word)
+                    elif sentence:
+                        numSentences += 1
+                        yield sentence
+                        sentence = []
+            if sentence:
+                numSentences += 1
+                yield sentence
+            logging.info("%s sentences loaded from file %s [%0.3f Mb].", '{:,}'.format(numSentences), fileName,
+                         ((os.path.getsize(fileName) if end is None else end) - start) / (1024 * 1024))
         except Exception as e:
             logging.info(repr(e))
     else:
         logging.info("Please provide a corpus file.")
-    return originalSentences
 
 
 # # -------------------------------------------------------------------
@@ -92,21 +168,358 @@ def loadSentences(fileName):
 #         yield (gensim.utils.simple_preprocess(str(sentence), min_len=1, max_len=100, deacc=False))  # deacc=True removes punctuations
 
 
+# --------------------------------------------------------------------------------------------------
+# The functions to read a compressed corpus (gzip, bz2 or xz, detected by its first bytes), decompressing it
+# on the fly: a background thread reads and decompresses the next blocks while the current one is tokenized
+# (zlib, bz2 and lzma release the GIL while they decompress), so the text never goes to disk
+# --------------------------------------------------------------------------------------------------
+def detectCompression(fileName):
+    """
+    :param fileName: File containing corpus body
+    :return: 'gzip', 'bz2', 'xz', or None if the file is not compressed
+    """
+    with open(fileName, mode='rb') as f:
+        head = f.read(max(map(len, ctCompressionMagic.values())))
+    for compression, magic in ctCompressionMagic.items():
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+def openCompressed(f, compression):
+    """
+    :param f: compressed binary file
+    :param compression: 'gzip', 'bz2' or 'xz'
+    :return: binary file of the decompressed bytes
+    """
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=f, mode='rb')
+    if compression == 'bz2':
+        return bz2.BZ2File(f, mode='rb')
+    return lzma.LZMAFile(f, mode='rb')
+
+
+def readAhead(blocks, depth=ctReadAheadBlocks):
+    """ Run a generator in a background thread, at most a few items ahead of its consumer
+    :param blocks: generator (e.g. of decompressed blocks)
+    :param depth: maximum number of items waiting for the consumer
+    :return: generator of the same items (an exception of the thread is raised again here)
+    """
+    items = queue.Queue(depth)
+    stop = threading.Event()
+    end = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for block in blocks:
+                if not put(block):
+                    return
+            put(end)
+        except Exception as e:
+            put(e)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is end:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # The consumer may stop early: the thread stops at its next block
+        stop.set()
+        thread.join()
+
+
+def decompressBlocks(fileName, compression, blockSize=ctChunkSize, start=0, end=None):
+    """
+    :param fileName: compressed file
+    :param compression: 'gzip', 'bz2' or 'xz'
+    :param blockSize: Number of decompressed bytes per block
+    :param start: first decompressed byte returned
+    :param end: decompressed byte at which reading stops (None = end of file)
+    :return: generator of blocks of decompressed bytes
+    """
+    statistics = {'compressed': 0, 'decompressed': 0, 'readerSeconds': 0.0}
+
+    def read():
+        with open(fileName, mode='rb') as raw, openCompressed(raw, compression) as f:
+            while True:
+                begin = time.perf_counter()
+                block = f.read(blockSize)
+                statistics['readerSeconds'] += time.perf_counter() - begin
+                statistics['compressed'] = raw.tell()
+                if not block:
+                    break
+                yield block
+
+    begin = time.perf_counter()
+    position = 0
+    for block in readAhead(read()):
+        blockStart = position
+        position += len(block)
+        if position <= start:
+            continue
+        block = block[max(start - blockStart, 0):]
+        if end is not None and position >= end:
+            block = block[:len(block) - (position - end)]
+        statistics['decompressed'] += len(block)
+        yield block
+        if end is not None and position >= end:
+            break
+
+    # Throughput of the compressed file, and of the text (the wall time includes the tokenization,
+    # the reader time is the time spent reading and decompressing, in the background thread)
+    seconds = max(time.perf_counter() - begin, 1e-9)
+    logging.info("Decompressed %s (%s): %0.3f Mb compressed (%0.1f Mb/s) -> %0.3f Mb of text (%0.1f Mb/s), "
+                 "%.3fs, reader busy %.3fs.", fileName, compression, statistics['compressed'] / (1024 * 1024),
+                 statistics['compressed'] / (1024 * 1024) / seconds, statistics['decompressed'] / (1024 * 1024),
+                 statistics['decompressed'] / (1024 * 1024) / seconds, seconds, statistics['readerSeconds'])
+
+
+# --------------------------------------------------------------------------------------------------
+# A function to read a text file in fixed-size buffered chunks (any text file, compressed or not)
+# Every chunk ends on a whitespace character, so no token is ever split between two chunks
+# --------------------------------------------------------------------------------------------------
+def readBlocks(fileName, blockSize=ctChunkSize, start=0, end=None):
+    """
+    :return: generator of blocks of bytes of the byte range [start, end) of a file (see streamText)
+    """
+    with open(fileName, mode='rb') as f:
+        f.seek(start)
+        remaining = (os.path.getsize(fileName) if end is None else end) - start
+        while remaining > 0:
+            block = f.read(min(blockSize, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            yield block
+
+
+def streamText(fileName, chunkSize=ctChunkSize, start=0, end=None, separators=ctWhitespaceBytes):
+    """ Read a text file (or a byte range of it) in chunks which always end on whitespace
+    :param fileName: File containing corpus body (a compressed file is decompressed on the fly,
+                     and its byte range is then a range of the decompressed text)
+    :param chunkSize: Number of bytes read from disk at once
+    :param start: first byte to read (must be the start of a token, see shardFile)
+    :param end: byte at which reading stops (None = end of file)
+    :param separators: ASCII characters after which a chunk may end (e.g. ctLineEndBytes for whole lines);
+                       if none of them occurs in chunkSize bytes, the chunk ends on any whitespace
+    :return: generator of text chunks, with the line ends ('\r\n', '\r') turned into '\n', as in text mode
+    """
+    compression = detectCompression(fileName)
+    if compression:
+        blocks = decompressBlocks(fileName, compression, chunkSize, start, end)
+    else:
+        blocks = readBlocks(fileName, chunkSize, start, end)
+    # The bytes after the last cut, not yielded yet (they hold no separator: only the new block is searched)
+    carry = []
+    carrySize = 0
+    # A '\r\n' cut between two chunks is a single line end
+    lineEnd = False
+    for block in blocks:
+        # Cut after the last separator; the trailing (possibly incomplete) token or line goes to the next chunk
+        # (ASCII whitespace bytes never occur inside a multi-byte UTF-8 character)
+        cut = max(block.rfind(c) for c in separators) + 1
+        if cut == 0 and carrySize + len(block) >= chunkSize:
+            cut = max(block.rfind(c) for c in ctWhitespaceBytes) + 1
+        if cut == 0:
+            carry.append(block)
+            carrySize += len(block)
+            continue
+        carry.append(block[:cut])
+        text = b''.join(carry).decode('utf-8')
+        if lineEnd and text.startswith('\n'):
+            text = text[1:]
+        if text:
+            lineEnd = text.endswith('\r')
+            yield text.replace('\r\n', '\n').replace('\r', '\n')
+        carry = [block[cut:]]
+        carrySize = len(block) - cut
+    if carrySize:
+        text = b''.join(carry).decode('utf-8')
+        if lineEnd and text.startswith('\n'):
+            text = text[1:]
+        if text:
+            yield text.replace('\r\n', '\n').replace('\r', '\n')
+
+
+# --------------------------------------------------------------------------------------------------
+# A function to read a whole text file (compressed or not)
+# --------------------------------------------------------------------------------------------------
+def readText(fileName):
+    """
+    :param fileName: File containing corpus body
+    :return: the text of the file, with the line ends turned into '\n' (text mode, or see streamText)
+    """
+    if detectCompression(fileName):
+        return ''.join(streamText(fileName))
+    with open(fileName, mode='r', encoding='utf-8') as f:
+        return f.read()
+
+
+# --------------------------------------------------------------------------------------------------
+# A function to split a text file in byte ranges (shards) which start and end on token boundaries
+# We'll use it to process the shards of a large corpus in parallel
+# --------------------------------------------------------------------------------------------------
+def shardFile(fileName, numShards, separators=ctWhitespaceBytes):
+    """
+    :param fileName: File containing corpus body
+    :param numShards: Number of shards wanted
+    :param separators: the bytes on which a shard may end (default: whitespace)
+    :return: list of (start, end) byte ranges, each one ending right after a separator
+             (a compressed file has no random access: it is a single shard, (0, None))
+    """
+    if detectCompression(fileName):
+        return [(0, None)]
+    size = os.path.getsize(fileName)
+    bounds = [0]
+    with open(fileName, mode='rb') as f:
+        for k in range(1, numShards):
+            position = max(size * k // numShards, bounds[-1])
+            f.seek(position)
+            while position < size:
+                block = f.read(64 * 1024)
+                cuts = [block.find(c) for c in separators]
+                cuts = [cut for cut in cuts if cut >= 0]
+                if cuts:
+                    position += min(cuts) + 1
+                    break
+                position += len(block)
+            if position >= size:
+                break
+            if position > bounds[-1]:
+                bounds.append(position)
+    bounds.append(size)
+    return [(bounds[k], bounds[k + 1]) for k in range(len(bounds) - 1) if bounds[k + 1] > bounds[k]]
+
+
+# --------------------------------------------------------------------------------------------------
+# A generator yielding the individual words from a text file, one chunk of text at a time
+# We'll use it for corpora which are too large to be loaded in memory at once
+# --------------------------------------------------------------------------------------------------
+def streamWords(fileName, chunkSize=ctChunkSize, stopwords=None):
+    """
+    :param fileName: Corpus of text, as txt file
+    :param chunkSize: Number of bytes read from disk at once
+    :param stopwords: set of stopwords, dropped as they are read (None = keep all the words)
+    :return: generator of words
+    """
+    numWords = 0
+    try:
+        if stopwords:
+            # The stopwords are dropped here, instead of filtering the stream (or a list) afterwards
+            numStopwords = 0
+            for chunk in streamText(fileName, chunkSize):
+                for match in ctWordRegex.finditer(chunk.lower()):
+                    word = match.group()
+                    if word in stopwords:
+                        numStopwords += 1
+                    else:
+                        numWords += 1
+                        yield word
+            logging.info("%s words streamed (%s stopwords removed)...",
+                         '{:,}'.format(numWords), '{:,}'.format(numStopwords))
+            return
+        for chunk in streamText(fileName, chunkSize):
+            for match in ctWordRegex.finditer(chunk.lower()):
+                numWords += 1
+                yield match.group()
+        logging.info("%s words streamed...", '{:,}'.format(numWords))
+    except Exception as e:
+        logging.info(repr(e))
+
+
+# --------------------------------------------------------------------------------------------------
+# Functions to count the words of a text file with a pool of processes
+# The file is split in shards, every shard is counted by a process, then the Counters are merged
+# --------------------------------------------------------------------------------------------------
+def countShard(shard):
+    """
+    :param shard: (fileName, start, end)
+    :return: Counter of the words in the byte range [start, end) of the file
+    """
+    fileName, start, end = shard
+    counts = collections.Counter()
+    for chunk in streamText(fileName, start=start, end=end):
+        counts.update(ctWordRegex.findall(chunk.lower()))
+    return counts
+
+
+def countChunk(chunk):
+    """
+    :param chunk: text
+    :return: Counter of the words of the text
+    """
+    return collections.Counter(ctWordRegex.findall(chunk.lower()))
+
+
+def countWordsParallel(fileName, processes=None, shardsPerProcess=4):
+    """
+    :param fileName: Corpus of text, as txt file
+    :param processes: Number of processes (None = number of CPUs)
+    :param shardsPerProcess: Number of shards per process, for balancing the load
+    :return: Counter of words -> absolute frequency
+    """
+    counts = collections.Counter()
+    if fileName and os.path.exists(fileName):
+        processes = processes or os.cpu_count() or 1
+        if detectCompression(fileName):
+            # A compressed file cannot be split in shards: it is decompressed here (see streamText),
+            # and its chunks are counted by the processes
+            function, tasks = countChunk, streamText(fileName)
+            logging.info("Counting words from compressed file %s [%0.3f Mb] by chunks, with %s processes.",
+                         fileName, os.path.getsize(fileName) / (1024 * 1024), processes)
+        else:
+            shards = shardFile(fileName, processes * shardsPerProcess)
+            function, tasks = countShard, [(fileName, start, end) for start, end in shards]
+            logging.info("Counting words from file %s [%0.3f Mb] in %s shards, with %s processes.",
+                         fileName, os.path.getsize(fileName) / (1024 * 1024), len(shards), processes)
+        try:
+            with multiprocessing.Pool(processes) as pool:
+                for shardCounts in pool.imap_unordered(function, tasks):
+                    counts.update(shardCounts)
+            logging.info("%s words counted, %s distinct words.",
+                         '{:,}'.format(sum(counts.values())), '{:,}'.format(len(counts)))
+        except Exception as e:
+            logging.info(repr(e))
+    else:
+        logging.info("Please provide a valid file name.")
+    return counts
+
+
 # --------------------------------------------------------------------------------------------------
 # A function to load all individual words from a text file (any text file)
 # We'll use it for loading in memory all words from the supplied corpus or from the stopwords file
 # --------------------------------------------------------------------------------------------------
-def loadWords(fileName):
+def loadWords(fileName, stream=False, chunkSize=ctChunkSize, stopwords=None):
     """
     :param fileName: Corpus of text, as txt file
+    :param stream: return a generator reading the file in chunks, instead of a list? (True/False, default = False)
+    :param chunkSize: Number of bytes read from disk at once (only used when streaming)
+    :param stopwords: set of stopwords, dropped while streaming (only used when streaming, see loadStopwords)
     :return: iterable of words
     """
     words = []
     if fileName and os.path.exists(fileName):
         logging.info("Loading words from file %s [%0.3f Mb].", fileName, os.path.getsize(fileName) / (1024 * 1024))
+        if stream:
+            return streamWords(fileName, chunkSize, stopwords)
         try:
             # # words = tokenize.word_tokenize(text=open(fileName, mode='r', encoding='utf-8').read(), language='english')
-            words = re.findall(r'\w+', open(fileName, mode='r', encoding='utf-8').read().lower())
+            words = ctWordRegex.findall(readText(fileName).lower())
             logging.info("%s words loaded...", '{:,}'.format(len(words)))
         except Exception as e:
             # logging.info("Please provide a valid file name.")
@@ -149,216 +562,1638 @@ def loadLexicon(fileName):
     return lexicon
 
 
-# --------------------------------------------------
-# A function to remove a set of words from a corpus
-# We'll use it to remove the stopwords
-# --------------------------------------------------
-def removeStopwords(words, stopwords):
-    """ Remove stopwords from corpus
-    :return: list of words minus stopwords
+# --------------------------------------------------------------------------------------------------
+# A function to convert a lexicon term (with wildcards) to a regular expression
+# ('*' = any non-whitespace characters, '?' = any character, '|' is ignored)
+# --------------------------------------------------------------------------------------------------
+def termPattern(term):
     """
-    wordsAux = []
-    if stopwords and words:
-        logging.info("Removing stopwords...")
-        wordsAux = [x for x in words if x not in stopwords]
-        logging.info("%s words retained from text.", '{:,}'.format(len(wordsAux)))
-    return wordsAux
+    :param term: lexicon term, e.g. agas[a|e|â]*
+    :return: regular expression, as a string
+    """
+    term_aux = term.replace('?', '.')
+    term_aux = term_aux.replace('*', r'\S+')
+    term_aux = term_aux.replace('|', '')
+    term_aux = r'\b' + term_aux + r'\b'
+    return term_aux
 
 
-# --------------------------------------------------
-# A function to remove unicode punctuation
-# --------------------------------------------------
-def removeUnicodePunctuation(text):
-    """ Removes unicode punctuation
-    :param text:
-    :return: string without unicode punctuation
+# --------------------------------------------------------------------------------------------------
+# A lexicon, prepared for matching against the distinct chunks (whitespace-delimited) of a corpus:
+# the literal prefixes of the terms (e.g. 'admir' for admir*) are stored in a trie, so that
+# a term's regular expression only runs on the chunks having a word starting with its prefix
+# The terms which may match whitespace ('?', or a negated class such as sper[^m^o]*) can match
+# across chunks, so they still run on the text itself
+# It holds everything a run needs (terms, sentiment values, exclusions), so it can be cached on disk
+# (see loadCompiledLexicon); the regular expressions are compiled only when first used
+# --------------------------------------------------------------------------------------------------
+class LexiconMatcher(object):
+
+    def __init__(self, lexicon, exclusions=()):
+        """
+        :param lexicon: dictionary of terms -> sentiment value
+        :param exclusions: words which are never counted as occurrences of a term
+        """
+        self.lexicon = dict(lexicon)
+        self.exclusions = frozenset(exclusions)
+        self.terms = [term for term in lexicon if term]
+        self.sources = [termPattern(term) for term in self.terms]
+        self.patterns = [None] * len(self.terms)
+        self.trie = {}
+        # Terms without a literal prefix starting with a letter are tried on every chunk
+        self.unanchored = []
+        self.spanning = []
+        self.anchors = {}
+        for index, term in enumerate(self.terms):
+            if ctSpanningRegex.search(term):
+                self.spanning.append(index)
+                self.anchors[index] = self.literalAnchor(term)
+                continue
+            prefix = self.literalPrefix(term)
+            if not prefix or not ctWordRegex.match(prefix):
+                self.unanchored.append(index)
+                continue
+            node = self.trie
+            for char in prefix:
+                node = node.setdefault(char, {})
+            node.setdefault(None, []).append(index)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['patterns'] = [None] * len(self.terms)
+        return state
+
+    def pattern(self, index):
+        """
+        :param index: index of the term
+        :return: compiled regular expression of the term
+        """
+        pattern = self.patterns[index]
+        if pattern is None:
+            pattern = self.patterns[index] = re.compile(self.sources[index], re.MULTILINE | re.IGNORECASE)
+        return pattern
+
+    @staticmethod
+    def literalPrefix(term):
+        """
+        :param term: lexicon term
+        :return: the characters of the term before its first wildcard (lowercase)
+        """
+        prefix = []
+        for char in term:
+            if char in ctRegexSpecials:
+                break
+            prefix.append(char)
+        return ''.join(prefix).lower()
+
+    @staticmethod
+    def literalAnchor(term):
+        """
+        :param term: lexicon term
+        :return: (longest run of literal characters before the first '*', its offset in any match), or None
+        """
+        best = None
+        offset = 0
+        run = ''
+        position = 0
+        while position < len(term) and term[position] != '*':
+            char = term[position]
+            if char == '|':
+                position += 1
+                continue
+            if char in ctRegexSpecials:
+                if char == '[':
+                    position = term.find(']', position + 1)
+                    if position < 0:
+                        break
+                elif char != '?':
+                    break
+                run = ''
+            else:
+                run += char.lower()
+                if best is None or len(run) > len(best[0]):
+                    best = (run, offset - len(run) + 1)
+            offset += 1
+            position += 1
+        return best
+
+    def candidates(self, chunk):
+        """
+        :param chunk: lowercase chunk of text
+        :return: set of indexes of the terms which may match the chunk
+        """
+        found = set(self.unanchored)
+        for start in ctWordStartRegex.finditer(chunk):
+            node = self.trie
+            for char in chunk[start.start():]:
+                node = node.get(char)
+                if node is None:
+                    break
+                if None in node:
+                    found.update(node[None])
+        return found
+
+    def match(self, chunks, occurrences):
+        """ Match the terms which never match whitespace against the distinct chunks
+        :param chunks: Counter of distinct chunks -> number of occurrences
+        :param occurrences: list of Counters, one per term: form found -> number of occurrences (updated)
+        """
+        exclusions = self.exclusions
+        for chunk, count in chunks.items():
+            for index in self.candidates(chunk):
+                for form in self.pattern(index).findall(chunk):
+                    if form not in exclusions:
+                        occurrences[index][form] += count
+
+    def scan(self, text, occurrences):
+        """ Match the terms which may match whitespace against a (lowercase) text
+        :param text: text
+        :param occurrences: list of Counters, one per term: form found -> number of occurrences (updated)
+        """
+        exclusions = self.exclusions
+        for index in self.spanning:
+            occurrences[index].update(form for form in self.findAll(index, text) if form not in exclusions)
+
+    def findAll(self, index, text):
+        """ The same as findall(), but the pattern is only tried where its literal anchor occurs
+        :param index: index of the term
+        :param text: text
+        :return: list of matches
+        """
+        pattern = self.pattern(index)
+        if self.anchors[index] is None:
+            return pattern.findall(text)
+        literal, offset = self.anchors[index]
+        found = []
+        position = 0
+        while True:
+            start = text.find(literal, position + offset) - offset
+            if start < position:
+                return found
+            match = pattern.match(text, start)
+            if match:
+                found.append(match.group())
+                position = match.end()
+            else:
+                position = start + 1
+
+
+# --------------------------------------------------------------------------------------------------
+# A function to compute the Sentiment Index of a corpus, in a single pass over the corpus file:
+# the text is only tokenized (in distinct chunks, with their counts), then the lexicon is
+# matched against the distinct chunks and the matches are multiplied by their counts
+# --------------------------------------------------------------------------------------------------
+def scoreSentiment(fileName, lexicon=None, exclusions=(), matcher=None, chunkSize=ctChunkSize):
+    """
+    :param fileName: File containing corpus body
+    :param lexicon: dictionary of terms -> sentiment value (not needed if matcher is given)
+    :param exclusions: words which are never counted as occurrences of a term (not needed if matcher is given)
+    :param matcher: LexiconMatcher of the lexicon and exclusions (built here if missing)
+    :param chunkSize: Number of bytes read from disk at once
+    :return: (dictionary of terms -> [value, absolute frequency, tokens, contribution, occurrences], Sentiment Index)
     """
-    res = text
-    res = res.replace(u'”', ' ')
-    res = res.replace(u'’', ' ')
-    res = res.replace(u'…', ' ')
-    res = res.replace(u'„', ' ')
-    res = res.replace(u'“', ' ')
-    res = res.replace(u',', ' ')
-    return res
+    outFreq = {}
+    sentimentIndex = 0
+    if not fileName or not os.path.exists(fileName):
+        logging.info("Please provide a corpus file.")
+        return outFreq, sentimentIndex
 
+    if matcher is None:
+        matcher = LexiconMatcher(lexicon, exclusions)
+    lexicon = matcher.lexicon
+    occurrences = [collections.Counter() for term in matcher.terms]
+    chunks = collections.Counter()
+    logging.info("Loading corpus...")
+    try:
+        # Whole lines, so that a '?' (which never matches a newline) never misses a match split between two reads
+        for text in streamText(fileName, chunkSize, separators=ctLineEndBytes):
+            text = text.lower()
+            chunks.update(text.split())
+            matcher.scan(text, occurrences)
+        logging.info("Corpus loaded from file %s [%0.3f Mb], %s distinct chunks.",
+                     fileName,
+                     os.path.getsize(fileName) / (1024 * 1024),
+                     '{:,}'.format(len(chunks)))
+    except Exception as e:
+        logging.info(repr(e))
+        return outFreq, sentimentIndex
+    matcher.match(chunks, occurrences)
 
-# --------------------------------------------------
-# A function to remove Romanian diacritics
-# --------------------------------------------------
-def removeDiacritics(text):
-    """ Replaces diacritics
-    :param text:
-    :return: string without diacritics
+    # Word count
+    tokens = sum(count * len([word for word in ctWordRegex.findall(chunk) if len(word) > 1])
+                 for chunk, count in chunks.items())
+    logging.info('%s words in corpus', '{:,}'.format(tokens))
+
+    if tokens:
+        for term, found in zip(matcher.terms, occurrences):
+            subjValue = lexicon[term]
+            freq = sum(found.values())
+            outFreq[term] = [subjValue, freq, tokens, freq / tokens * float(subjValue), found]
+            sentimentIndex += outFreq[term][3]
+    return outFreq, sentimentIndex
+
+
+# --------------------------------------------------------------------------------------------------
+# A function to load a lexicon, compiled for matching (see LexiconMatcher)
+# The compiled lexicon is cached on disk, under the hash of the lexicon file and of the exclusions,
+# so it is compiled again only when one of them changes
+# --------------------------------------------------------------------------------------------------
+def lexiconCacheFile(cacheFolder, lexiconFile, exclusions):
+    """
+    :param cacheFolder: The folder holding the compiled lexicons
+    :param lexiconFile: Lexicon, as csv file
+    :param exclusions: words which are never counted as occurrences of a term
+    :return: path of the compiled lexicon
     """
-    res = text
-    res = res.replace(u'ț', 't')
-    res = res.replace(u'ă', 'a')
-    res = res.replace(u'î', 'i')
-    res = res.replace(u'ș', 's')
-    res = res.replace(u'â', 'a')
-    res = res.replace(u'ţ', 't')
-    res = res.replace(u'ş', 's')
-    res = res.replace(u'à', 'a')
-    return res
+    digest = hashlib.sha1(str(ctLexiconCacheVersion).encode('utf-8'))
+    with open(lexiconFile, mode='rb') as f:
+        digest.update(f.read())
+    digest.update(b'\0' + '\n'.join(sorted(set(exclusions))).encode('utf-8'))
+    return os.path.join(cacheFolder, 'lexicon_' + digest.hexdigest() + '.pickle')
 
 
-# -----------------------------------------------------------------
-# A function to do some generic pre-processing on a corpus of words
-# -----------------------------------------------------------------
-def preProcess(document, lowercase=True, unicode=True, diacritics=True, punctuation=True, digits=True):
-    """ Pre-process corpora for training
-    :param sentences: The corpora sentences (list)
-    :param lowercase: change all text to lowercase? (True/False, default = True)
-    :param unicode: remove Unicode punctuation? (True/False, default = True)
-    :param diacritics: remove diacritics? (True/False, default = True)
-    :param punctuation: remove punctuation? (True/False, default = True)
-    :param digits: remove digits? (True/False, default = True)
-    :return: preprocessed list of words
+def loadCompiledLexicon(lexiconFile, exclusions=(), cacheFolder=ctLexiconCacheFolder):
+    """
+    :param lexiconFile: Lexicon, as csv file
+    :param exclusions: words which are never counted as occurrences of a term
+    :param cacheFolder: The folder holding the compiled lexicons (None = no cache)
+    :return: LexiconMatcher (None, if the lexicon is empty)
     """
+    if not lexiconFile or not os.path.exists(lexiconFile):
+        logging.info("Please provide a valid file name.")
+        return None
 
-    numWords = len(document)
-    i = 1
+    fpath = lexiconCacheFile(cacheFolder, lexiconFile, exclusions) if cacheFolder else None
+    if fpath and os.path.exists(fpath):
+        try:
+            start = time.perf_counter()
+            with open(fpath, mode='rb') as f:
+                matcher = pickle.load(f)
+            logging.info("Compiled lexicon (%s terms) loaded from file %s in %.3fs",
+                         '{:,}'.format(len(matcher.terms)), fpath, time.perf_counter() - start)
+            return matcher
+        except Exception as e:
+            logging.info(repr(e))
 
-    logging.info('Pre-processsing %s words...', '{:,}'.format(numWords))
+    start = time.perf_counter()
+    lexicon = loadLexicon(lexiconFile)
+    if not lexicon:
+        return None
+    matcher = LexiconMatcher(lexicon, exclusions)
+    logging.info("Lexicon (%s terms) compiled in %.3fs", '{:,}'.format(len(matcher.terms)), time.perf_counter() - start)
 
-    # replace uppercase with lowercase
-    if lowercase:
-        document = [word.lower() for word in document]
+    if fpath:
+        if not os.path.exists(cacheFolder):
+            os.makedirs(cacheFolder)
+        try:
+            logging.info("Saving compiled lexicon to file %s", fpath)
+            with replaceFile(fpath) as temporary, open(temporary, mode='wb') as f:
+                pickle.dump(matcher, f, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            logging.info(repr(e))
+    return matcher
 
-    # remove unicode punctuation
-    if unicode:
-        document = [removeUnicodePunctuation(word) for word in document]
 
-    # remove diacritics
-    if diacritics:
-        document = [removeDiacritics(word) for word in document]
+# --------------------------------------------------------------------------------------------------
+# A function to save the sentiment scores of a corpus to a csv file, in a folder named after the corpus
+# --------------------------------------------------------------------------------------------------
+def saveSentiment(corpusFile, outFreq, sentimentIndex, lexicon, folderName=None):
+    """
+    :param corpusFile: File containing corpus body
+    :param outFreq: dictionary of terms -> [value, absolute frequency, tokens, contribution, occurrences]
+    :param sentimentIndex: Sentiment Index of the corpus
+    :param lexicon: dictionary of terms -> sentiment value
+    :param folderName: The folder in which we'll save the file (None = a new folder named after the corpus)
+    """
+    folderName = folderName or corpusName(corpusFile)
+    saveToCSVFile(rows=sentimentRows(corpusFile, outFreq, sentimentIndex, lexicon),
+                  folderName=folderName,
+                  fileName=os.path.basename(folderName),
+                  suffix='_sentiment',
+                  delimiter=';')
 
-    # filter punctuation, stopwords, digits
-    if punctuation:
-        document = [word for word in document if word not in ctPunctuationTokens]
-        document = [re.sub('[' + ctPunctuation + ']', '', word) for word in document]
 
-    # remove digits
-    if digits:
-        document = [re.sub('[' + ctDigits + ']', '', word) for word in document]
+def sentimentRows(corpusFile, outFreq, sentimentIndex, lexicon):
+    """
+    :return: generator of the rows of the sentiment file (see saveSentiment)
+    """
+    yield ['---------------------------------------------------']
+    yield ['Corpus: ' + corpusName(corpusFile)]
+    yield ['Sentiment Index = {:>20.15f}'.format(sentimentIndex)]
+    yield ['---------------------------------------------------']
+    yield []
+    yield ['Term', 'Sentiment value', 'Absolute frequency', 'Corpus size (tokens)', 'Contribution of term', 'Occurrences']
+    for item in lexicon:
+        yield [item,
+               outFreq[item][0],
+               outFreq[item][1],
+               '{:10.0f}'.format(outFreq[item][2]),
+               '{:20.15f}'.format(outFreq[item][3]),
+               dict(outFreq[item][4].most_common())]
 
-    logging.info('Pre-processing of %s words finished successfully!', '{:,}'.format(numWords))
-    logging.info('%s words remaining', '{:,}'.format(len(document)))
 
-    # Remove potential void words
-    document = [word for word in document if word.strip() != '']
+# --------------------------------------------------------------------------------------------------
+# A function to list the corpora of a folder (all .txt files) or matching a pattern (e.g. news/*.txt)
+# The files written by the tools are skipped, so that the results of a previous run are never taken for corpora:
+# the results of a corpus are saved in a folder named after it (news/a.txt -> news/a, news -> news_corpus),
+# in files named after the folder (see ctResultPatterns); the other files of such a folder are kept
+# --------------------------------------------------------------------------------------------------
+ctResultPatterns = ('{0}.csv', '{0}.csv.gz', '{0}.idx', '{0}_vocabulary.txt', '{0}_steps.jsonl', '{0}_step_*.ids',
+                    '{0}_step_*.txt', '{0}_step_*.txt.gz', '{0}_collocations_step_*.csv', '{0}_sentiment.csv',
+                    '{0}_files.csv', '{0}_*_run.csv', '{0}_*_run.jsonl', 'sentiment_summary.csv', 'sentiment_run.csv',
+                    '*_profile_*.txt', '*_profile_*.prof')
 
-    return document
 
+def resultFiles(folderName):
+    """
+    :param folderName: folder
+    :return: set of the files of the folder written by the tools (see ctResultPatterns), empty for a folder of corpora
+    """
+    name = glob.escape(os.path.basename(os.path.abspath(folderName)))
+    patterns = [pattern.format(name) for pattern in ctResultPatterns]
+    try:
+        fileNames = [entry.name for entry in os.scandir(folderName or os.curdir) if entry.is_file()]
+    except OSError:
+        return set()
+    results = set(fileName for fileName in fileNames if any(fnmatch.fnmatchcase(fileName, pattern)
+                                                           for pattern in patterns[:-2]))
+    # The profiles alone do not make a folder of results
+    if results:
+        results.update(fileName for fileName in fileNames if any(fnmatch.fnmatchcase(fileName, pattern)
+                                                                 for pattern in patterns[-2:]))
+    return results
 
-# ------------------------------------------------------------------------
-# A function to remove morphological affixes from corpus (Snowball stemmer)
-# ------------------------------------------------------------------------
-def doStemming(words):
-    stemmed = []
-    if words:
-        detectedLanguage = detect(' '.join(words))
-        if detectedLanguage in ctLanguages:
-            stemmerLanguage = ctLanguages[detectedLanguage]
-        else:
-            stemmerLanguage = 'english'
-        stemmer = stem.SnowballStemmer(stemmerLanguage)
-        for word in words:
-            stemmed.append(stemmer.stem(word))
-    return stemmed
 
+def isResultFile(fileName, resultFolders=None):
+    """
+    :param fileName: corpus file
+    :param resultFolders: dictionary of the folders already checked -> their result files (see resultFiles)
+    :return: True if the file was written by the tools
+    """
+    resultFolders = {} if resultFolders is None else resultFolders
+    folderName, name = os.path.split(os.path.normpath(fileName))
+    if folderName not in resultFolders:
+        resultFolders[folderName] = resultFiles(folderName)
+    return name in resultFolders[folderName]
 
-# ------------------------------------------------------------------------
-# A function to find and mark collocations (bi-grams) in a corpus of text
-# ------------------------------------------------------------------------
-# @profile
-def findCollocations(words, bigramMethod):
-    if words:
-        # Find collocations (Manning's algorithm, NLTK)
-        bigramMeasures = collocations.BigramAssocMeasures()
-        finder = collocations.BigramCollocationFinder.from_words(words=words, window_size=2)
-        finder.apply_freq_filter(2)
-        topBigrams = finder.nbest(bigramMeasures.pmi, 10000000)
 
-        # Mark collocations in corpus
-        if bigramMethod == 0:
+def findCorpora(source, pattern=ctCorpusPatterns, recursive=False):
+    """
+    :param source: folder, or file name pattern (** for any number of sub-folders)
+    :param pattern: pattern(s) of the corpora inside a folder (default: text files, compressed or not)
+    :param recursive: also look for the corpora in the sub-folders of a folder?
+    :return: sorted list of corpus files
+    """
+    sources = [source]
+    if os.path.isdir(source):
+        sources = [os.path.join(source, '**', pattern) if recursive else os.path.join(source, pattern)
+                   for pattern in ([pattern] if isinstance(pattern, str) else pattern)]
+    fileNames = set(fileName for path in sources for fileName in glob.glob(path, recursive=True)
+                    if os.path.isfile(fileName))
+    resultFolders = {}
+    skipped = collections.Counter(os.path.dirname(os.path.normpath(fileName)) or os.curdir
+                                  for fileName in fileNames if isResultFile(fileName, resultFolders))
+    for folderName, count in sorted(skipped.items()):
+        logging.info("Folder %s: %s files of results of a previous run skipped", folderName, '{:,}'.format(count))
+    corpora = sorted(fileName for fileName in fileNames if not isResultFile(fileName, resultFolders))
+    logging.info("%s corpora found in %s", '{:,}'.format(len(corpora)), source)
+    return corpora
 
-            # ---------------------------------------------------------------------------------------
-            # METHOD 3 - DICTIONARY
-            # Put bi-grams in a dictionary then loop over the whole corpus once and
-            # check if two successive words are part of a bi-gram from the dictionary
-            # ---------------------------------------------------------------------------------------
-            # +++ Very fast !
-            # ---
-            # ---------------------------------------------------------------------------------------
-            topBigramsDict = {}
-            for bigram in topBigrams:
-                if not bigram[0] in topBigramsDict:
-                    topBigramsDict[bigram[0]] = [bigram[1]]
-                else:
-                    topBigramsDict[bigram[0]].append(bigram[1])
 
-            # Now mark collocations in corpus
-            document = []
-            skipIndex = -1
-            for index, word in enumerate(words):
-                if index != skipIndex and \
-                        index < len(words) - 1 and \
-                        word and words[index + 1] and \
-                        word != words[index + 1] and \
-                        len(word) > 1 and len(words[index + 1]) > 1 and \
-                        word not in ctPunctuationTokens and words[index + 1] not in ctPunctuationTokens:
+# --------------------------------------------------------------------------------------------------
+# Functions to score many corpora with a pool of processes
+# The compiled lexicon is sent only once to every process (pool initializer), then every
+# process scores whole corpora and saves their results itself
+# --------------------------------------------------------------------------------------------------
+sentimentMatcher = None
 
-                    if word not in topBigramsDict:
-                        document.append(word)
-                    elif words[index + 1] not in topBigramsDict[word]:
-                        document.append(word)
-                    else:
-                        document.append(word + '_' + words[index + 1])
-                        skipIndex = index + 1
 
-            words.clear()
-            words = document
+def initSentimentWorker(matcher):
+    """
+    :param matcher: LexiconMatcher used by the process
+    """
+    global sentimentMatcher
+    sentimentMatcher = matcher
 
-        elif bigramMethod == 1:
 
-            # ---------------------------------------------------------------------------------------------
-            # METHOD 1 - REGEX
-            # We use a regex to identify & replace all occurrences of the first bi-gram in the full corpus.
-            # Then we move to the second bi-gram and so forth...
-            # ---------------------------------------------------------------------------------------------
-            # +++ We try to use a regex to identify all occurrences of a bi-gram in corpus.
-            #     Then only we move to the next bi-gram.
-            #     The question is: which bi-gram should we apply first?
-            #     By default, we start with the most frequent ones but those are also the most trivial
-            # --- Very slow on larger corpora
-            #     The sequence of identification of all occurrences is not guaranteed
-            # ---------------------------------------------------------------------------------------------
-            corpus = ' '.join(words)
-            for b1, b2 in topBigrams:
-                if b1 and b2 and \
-                        b1 != b2 and \
-                        len(b1) > 1 and \
-                        len(b2) > 1 and \
-                        b1 not in ctPunctuationTokens and \
-                        b2 not in ctPunctuationTokens:
-                    bigramRegex = regex.compile(r'\b%s\b\s{1}\b%s\b' % (b1, b2))
-                    corpus = bigramRegex.sub(b1 + '_' + b2, corpus)
+def scoreCorpus(task):
+    """
+    :param task: (corpusFile, folderName): File containing corpus body, and the folder of its results
+    :return: (corpusFile, Sentiment Index, tokens, seconds)
+    """
+    corpusFile, folderName = task
+    start = time.perf_counter()
+    outFreq, sentimentIndex = scoreSentiment(corpusFile, matcher=sentimentMatcher)
+    tokens = 0
+    if outFreq:
+        tokens = next(iter(outFreq.values()))[2]
+        saveSentiment(corpusFile, outFreq, sentimentIndex, sentimentMatcher.lexicon, folderName)
+    return corpusFile, sentimentIndex, tokens, time.perf_counter() - start
 
-            words.clear()
-            words = tokenize.word_tokenize(text=corpus, language='english')
 
-        elif bigramMethod == 2:
-            # ----------------------------------------------------------------------------------------
-            # METHOD 3 - FULL SCAN
-            # Apply the first bi-gram to the entire corpus, then the second and so forth...
-            # ----------------------------------------------------------------------------------------
-            # +++ It guarantees that a bi-gram is applied to ALL its occurrences in the text.
-            #     Then only we move to the next bi-gram.
-            #     The order of applying bi-grams to corpus is guaranteed.
-            #     The question is: which bi-gram should be applied first?
-            #     By default, we start with the most frequent ones but those are also the most trivial
+def scoreCorpora(corpusFiles, matcher, processes=None, source=None):
+    """
+    :param corpusFiles: list of corpus files
+    :param matcher: LexiconMatcher of the lexicon and exclusions
+    :param processes: Number of processes (None = number of CPUs, 0 or 1 = none, score in this process)
+    :param source: folder / pattern / manifest of the corpus files: the results of every corpus are saved
+                   inside <folder>_corpus (None = in a new folder named after every corpus)
+    :return: list of (corpusFile, Sentiment Index, tokens, seconds), in the order of corpusFiles
+    """
+    results = {}
+    if corpusFiles:
+        processes = min((os.cpu_count() or 1) if processes is None else max(processes, 1), len(corpusFiles))
+        size = sum(os.path.getsize(fileName) for fileName in corpusFiles)
+        logging.info("Scoring %s corpora [%0.3f Mb] with %s processes.",
+                     '{:,}'.format(len(corpusFiles)), size / (1024 * 1024), processes)
+        start = time.perf_counter()
+        try:
+            # The largest corpora first, so that no process is left alone with a large corpus at the end
+            largestFirst = [(fileName, resultFolder(fileName, source) if source else None)
+                            for fileName in sorted(corpusFiles, key=os.path.getsize, reverse=True)]
+            if processes == 1:
+                initSentimentWorker(matcher)
+                for result in map(scoreCorpus, largestFirst):
+                    results[result[0]] = result
+            else:
+                with multiprocessing.Pool(processes, initializer=initSentimentWorker, initargs=(matcher,)) as pool:
+                    for result in pool.imap_unordered(scoreCorpus, largestFirst):
+                        results[result[0]] = result
+            elapsed = time.perf_counter() - start
+            logging.info("%s corpora scored in %.3fs [%0.3f Mb/s].",
+                         '{:,}'.format(len(results)), elapsed, size / (1024 * 1024) / elapsed)
+        except Exception as e:
+            logging.info(repr(e))
+    return [results[fileName] for fileName in corpusFiles if fileName in results]
+
+
+# --------------------------------------------------------------------------------------------------
+# A function to save the Sentiment Index of many corpora to a single csv file
+# --------------------------------------------------------------------------------------------------
+def saveSentimentSummary(results, folderName, fileName='sentiment_summary'):
+    """
+    :param results: list of (corpusFile, Sentiment Index, tokens, seconds)
+    :param folderName: The folder in which we'll save the file
+    :param fileName: The name of the file
+    """
+    if results:
+        rows = itertools.chain([['Corpus', 'Sentiment Index', 'Corpus size (tokens)']],
+                               ([corpusFile, '{:20.15f}'.format(sentimentIndex), '{:10.0f}'.format(tokens)]
+                                for corpusFile, sentimentIndex, tokens, seconds in results))
+        saveToCSVFile(rows=rows, folderName=folderName, fileName=fileName, suffix='', delimiter=';')
+
+
+# --------------------------------------------------------------------------------------------------
+# A compact, integer-encoded corpus: the vocabulary of distinct words (word <-> id), plus
+# the corpus itself as an array of word ids (4 bytes per token, instead of a Python string)
+# All stages below accept it instead of a list of words and work on ids, decoding only at output time
+# --------------------------------------------------------------------------------------------------
+class EncodedCorpus(object):
+    """ Corpus of words encoded as integer ids over a vocabulary
+    """
+
+    def __init__(self, vocabulary=None, ids=None):
+        """
+        :param vocabulary: iterable of distinct words (id = position)
+        :param ids: array('I') of word ids
+        """
+        self.vocabulary = []
+        self.index = {}
+        for word in vocabulary or []:
+            self.add(word)
+        self.ids = array('I') if ids is None else ids
+
+    def add(self, word):
+        """ Add a word to the vocabulary (if not there yet)
+        :return: the id of the word
+        """
+        try:
+            return self.index[word]
+        except KeyError:
+            wordId = self.index[word] = len(self.vocabulary)
+            self.vocabulary.append(word)
+            return wordId
+
+    def extend(self, words):
+        """ Append words (any iterable, including a stream) at the end of the corpus
+        """
+        self.ids.extend(map(self.add, words))
+
+    def counts(self):
+        """
+        :return: Counter of word -> absolute frequency
+        """
+        vocabulary = self.vocabulary
+        frequencies = np.bincount(np.frombuffer(self.ids, dtype=np.uint32), minlength=len(vocabulary)).tolist()
+        return collections.Counter({word: count for word, count in zip(vocabulary, frequencies) if count})
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return map(self.vocabulary.__getitem__, self.ids)
+
+
+# --------------------------------------------------------------------------------------------------
+# A function to encode words (a list or a stream) as an EncodedCorpus
+# --------------------------------------------------------------------------------------------------
+def encodeWords(words):
+    """
+    :param words: iterable of words
+    :return: EncodedCorpus
+    """
+    corpus = words
+    if not isinstance(words, EncodedCorpus):
+        corpus = EncodedCorpus()
+        corpus.extend(words)
+        logging.info("%s words encoded, %s distinct words.",
+                     '{:,}'.format(len(corpus)), '{:,}'.format(len(corpus.vocabulary)))
+    return corpus
+
+
+# --------------------------------------------------------------------------------------------------
+# A function to transform an EncodedCorpus word by word, working on the vocabulary only:
+# every distinct word is transformed once, then the ids are remapped
+# --------------------------------------------------------------------------------------------------
+def remapCorpus(corpus, function):
+    """
+    :param corpus: EncodedCorpus
+    :param function: function returning the new form of a word, or None if the word has to be dropped
+    :return: new EncodedCorpus
+    """
+    result = EncodedCorpus()
+    remap = []
+    for word in corpus.vocabulary:
+        # The sentence boundaries are kept as they are (see loadSentenceCorpus)
+        newWord = word if word == ctSentenceBoundary else function(word)
+        remap.append(-1 if newWord is None else result.add(newWord))
+    if -1 in remap:
+        result.ids = array('I', [remap[wordId] for wordId in corpus.ids if remap[wordId] >= 0])
+    else:
+        result.ids = array('I', map(remap.__getitem__, corpus.ids))
+    return result
+
+
+# --------------------------------------------------------------------------------------------------
+# A function to append an EncodedCorpus at the end of another one, which has its own vocabulary
+# The words of the appended corpus are added to the vocabulary once, then its ids are remapped with NumPy
+# --------------------------------------------------------------------------------------------------
+def appendCorpus(corpus, other):
+    """
+    :param corpus: EncodedCorpus (extended)
+    :param other: EncodedCorpus
+    :return: corpus
+    """
+    mapping = np.array([corpus.add(word) for word in other.vocabulary], dtype=np.int64)
+    if len(other):
+        corpus.ids.frombytes(mapping[corpusIds(other)].astype('=u%d' % corpus.ids.itemsize).tobytes())
+    return corpus
+
+
+# --------------------------------------------------------------------------------------------------
+# The functions to load a corpus as sentences: every sentence is followed by a boundary token
+# (ctSentenceBoundary), which the bi-grams never span (see countBigrams)
+# Every shard ends with a sentence end, so that the shards are encoded in parallel and then appended in order,
+# and the sentences are the same with any number of processes
+# --------------------------------------------------------------------------------------------------
+def shardSentences(fileName, numShards, blockSize=1024 * 1024):
+    """
+    :param fileName: File containing corpus body
+    :param numShards: Number of shards wanted
+    :param blockSize: Number of bytes read at once, while looking for a sentence end
+    :return: list of (start, end) byte ranges, each one ending right after a sentence end (see loadSentences);
+             a part of the file without any sentence end is not cut (a compressed file is a single shard, (0, None))
+    """
+    if detectCompression(fileName):
+        return [(0, None)]
+    size = os.path.getsize(fileName)
+    bounds = [0]
+    with open(fileName, mode='rb') as f:
+        for k in range(1, numShards):
+            position = max(size * k // numShards, bounds[-1])
+            limit = size * (k + 1) // numShards
+            f.seek(position)
+            # The text is decoded from the start of a line (never inside a UTF-8 character), line by line;
+            # the first sentence end after a word is a sentence end of the whole file too
+            block = f.read(blockSize)
+            lineStart = seenWord = False
+            cut = None
+            while cut is None and block and position < limit:
+                last = max(block.rfind(c) for c in ctLineEndBytes) + 1
+                if not last:
+                    more = f.read(blockSize)
+                    if not lineStart:
+                        position, block = position + len(block), more
+                    elif more and position + len(block) < limit:
+                        block += more
+                    else:
+                        break
+                    continue
+                if lineStart:
+                    text = block[:last].decode('utf-8')
+                    for match in ctSentenceRegex.finditer(text):
+                        if match.group(1):
+                            seenWord = True
+                        elif seenWord:
+                            cut = position + len(text[:match.end()].encode('utf-8'))
+                            break
+                else:
+                    last = min(found for found in (block.find(c) for c in ctLineEndBytes) if found >= 0) + 1
+                    lineStart = True
+                position, block = position + last, block[last:] + f.read(blockSize)
+            if cut is not None and bounds[-1] < cut < size:
+                bounds.append(cut)
+    bounds.append(size)
+    return [(bounds[k], bounds[k + 1]) for k in range(len(bounds) - 1) if bounds[k + 1] > bounds[k]]
+
+
+def encodeSentenceShard(shard):
+    """
+    :param shard: (fileName, start, end, minLength)
+    :return: EncodedCorpus of the sentences in the byte range [start, end) of the file
+    """
+    fileName, start, end, minLength = shard
+    corpus = EncodedCorpus()
+    for sentence in loadSentences(fileName, start, end):
+        length = len(corpus)
+        corpus.extend(word for word in sentence if len(word) >= minLength)
+        if len(corpus) > length:
+            corpus.ids.append(corpus.add(ctSentenceBoundary))
+    return corpus
+
+
+def loadSentenceCorpus(fileName, processes=0, minLength=1, shardsPerProcess=4):
+    """
+    :param fileName: Corpus of text, as txt file
+    :param processes: Number of processes loading the shards in parallel (0 = none)
+    :param minLength: minimum length of the words kept
+    :param shardsPerProcess: Number of shards per process, for balancing the load
+    :return: EncodedCorpus of the words, with a ctSentenceBoundary after every sentence
+    """
+    corpus = EncodedCorpus()
+    if fileName and os.path.exists(fileName):
+        shards = shardSentences(fileName, processes * shardsPerProcess) if processes > 1 else [(0, None)]
+        shards = [(fileName, start, end, minLength) for start, end in shards]
+        logging.info("Loading the sentences of file %s [%0.3f Mb] in %s shards, with %s processes.",
+                     fileName, os.path.getsize(fileName) / (1024 * 1024), len(shards), max(processes, 1))
+        try:
+            if processes > 1:
+                with multiprocessing.Pool(processes) as pool:
+                    for shard in pool.imap(encodeSentenceShard, shards):
+                        appendCorpus(corpus, shard)
+            else:
+                for shard in shards:
+                    appendCorpus(corpus, encodeSentenceShard(shard))
+            numSentences = np.count_nonzero(corpusIds(corpus) == corpus.index.get(ctSentenceBoundary, -1))
+            logging.info("%s words encoded, %s sentences, %s distinct words.",
+                         '{:,}'.format(len(corpus) - numSentences), '{:,}'.format(numSentences),
+                         '{:,}'.format(len(corpus.vocabulary)))
+        except Exception as e:
+            logging.info(repr(e))
+    else:
+        logging.info("Please provide a valid file name.")
+    return corpus
+
+
+# --------------------------------------------------------------------------------------------------
+# A function to name the results of a corpus: the folder of the results, and the start of their file names
+# (the name of a file is cut at its first '.', but not the names of its folders)
+# --------------------------------------------------------------------------------------------------
+def corpusRoot(corpus):
+    """
+    :param corpus: text file, folder, file name pattern or manifest (see CorpusSource)
+    :return: the folder of the corpus: the folder itself, the folder before the first wildcard of a pattern,
+             or the folder of a file or manifest, e.g. news -> news, news/**/*.txt -> news, news/a.txt -> news
+    """
+    if os.path.isdir(corpus):
+        return os.path.normpath(corpus)
+    if not any(c in corpus for c in '*?['):
+        return os.path.dirname(os.path.normpath(corpus)) or '.'
+    parts = []
+    for part in os.path.normpath(corpus).split(os.sep):
+        if any(c in part for c in '*?['):
+            break
+        parts.append(part)
+    return os.sep.join(parts) or '.'
+
+
+def corpusName(corpus):
+    """
+    :param corpus: text file, folder, file name pattern or manifest (see CorpusSource)
+    :return: the file name without extension (in the same folder), or <folder>_corpus for a folder, a pattern
+             or a manifest (next to the folder, so that the results are never taken for corpus files), e.g.
+             news/a.txt.gz -> news/a, news -> news_corpus, news/**/*.txt -> news_corpus,
+             news.manifest -> news_corpus
+    """
+    if os.path.isdir(corpus) or any(c in corpus for c in '*?['):
+        folderName = corpusRoot(corpus)
+        return folderName + '_corpus' if folderName != '.' else 'corpus'
+    folderName, fileName = os.path.split(corpus)
+    if fileName.endswith(ctManifestSuffixes):
+        return os.path.join(folderName, fileName.split('.')[0] + '_corpus')
+    return os.path.join(folderName, fileName.split('.')[0])
+
+
+def resultFolder(corpusFile, source):
+    """
+    :param corpusFile: one of the corpus files of a source
+    :param source: folder, file name pattern or manifest of the corpus file
+    :return: the folder of the results of the corpus file, inside the folder of the results of the source
+             (with the same sub-folders as in the source), e.g. news/a/x.txt of news -> news_corpus/a/x
+    """
+    relativeName = os.path.relpath(corpusName(corpusFile), corpusRoot(source))
+    if relativeName.startswith(os.pardir):
+        relativeName = os.path.basename(corpusName(corpusFile))
+    return os.path.join(corpusName(source), relativeName)
+
+
+# --------------------------------------------------------------------------------------------------
+# The corpus sources: a corpus is a text file, or many of them (a folder, a file name pattern, or a manifest
+# listing one file per line). The files of a source are read by a pool of threads, in batches of about
+# ctBatchSize bytes, and every batch is tokenized by a pool of processes; the batches are then appended
+# in order, and the number of words read from every file is kept (the provenance of the words)
+# --------------------------------------------------------------------------------------------------
+corpusWorkerOptions = (1, frozenset(), False)
+
+
+def initCorpusWorker(minLength, stopwords, sentences):
+    """ Keep the options of the tokenizer in every process, so that they are sent only once (pool initializer)
+    """
+    global corpusWorkerOptions
+    corpusWorkerOptions = (minLength, stopwords or frozenset(), sentences)
+
+
+def readBatch(batch):
+    """
+    :param batch: list of files
+    :return: list of (file, text)
+    """
+    return [(fileName, readText(fileName)) for fileName in batch]
+
+
+def encodeBatch(texts):
+    """
+    :param texts: list of (file, text)
+    :return: (EncodedCorpus of the words of the texts, list of (position of the first word, number of words)
+             of every text)
+    """
+    minLength, stopwords, sentences = corpusWorkerOptions
+    corpus = EncodedCorpus()
+    numWords = []
+    for fileName, text in texts:
+        length = len(corpus)
+        if sentences:
+            # Every sentence is followed by a boundary, and so is the end of a file (see loadSentenceCorpus)
+            boundary = corpus.add(ctSentenceBoundary)
+            numBoundaries = 0
+            for match in ctSentenceRegex.finditer(text.lower()):
+                word = match.group(1)
+                if word:
+                    if len(word) >= minLength and word not in stopwords:
+                        corpus.ids.append(corpus.add(word))
+                elif len(corpus) > length and corpus.ids[-1] != boundary:
+                    corpus.ids.append(boundary)
+                    numBoundaries += 1
+            if len(corpus) > length and corpus.ids[-1] != boundary:
+                corpus.ids.append(boundary)
+                numBoundaries += 1
+            numWords.append((length, len(corpus) - length - numBoundaries))
+        else:
+            corpus.extend(word for word in ctWordRegex.findall(text.lower())
+                          if len(word) >= minLength and word not in stopwords)
+            numWords.append((length, len(corpus) - length))
+    return corpus, numWords
+
+
+class CorpusSource(object):
+
+    def __init__(self, source):
+        """
+        :param source: text file (compressed or not), folder (with its sub-folders), file name pattern
+                       (e.g. news/*.txt, news/**/*.txt.gz), or manifest (*.manifest, *.lst: one file per line,
+                       relative to the manifest, # for comments)
+        """
+        self.source = source
+        self.multiple = os.path.isdir(source) or any(c in source for c in '*?[') or \
+            source.endswith(ctManifestSuffixes)
+        if os.path.isdir(source):
+            self.files = findCorpora(source, recursive=True)
+        elif any(c in source for c in '*?['):
+            self.files = findCorpora(source)
+        elif source.endswith(ctManifestSuffixes):
+            self.files = self.readManifest(source)
+        else:
+            self.files = [source] if os.path.isfile(source) else []
+        self.size = sum(map(os.path.getsize, self.files))
+        self.provenance = None
+
+    @staticmethod
+    def readManifest(fileName):
+        """
+        :return: list of the files of a manifest
+        """
+        files = []
+        if os.path.isfile(fileName):
+            folderName = os.path.dirname(fileName)
+            with open(fileName, mode='r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if line and not line.startswith('#'):
+                        files.append(os.path.join(folderName, line))
+        missing = [file for file in files if not os.path.isfile(file)]
+        if missing:
+            logging.info("%s files of the manifest %s not found (e.g. %s)", '{:,}'.format(len(missing)), fileName,
+                         missing[0])
+        return [file for file in files if os.path.isfile(file)]
+
+    def name(self):
+        """
+        :return: the path of the results, without extension (see corpusName)
+        """
+        return corpusName(self.source)
+
+    def hash(self, threads=ctReaderThreads):
+        """
+        :return: hash of the content of the files (SHA-1, hex), computed by a pool of threads
+        """
+        if not self.multiple:
+            return fileHash(self.source)
+        sha = hashlib.sha1()
+        with concurrent.futures.ThreadPoolExecutor(threads) as executor:
+            for fileName, fileDigest in zip(self.files, executor.map(fileHash, self.files)):
+                sha.update(('%s\t%s\n' % (fileName, fileDigest)).encode('utf-8'))
+        return sha.hexdigest()
+
+    def batches(self, batchSize=ctBatchSize):
+        """
+        :return: generator of lists of files, about batchSize bytes each
+        """
+        batch = []
+        size = 0
+        for fileName in self.files:
+            batch.append(fileName)
+            size += os.path.getsize(fileName)
+            if size >= batchSize:
+                yield batch
+                batch = []
+                size = 0
+        if batch:
+            yield batch
+
+    def readBatches(self, threads=ctReaderThreads):
+        """ Read the batches with a pool of threads, a few batches ahead of their consumer
+        :return: generator of lists of (file, text), in the order of the files
+        """
+        with concurrent.futures.ThreadPoolExecutor(threads) as executor:
+            pending = collections.deque()
+            for batch in self.batches():
+                pending.append(executor.submit(readBatch, batch))
+                if len(pending) >= 2 * threads:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def load(self, processes=0, minLength=1, stopwords=None, sentences=False, threads=ctReaderThreads):
+        """
+        :param processes: Number of processes tokenizing the files in parallel (0 = none)
+        :param minLength: minimum length of the words kept
+        :param stopwords: set of stopwords, dropped while tokenizing (None = keep all the words)
+        :param sentences: add a sentence boundary after every sentence and at the end of every file?
+        :param threads: Number of threads reading the files
+        :return: EncodedCorpus of the words of all the files, in order (self.provenance: the words of every file)
+        """
+        corpus = EncodedCorpus()
+        self.provenance = []
+        if not self.files:
+            logging.info("No corpus file found in %s", self.source)
+            return corpus
+        start = time.perf_counter()
+        logging.info("Loading %s files [%0.3f Mb] with %s threads and %s processes.", '{:,}'.format(len(self.files)),
+                     self.size / (1024 * 1024), threads, max(processes, 1))
+
+        def append(result, files):
+            batch, numWords = result
+            for fileName, (position, words) in zip(files, numWords):
+                self.provenance.append(collections.OrderedDict([('file', fileName), ('bytes', os.path.getsize(fileName)),
+                                                                ('start', len(corpus) + position), ('words', words)]))
+            appendCorpus(corpus, batch)
+
+        options = (minLength, stopwords, sentences)
+        try:
+            if processes > 1:
+                # At most a few batches wait for a process, so that the text is never all in memory
+                with multiprocessing.Pool(processes, initializer=initCorpusWorker, initargs=options) as pool:
+                    pending = collections.deque()
+                    for texts in self.readBatches(threads):
+                        pending.append((pool.apply_async(encodeBatch, (texts,)), [text[0] for text in texts]))
+                        if len(pending) >= 2 * processes:
+                            result, files = pending.popleft()
+                            append(result.get(), files)
+                    while pending:
+                        result, files = pending.popleft()
+                        append(result.get(), files)
+            else:
+                initCorpusWorker(*options)
+                for texts in self.readBatches(threads):
+                    append(encodeBatch(texts), [text[0] for text in texts])
+        except Exception as e:
+            logging.info(repr(e))
+        seconds = max(time.perf_counter() - start, 1e-9)
+        logging.info("%s files loaded in %.3fs (%0.1f Mb/s, %0.1f files/s): %s words, %s distinct words.",
+                     '{:,}'.format(len(self.provenance)), seconds, self.size / (1024 * 1024) / seconds,
+                     len(self.provenance) / seconds, '{:,}'.format(sum(item['words'] for item in self.provenance)),
+                     '{:,}'.format(len(corpus.vocabulary)))
+        return corpus
+
+    def saveProvenance(self, folderName, fileName):
+        """ Save the words read from every file (file, bytes, position of its first word, words), as _files.csv
+        """
+        if self.provenance:
+            saveToCSVFile(rows=itertools.chain([list(self.provenance[0])],
+                                               (list(item.values()) for item in self.provenance)),
+                          folderName=folderName,
+                          fileName=fileName,
+                          suffix='_files')
+
+
+# --------------------------------------------------------------------------------------------------
+# A function to transform a Counter of words (e.g. returned by countWordsParallel) word by word
+# Every distinct word is transformed once, and the counts of words becoming identical are added up
+# --------------------------------------------------------------------------------------------------
+def remapCounts(counts, function):
+    """
+    :param counts: Counter of word -> absolute frequency
+    :param function: function returning the new form of a word, or None if the word has to be dropped
+    :return: new Counter
+    """
+    result = collections.Counter()
+    for word, count in counts.items():
+        newWord = function(word)
+        if newWord is not None:
+            result[newWord] += count
+    return result
+
+
+# --------------------------------------------------------------------------------------------------
+# A function to tell a lazy stream of words (e.g. the generator returned by streamWords)
+# from a list of words already loaded in memory
+# --------------------------------------------------------------------------------------------------
+def isStream(words):
+    """
+    :param words: iterable of words
+    :return: True if words can only be consumed once (an iterator / generator)
+    """
+    return isinstance(words, collections.abc.Iterator)
+
+
+# --------------------------------------------------------------------------------------------------
+# Functions to save an EncodedCorpus to a binary file on disk and to load it back
+# Format: header (magic, version, number of distinct words, number of tokens), then the byte length of
+# every word of the vocabulary (uint32), the words themselves (UTF-8), then the word ids (uint32),
+# all in little-endian order
+# --------------------------------------------------------------------------------------------------
+def saveEncodedCorpus(corpus, fileName):
+    """
+    :param corpus: EncodedCorpus
+    :param fileName: binary file
+    """
+    words = [word.encode('utf-8') for word in corpus.vocabulary]
+    lengths = array('I', map(len, words))
+    ids = corpus.ids if isinstance(corpus.ids, array) and corpus.ids.typecode == 'I' else array('I', corpus.ids)
+    if sys.byteorder == 'big':
+        lengths.byteswap()
+        ids = array('I', ids)
+        ids.byteswap()
+    with open(fileName, mode='wb') as f:
+        f.write(ctEncodedCorpusHeader.pack(ctEncodedCorpusMagic, ctEncodedCorpusVersion, len(words), len(ids)))
+        f.write(lengths.tobytes())
+        f.write(b''.join(words))
+        f.write(ids.tobytes())
+
+
+def encodedCorpusSize(corpus):
+    """
+    :param corpus: EncodedCorpus
+    :return: size of the file of the corpus, in bytes (see saveEncodedCorpus)
+    """
+    return (ctEncodedCorpusHeader.size + 4 * len(corpus.vocabulary) +
+            sum(len(word.encode('utf-8')) for word in corpus.vocabulary) + 4 * len(corpus.ids))
+
+
+def loadEncodedCorpus(fileName):
+    """
+    :param fileName: binary file (see saveEncodedCorpus)
+    :return: EncodedCorpus
+    """
+    with open(fileName, mode='rb') as f:
+        magic, version, numWords, numIds = ctEncodedCorpusHeader.unpack(f.read(ctEncodedCorpusHeader.size))
+        if magic != ctEncodedCorpusMagic or version != ctEncodedCorpusVersion:
+            raise ValueError('%s is not an encoded corpus (version %s)' % (fileName, ctEncodedCorpusVersion))
+        lengths = array('I')
+        lengths.frombytes(f.read(4 * numWords))
+        if sys.byteorder == 'big':
+            lengths.byteswap()
+        data = f.read(sum(lengths))
+        ids = array('I')
+        ids.frombytes(f.read(4 * numIds))
+        if sys.byteorder == 'big':
+            ids.byteswap()
+    corpus = EncodedCorpus(ids=ids)
+    ends = list(itertools.accumulate(lengths))
+    corpus.vocabulary = [data[end - length:end].decode('utf-8') for end, length in zip(ends, lengths)]
+    corpus.index = {word: wordId for wordId, word in enumerate(corpus.vocabulary)}
+    return corpus
+
+
+# --------------------------------------------------------------------------------------------------
+# A function to hash the content of a file (e.g. for naming the cached results computed from it)
+# --------------------------------------------------------------------------------------------------
+def fileHash(fileName, chunkSize=ctChunkSize):
+    """
+    :param fileName: any file
+    :param chunkSize: Number of bytes read from disk at once
+    :return: SHA-1 of the content of the file, as hex string
+    """
+    digest = hashlib.sha1()
+    with open(fileName, mode='rb') as f:
+        for chunk in iter(lambda: f.read(chunkSize), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# --------------------------------------------------------------------------------------------------
+# A cache of encoded corpora on disk (e.g. the corpus after each pre-processing stage), one binary file
+# per key, limited in size: when it grows over its maximum size, the least recently used files go first
+# --------------------------------------------------------------------------------------------------
+class StageCache(object):
+
+    def __init__(self, cacheFolder=ctStageCacheFolder, maxSize=ctStageCacheSize):
+        """
+        :param cacheFolder: The folder holding the cached corpora
+        :param maxSize: maximum size of the cache, in bytes
+        """
+        self.cacheFolder = cacheFolder
+        self.maxSize = maxSize
+
+    def path(self, key):
+        return os.path.join(self.cacheFolder, key + '.corpus')
+
+    def get(self, key):
+        """
+        :param key: key of the corpus (see stageKey)
+        :return: EncodedCorpus, or None if it is not in the cache
+        """
+        fpath = self.path(key)
+        if not os.path.exists(fpath):
+            return None
+        try:
+            start = time.perf_counter()
+            corpus = loadEncodedCorpus(fpath)
+            # The modification time is the time of the last use
+            os.utime(fpath)
+            logging.info("%s words (%s distinct words) loaded from file %s in %.3fs",
+                         '{:,}'.format(len(corpus)), '{:,}'.format(len(corpus.vocabulary)), fpath,
+                         time.perf_counter() - start)
+            return corpus
+        except Exception as e:
+            logging.info(repr(e))
+            return None
+
+    def put(self, key, corpus):
+        """
+        :param key: key of the corpus (see stageKey)
+        :param corpus: EncodedCorpus
+        """
+        # A corpus larger than the whole cache is not saved (it would be removed at once, with all the others)
+        size = encodedCorpusSize(corpus)
+        if size > self.maxSize:
+            logging.info("%s words [%0.3f Mb] not saved: larger than the cache [%0.3f Mb]", '{:,}'.format(len(corpus)),
+                         size / (1024 * 1024), self.maxSize / (1024 * 1024))
+            return
+        if not os.path.exists(self.cacheFolder):
+            os.makedirs(self.cacheFolder)
+        try:
+            fpath = self.path(key)
+            logging.info("Saving %s words to file %s", '{:,}'.format(len(corpus)), fpath)
+            with replaceFile(fpath) as temporary:
+                saveEncodedCorpus(corpus, temporary)
+            self.evict()
+        except Exception as e:
+            logging.info(repr(e))
+
+    def putProvenance(self, key, provenance):
+        """ Save the provenance of the words of a cached corpus (see CorpusSource.load)
+        """
+        if not os.path.exists(self.path(key)):
+            return
+        try:
+            with open(self.path(key) + '.files.json', mode='w', encoding='utf-8') as f:
+                json.dump(provenance, f)
+            self.evict()
+        except Exception as e:
+            logging.info(repr(e))
+
+    def getProvenance(self, key):
+        """
+        :return: the provenance of the words of a cached corpus, or None
+        """
+        fpath = self.path(key) + '.files.json'
+        if not os.path.exists(fpath):
+            return None
+        with open(fpath, mode='r', encoding='utf-8') as f:
+            return json.load(f, object_pairs_hook=collections.OrderedDict)
+
+    def evict(self):
+        """ Remove the least recently used corpora, until the cache fits in its maximum size
+        (the provenance of a corpus counts with it)
+        """
+        files = []
+        for fileName in os.listdir(self.cacheFolder):
+            if fileName.endswith('.corpus'):
+                info = os.stat(os.path.join(self.cacheFolder, fileName))
+                fileSize = info.st_size
+                if os.path.exists(os.path.join(self.cacheFolder, fileName + '.files.json')):
+                    fileSize += os.path.getsize(os.path.join(self.cacheFolder, fileName + '.files.json'))
+                files.append((info.st_mtime, fileSize, fileName))
+        size = sum(file[1] for file in files)
+        for mtime, fileSize, fileName in sorted(files):
+            if size <= self.maxSize:
+                break
+            logging.info("Removing %s from the cache", fileName)
+            os.remove(os.path.join(self.cacheFolder, fileName))
+            if os.path.exists(os.path.join(self.cacheFolder, fileName + '.files.json')):
+                os.remove(os.path.join(self.cacheFolder, fileName + '.files.json'))
+            size -= fileSize
+
+
+# --------------------------------------------------------------------------------------------------
+# A function to compute the key of a corpus after a list of stages, e.g.
+# [('load', corpus hash, minimum length), ('stopwords', stopwords hash), ('preprocess', flags), ...]
+# --------------------------------------------------------------------------------------------------
+def stageKey(stages):
+    """
+    :param stages: list of stages (tuples of the stage name and all its options)
+    :return: key, as hex string
+    """
+    return hashlib.sha1(repr([ctEncodedCorpusVersion] + list(stages)).encode('utf-8')).hexdigest()
+
+
+# --------------------------------------------------
+# A function to load the stopwords once, as a set
+# --------------------------------------------------
+def loadStopwords(fileName, normalize=None):
+    """
+    :param fileName: Stopwords file
+    :param normalize: normalizer (see buildNormalizer): the normalized forms of the stopwords are added too,
+                      e.g. 'si' for 'și' (None = the stopwords as they are)
+    :return: frozenset of stopwords
+    """
+    stopwords = set(loadWords(fileName))
+    if normalize:
+        stopwords.update(word for word in map(normalize, list(stopwords)) if word)
+    logging.info("%s stopwords loaded.", '{:,}'.format(len(stopwords)))
+    return frozenset(stopwords)
+
+
+# --------------------------------------------------
+# A function to remove a set of words from a corpus
+# We'll use it to remove the stopwords
+# --------------------------------------------------
+def removeStopwords(words, stopwords):
+    """ Remove stopwords from corpus
+    :param stopwords: set of stopwords (see loadStopwords; any other iterable is converted to a set first)
+    :return: list of words minus stopwords (a generator, if words is a stream)
+    """
+    wordsAux = []
+    if stopwords and words:
+        logging.info("Removing stopwords...")
+        if not isinstance(stopwords, (set, frozenset)):
+            stopwords = frozenset(stopwords)
+        if isinstance(words, EncodedCorpus):
+            wordsAux = remapCorpus(words, lambda word: None if word in stopwords else word)
+            logging.info("%s words retained from text.", '{:,}'.format(len(wordsAux)))
+            return wordsAux
+        if isinstance(words, collections.Counter):
+            wordsAux = remapCounts(words, lambda word: None if word in stopwords else word)
+            logging.info("%s words retained from text.", '{:,}'.format(sum(wordsAux.values())))
+            return wordsAux
+        if isStream(words):
+            return (x for x in words if x not in stopwords)
+        wordsAux = [x for x in words if x not in stopwords]
+        logging.info("%s words retained from text.", '{:,}'.format(len(wordsAux)))
+    return wordsAux
+
+
+# --------------------------------------------------
+# A function to remove unicode punctuation
+# --------------------------------------------------
+def removeUnicodePunctuation(text):
+    """ Removes unicode punctuation
+    :param text:
+    :return: string without unicode punctuation
+    """
+    return text.translate(ctUnicodePunctuationTable)
+
+
+# --------------------------------------------------
+# A function to remove Romanian diacritics
+# --------------------------------------------------
+def removeDiacritics(text):
+    """ Replaces diacritics
+    :param text:
+    :return: string without diacritics
+    """
+    return text.translate(ctDiacriticsTable)
+
+
+# ---------------------------------------------------------------------------------------
+# A function to build a word normalizer doing all the generic pre-processing in one pass
+# The translation tables are computed once and every distinct word is normalized once
+# ---------------------------------------------------------------------------------------
+def buildNormalizer(lowercase=True, unicode=True, diacritics=True, punctuation=True, digits=True,
+                    cacheSize=ctNormalizerCacheSize):
+    """ Build a single-pass word normalizer, see preProcess for the meaning of the flags
+    :param cacheSize: maximum number of distinct words whose normalized form is remembered
+    :return: function returning the normalized word, or None if the word has to be dropped
+    """
+    # First table: unicode punctuation becomes a space, diacritics become plain letters
+    replaceTable = {}
+    if unicode:
+        replaceTable.update(ctUnicodePunctuationTable)
+    if diacritics:
+        replaceTable.update(ctDiacriticsTable)
+
+    # Second table: punctuation and digits are deleted (after the punctuation tokens have been filtered)
+    deleteTable = {}
+    if punctuation:
+        deleteTable.update(dict.fromkeys(map(ord, ctPunctuation)))
+    if digits:
+        deleteTable.update(dict.fromkeys(map(ord, ctDigits)))
+
+    punctuationTokens = frozenset(ctPunctuationTokens) if punctuation else frozenset()
+    cache = {}
+
+    def normalize(word):
+        try:
+            return cache[word]
+        except KeyError:
+            pass
+        res = word.lower() if lowercase else word
+        res = res.translate(replaceTable)
+        if res in punctuationTokens:
+            res = None
+        else:
+            res = res.translate(deleteTable)
+            if res.strip() == '':
+                res = None
+        if len(cache) < cacheSize:
+            cache[word] = res
+        return res
+
+    return normalize
+
+
+# -----------------------------------------------------------------
+# A function to do some generic pre-processing on a corpus of words
+# -----------------------------------------------------------------
+def preProcess(document, lowercase=True, unicode=True, diacritics=True, punctuation=True, digits=True, normalize=None):
+    """ Pre-process corpora for training
+    :param sentences: The corpora sentences (list, or a stream of words)
+    :param lowercase: change all text to lowercase? (True/False, default = True)
+    :param unicode: remove Unicode punctuation? (True/False, default = True)
+    :param diacritics: remove diacritics? (True/False, default = True)
+    :param punctuation: remove punctuation? (True/False, default = True)
+    :param digits: remove digits? (True/False, default = True)
+    :param normalize: normalizer built with buildNormalizer, e.g. shared by several corpora (None = build it here)
+    :return: preprocessed list of words (a generator, if document is a stream)
+    """
+    if normalize is None:
+        normalize = buildNormalizer(lowercase, unicode, diacritics, punctuation, digits)
+
+    if isinstance(document, EncodedCorpus):
+        logging.info('Pre-processsing %s distinct words...', '{:,}'.format(len(document.vocabulary)))
+        document = remapCorpus(document, normalize)
+        logging.info('%s words remaining', '{:,}'.format(len(document)))
+        return document
+
+    if isinstance(document, collections.Counter):
+        logging.info('Pre-processsing %s distinct words...', '{:,}'.format(len(document)))
+        document = remapCounts(document, normalize)
+        logging.info('%s words remaining', '{:,}'.format(sum(document.values())))
+        return document
+
+    if isStream(document):
+        logging.info('Pre-processsing stream of words...')
+        return (word for word in map(normalize, document) if word is not None)
+
+    numWords = len(document)
+
+    logging.info('Pre-processsing %s words...', '{:,}'.format(numWords))
+
+    # Normalize every word in one pass and remove potential void words
+    document = [word for word in map(normalize, document) if word is not None]
+
+    logging.info('Pre-processing of %s words finished successfully!', '{:,}'.format(numWords))
+    logging.info('%s words remaining', '{:,}'.format(len(document)))
+
+    return document
+
+
+# ------------------------------------------------------------------------
+# A function to detect the language of a corpus from a random sample of its words
+# ------------------------------------------------------------------------
+def detectLanguage(words, sampleSize=ctLanguageSampleSize):
+    """ Detect the corpus language, for the Snowball stemmer
+    :param words: list of words
+    :param sampleSize: maximum number of words handed to the language detector
+    :return: the stemmer language (english, if the detected language is not supported)
+    """
+    stemmerLanguage = 'english'
+    if words:
+        sample = words
+        if len(words) > sampleSize:
+            # A fixed seed, so that the same corpus is always stemmed in the same language
+            sample = random.Random(0).sample(words, sampleSize)
+        try:
+            detectedLanguage = detect(' '.join(sample))
+            if detectedLanguage in ctLanguages:
+                stemmerLanguage = ctLanguages[detectedLanguage]
+        except Exception as e:
+            logging.info(repr(e))
+        logging.info("Stemming language: %s (detected from %s words).", stemmerLanguage, '{:,}'.format(len(sample)))
+    return stemmerLanguage
+
+
+# ------------------------------------------------------------------------
+# Functions to save / load the stems cache of a language to / from disk
+# We'll use them to reuse the stems computed by previous runs
+# ------------------------------------------------------------------------
+def stemCacheFile(cacheFolder, language):
+    return os.path.join(cacheFolder, 'stems_' + language + '.pickle')
+
+
+def loadStemCache(cacheFolder, language):
+    """
+    :param cacheFolder: The folder holding the stems caches
+    :param language: The stemmer language
+    :return: dictionary of word -> stem (empty, if there is no cache yet)
+    """
+    stems = {}
+    fpath = stemCacheFile(cacheFolder, language)
+    if os.path.exists(fpath):
+        try:
+            with open(fpath, mode='rb') as f:
+                stems = pickle.load(f)
+            logging.info("%s stems loaded from file %s", '{:,}'.format(len(stems)), fpath)
+        except Exception as e:
+            logging.info(repr(e))
+    return stems
+
+
+def saveStemCache(stems, cacheFolder, language, cacheSize=None):
+    """
+    :param stems: dictionary of word -> stem (the most recently used last)
+    :param cacheFolder: The folder holding the stems caches
+    :param language: The stemmer language
+    :param cacheSize: maximum number of saved stems, the most recently used ones (None = no limit)
+    """
+    if stems:
+        if not os.path.exists(cacheFolder):
+            os.makedirs(cacheFolder)
+        try:
+            fpath = stemCacheFile(cacheFolder, language)
+            if cacheSize is not None and len(stems) > cacheSize:
+                stems = itertools.islice(stems.items(), len(stems) - cacheSize, None)
+            stems = dict(stems)
+            logging.info("Saving %s stems to file %s", '{:,}'.format(len(stems)), fpath)
+            with replaceFile(fpath) as temporary, open(temporary, mode='wb') as f:
+                pickle.dump(stems, f, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            logging.info(repr(e))
+
+
+# ------------------------------------------------------------------------
+# A function to build a memoized Snowball stemmer
+# Every distinct word is stemmed only once, then its stem is taken from the cache
+# ------------------------------------------------------------------------
+def buildStemmer(language, cacheSize=None, cacheFolder=None):
+    """
+    :param language: The stemmer language
+    :param cacheSize: maximum number of cached stems, least recently used evicted first (None = no limit)
+    :param cacheFolder: The folder holding the stems caches, to reuse them across runs (None = no reuse)
+    :return: function returning the stem of a word; its cache is available as the attribute .stems,
+             its size as .cacheSize and the number of words stemmed (not found in the cache) as .misses
+    """
+    stemmer = stem.SnowballStemmer(language)
+    stems = loadStemCache(cacheFolder, language) if cacheFolder else {}
+
+    if cacheSize is None:
+        def stemWord(word):
+            try:
+                return stems[word]
+            except KeyError:
+                res = stems[word] = stemmer.stem(word)
+                stemWord.misses += 1
+                return res
+    else:
+        # The saved stems are the most recently used last
+        stems = collections.OrderedDict(itertools.islice(stems.items(), max(len(stems) - cacheSize, 0), None))
+
+        def stemWord(word):
+            try:
+                stems.move_to_end(word)
+                return stems[word]
+            except KeyError:
+                res = stems[word] = stemmer.stem(word)
+                stemWord.misses += 1
+                if len(stems) > cacheSize:
+                    stems.popitem(last=False)
+                return res
+
+    stemWord.stems = stems
+    stemWord.cacheSize = cacheSize
+    stemWord.misses = 0
+    return stemWord
+
+
+def stemStream(words, stemWord, language, cacheFolder):
+    yield from map(stemWord, words)
+    if cacheFolder:
+        saveStemCache(stemWord.stems, cacheFolder, language, stemWord.cacheSize)
+
+
+# ------------------------------------------------------------------------
+# A function to remove morphological affixes from corpus (Snowball stemmer)
+# ------------------------------------------------------------------------
+def doStemming(words, language=None, sampleSize=ctLanguageSampleSize, cacheSize=None, cacheFolder=None, stemmer=None):
+    """ Apply the Snowball stemmer, in the language detected from the corpus
+    :param words: list of words, or a stream of words
+    :param language: The stemmer language (None = detect it from a sample of the corpus)
+    :param sampleSize: maximum number of words used for detecting the language
+    :param cacheSize: maximum number of cached stems (None = no limit)
+    :param cacheFolder: The folder in which the stems are saved, to be reused by the next runs (None = no reuse)
+    :param stemmer: function returning the stemmer of a language, e.g. shared by several corpora
+                    (None = build a new stemmer, see buildStemmer)
+    :return: list of stemmed words (a generator, if words is a stream)
+    """
+    if stemmer is None:
+        def stemmer(stemmerLanguage):
+            return buildStemmer(stemmerLanguage, cacheSize, cacheFolder)
+
+    stemmed = []
+    if words:
+        if isinstance(words, EncodedCorpus):
+            # Detect the language on a sample of the corpus, then stem the vocabulary only
+            positions = random.Random(0).sample(range(len(words)), min(sampleSize, len(words)))
+            sample = [words.vocabulary[words.ids[position]] for position in positions]
+            stemmerLanguage = language or detectLanguage(sample, sampleSize)
+            stemWord = stemmer(stemmerLanguage)
+            stemmed = remapCorpus(words, stemWord)
+            logging.info("%s distinct words stemmed to %s distinct stems.",
+                         '{:,}'.format(len(words.vocabulary)), '{:,}'.format(len(stemmed.vocabulary)))
+            if cacheFolder:
+                saveStemCache(stemWord.stems, cacheFolder, stemmerLanguage, stemWord.cacheSize)
+            return stemmed
+        if isinstance(words, collections.Counter):
+            # Detect the language on a sample drawn according to the word frequencies, then stem the words once
+            sample = random.Random(0).choices(list(words.keys()), weights=list(words.values()),
+                                              k=min(sampleSize, sum(words.values())))
+            stemmerLanguage = language or detectLanguage(sample, sampleSize)
+            stemWord = stemmer(stemmerLanguage)
+            stemmed = remapCounts(words, stemWord)
+            logging.info("%s distinct words stemmed to %s distinct stems.",
+                         '{:,}'.format(len(words)), '{:,}'.format(len(stemmed)))
+            if cacheFolder:
+                saveStemCache(stemWord.stems, cacheFolder, stemmerLanguage, stemWord.cacheSize)
+            return stemmed
+        if isStream(words):
+            # Detect the language on the head of the stream only, then put the head back in front of it
+            head = list(itertools.islice(words, sampleSize * 10))
+            if not head:
+                return stemmed
+            words = itertools.chain(head, words)
+            stemmerLanguage = language or detectLanguage(head, sampleSize)
+        else:
+            stemmerLanguage = language or detectLanguage(words, sampleSize)
+        stemWord = stemmer(stemmerLanguage)
+        if isStream(words):
+            return stemStream(words, stemWord, stemmerLanguage, cacheFolder)
+        stemmed = list(map(stemWord, words))
+        logging.info("%s words stemmed, %s distinct stems cached.",
+                     '{:,}'.format(len(stemmed)), '{:,}'.format(len(stemWord.stems)))
+        if cacheFolder:
+            saveStemCache(stemWord.stems, cacheFolder, stemmerLanguage, stemWord.cacheSize)
+    return stemmed
+
+
+# ------------------------------------------------------------------------
+# A function to find and mark collocations (bi-grams) in a corpus of text
+# ------------------------------------------------------------------------
+def findCollocations(words, bigramMethod, topK=ctTopBigrams, minPMI=None, minCount=2, processes=0):
+    """ Find the collocations (bi-grams) of the corpus and mark them (word1_word2)
+    :param words: list of words, or EncodedCorpus
+    :param bigramMethod: 0 = DICTIONARY, 1 = REGEX, 2 = FULL SCAN, 3 = RANKED MERGE
+    :param topK: maximum number of bi-grams, the ones with the highest PMI (None = no maximum)
+    :param minPMI: minimum PMI of a bi-gram (None = no minimum)
+    :param minCount: minimum frequency of a bi-gram
+    :param processes: Number of processes counting the bi-grams of an EncodedCorpus in parallel (0 = none)
+    :return: list of words (EncodedCorpus, if words is an EncodedCorpus) with the collocations marked
+    """
+    if isinstance(words, EncodedCorpus):
+        return findEncodedCollocations(words, bigramMethod, topK, minPMI, minCount, processes)
+    if words and bigramMethod == 3:
+        # ----------------------------------------------------------------------------------------
+        # METHOD 4 - RANKED MERGE
+        # Same as FULL SCAN, but all bi-grams are applied in a single pass (see mergeRankedBigrams)
+        # ----------------------------------------------------------------------------------------
+        # +++ The order of applying bi-grams to corpus is guaranteed, and it is fast
+        # ----------------------------------------------------------------------------------------
+        document = list(findEncodedCollocations(encodeWords(words), bigramMethod, topK, minPMI, minCount))
+        words.clear()
+        words = document
+    elif words:
+        # Find collocations (Manning's algorithm, scored with NumPy on the encoded corpus, same results as NLTK)
+        corpus = encodeWords(words)
+        numTypes = len(corpus.vocabulary)
+        keys, counts, scores = scoreEncodedBigrams(corpus, minCount, minPMI, topK)
+        logging.info("%s bi-grams selected.", '{:,}'.format(len(keys)))
+
+        # Mark collocations in corpus
+        if bigramMethod == 0:
+
+            # ---------------------------------------------------------------------------------------
+            # METHOD 3 - DICTIONARY
+            # Put bi-grams in a set (of packed keys id1 * V + id2) then loop over the whole corpus once and
+            # check if two successive words are part of a bi-gram from the set
+            # ---------------------------------------------------------------------------------------
+            # +++ Very fast !
+            # ---
+            # ---------------------------------------------------------------------------------------
+            topBigramsKeys = set(keys.tolist())
+            ids = corpus.ids
+
+            # Now mark collocations in corpus
+            document = []
+            skipIndex = -1
+            for index, word in enumerate(words):
+                if index != skipIndex and \
+                        index < len(words) - 1 and \
+                        word and words[index + 1] and \
+                        word != words[index + 1] and \
+                        len(word) > 1 and len(words[index + 1]) > 1 and \
+                        word not in ctPunctuationTokens and words[index + 1] not in ctPunctuationTokens:
+
+                    if ids[index] * numTypes + ids[index + 1] not in topBigramsKeys:
+                        document.append(word)
+                    else:
+                        document.append(word + '_' + words[index + 1])
+                        skipIndex = index + 1
+
+            words.clear()
+            words = document
+
+        else:
+            topBigrams = [(corpus.vocabulary[key // numTypes], corpus.vocabulary[key % numTypes])
+                          for key in keys.tolist()]
+
+        if bigramMethod == 1:
+
+            # ---------------------------------------------------------------------------------------------
+            # METHOD 1 - REGEX
+            # We use a regex to identify & replace all occurrences of the first bi-gram in the full corpus.
+            # Then we move to the second bi-gram and so forth...
+            # ---------------------------------------------------------------------------------------------
+            # +++ We try to use a regex to identify all occurrences of a bi-gram in corpus.
+            #     Then only we move to the next bi-gram.
+            #     The question is: which bi-gram should we apply first?
+            #     By default, we start with the most frequent ones but those are also the most trivial
+            # --- Very slow on larger corpora
+            #     The sequence of identification of all occurrences is not guaranteed
+            # ---------------------------------------------------------------------------------------------
+            corpus = ' '.join(words)
+            for b1, b2 in topBigrams:
+                if b1 and b2 and \
+                        b1 != b2 and \
+                        len(b1) > 1 and \
+                        len(b2) > 1 and \
+                        b1 not in ctPunctuationTokens and \
+                        b2 not in ctPunctuationTokens:
+                    bigramRegex = regex.compile(r'\b%s\b\s{1}\b%s\b' % (b1, b2))
+                    corpus = bigramRegex.sub(b1 + '_' + b2, corpus)
+
+            words.clear()
+            words = tokenize.word_tokenize(text=corpus, language='english')
+
+        elif bigramMethod == 2:
+            # ----------------------------------------------------------------------------------------
+            # METHOD 3 - FULL SCAN
+            # Apply the first bi-gram to the entire corpus, then the second and so forth...
+            # ----------------------------------------------------------------------------------------
+            # +++ It guarantees that a bi-gram is applied to ALL its occurrences in the text.
+            #     Then only we move to the next bi-gram.
+            #     The order of applying bi-grams to corpus is guaranteed.
+            #     The question is: which bi-gram should be applied first?
+            #     By default, we start with the most frequent ones but those are also the most trivial
             # --- Very very slow, even on smaller corpora!
             # ---------------------------------------------------------------------------------------
             for b1, b2 in topBigrams:
@@ -387,6 +2222,517 @@ def findCollocations(words, bigramMethod):
     return words
 
 
+# ------------------------------------------------------------------------
+# A function to view the ids of an EncodedCorpus as a NumPy array (no copy)
+# ------------------------------------------------------------------------
+def corpusIds(corpus):
+    """
+    :param corpus: EncodedCorpus
+    :return: int64 NumPy array of word ids
+    """
+    return np.frombuffer(corpus.ids, dtype=np.dtype('u%d' % corpus.ids.itemsize)).astype(np.int64)
+
+
+# ------------------------------------------------------------------------
+# A function to select and rank scored bi-grams (top k, minimum PMI)
+# Only the selected bi-grams are sorted: by decreasing PMI, then alphabetically, as NLTK does
+# ------------------------------------------------------------------------
+def rankBigrams(vocabulary, first, second, scores, minPMI=None, topK=None):
+    """
+    :param vocabulary: list of words (id -> word)
+    :param first: NumPy array of the ids of the first words of the bi-grams
+    :param second: NumPy array of the ids of the second words of the bi-grams
+    :param scores: NumPy array of the PMI of the bi-grams
+    :param minPMI: minimum PMI of a bi-gram (None = no minimum)
+    :param topK: maximum number of bi-grams, the ones with the highest PMI (None = no maximum)
+    :return: NumPy array of the indexes of the selected bi-grams, in rank order
+    """
+    selected = np.arange(len(scores))
+    if minPMI is not None:
+        selected = np.flatnonzero(scores >= minPMI)
+
+    # Equal scores are ordered alphabetically (only the words of the bi-grams need to be sorted)
+    words = np.unique(np.concatenate((first, second))).tolist()
+    alphabetical = np.zeros(len(vocabulary), dtype=np.int64)
+    alphabetical[sorted(words, key=vocabulary.__getitem__)] = np.arange(len(words))
+
+    if topK is not None and topK < len(selected):
+        # Partial sort: keep the scores above the k-th highest one, plus as many of the
+        # bi-grams scoring exactly as much as needed (the alphabetically first ones)
+        topK = max(topK, 0)
+        selectedScores = scores[selected]
+        kthScore = np.partition(selectedScores, len(selected) - topK)[len(selected) - topK] if topK else np.inf
+        above = selected[selectedScores > kthScore]
+        ties = selected[selectedScores == kthScore]
+        ties = ties[np.lexsort((alphabetical[second[ties]], alphabetical[first[ties]]))][:topK - len(above)]
+        selected = np.concatenate((above, ties))
+
+    order = np.lexsort((alphabetical[second[selected]], alphabetical[first[selected]], -scores[selected]))
+    return selected[order]
+
+
+# ------------------------------------------------------------------------
+# A function to compute the PMI of bi-grams, as NLTK's BigramAssocMeasures.pmi does
+# PMI = log2(n_ii * N) - log2(n_ix * n_xi)
+# ------------------------------------------------------------------------
+def pmiScores(counts, firstCounts, secondCounts, numWords):
+    return np.log2(counts.astype(np.float64) * numWords) - np.log2((firstCounts * secondCounts).astype(np.float64))
+
+
+# ------------------------------------------------------------------------
+# The functions to count the pairs of successive word ids, with NumPy
+# A pair never spans a sentence boundary (see loadSentenceCorpus). With several processes, the ids are split
+# in parts overlapping by one word (so that every pair is in exactly one part), the parts are counted
+# in parallel and their partial counts are merged
+# ------------------------------------------------------------------------
+def countPartBigrams(part):
+    """
+    :param part: (NumPy array of word ids, id of the sentence boundary or None)
+    :return: (pairs packed as id1 << 32 | id2, counts) NumPy arrays, sorted by pair
+    """
+    ids, boundary = part
+    ids = ids.astype(np.int64)
+    pairs = (ids[:-1] << 32) | ids[1:]
+    if boundary is not None:
+        pairs = pairs[(ids[:-1] != boundary) & (ids[1:] != boundary)]
+    return np.unique(pairs, return_counts=True)
+
+
+def countBigrams(ids, boundary=None, processes=0, partsPerProcess=4):
+    """
+    :param ids: NumPy array of word ids
+    :param boundary: id of the sentence boundary (None = no sentences)
+    :param processes: Number of processes counting parts of the corpus in parallel (0 = none)
+    :param partsPerProcess: Number of parts per process, for balancing the load
+    :return: (pairs packed as id1 << 32 | id2, counts) NumPy arrays, sorted by pair
+    """
+    numParts = processes * partsPerProcess if processes > 1 else 1
+    if numParts == 1 or len(ids) < 2 * numParts:
+        return countPartBigrams((ids, boundary))
+
+    # The ids travel to the processes as 32-bit integers
+    bounds = np.linspace(0, len(ids) - 1, numParts + 1).astype(np.int64).tolist()
+    parts = [(ids[start:end + 1].astype(np.uint32), boundary) for start, end in zip(bounds[:-1], bounds[1:])]
+    with multiprocessing.Pool(processes) as pool:
+        partialCounts = pool.map(countPartBigrams, parts)
+    pairs, inverse = np.unique(np.concatenate([pairs for pairs, counts in partialCounts]), return_inverse=True)
+    counts = np.bincount(inverse, weights=np.concatenate([counts for pairs, counts in partialCounts]),
+                         minlength=len(pairs)).astype(np.int64)
+    return pairs, counts
+
+
+# ------------------------------------------------------------------------
+# A function to score the bi-grams of an EncodedCorpus by PMI, with NumPy
+# Every pair of successive ids is counted (see countBigrams), then packed in one int64 key (id1 * V + id2)
+# Same counts, filter, scores and order as NLTK's BigramCollocationFinder (window_size=2)
+# In a corpus of sentences, the sentence boundaries are neither words nor parts of bi-grams
+# ------------------------------------------------------------------------
+def scoreEncodedBigrams(corpus, minCount=2, minPMI=None, topK=None, processes=0):
+    """
+    :param corpus: EncodedCorpus
+    :param minCount: minimum frequency of a bi-gram
+    :param minPMI: minimum PMI of a bi-gram (None = no minimum)
+    :param topK: maximum number of bi-grams, the ones with the highest PMI (None = no maximum)
+    :param processes: Number of processes counting the bi-grams in parallel (0 = none)
+    :return: (keys, counts, scores) NumPy arrays, ordered by decreasing PMI, then alphabetically
+    """
+    vocabulary = corpus.vocabulary
+    numTypes = len(vocabulary)
+    ids = corpusIds(corpus)
+    boundary = corpus.index.get(ctSentenceBoundary)
+
+    pairs, counts = countBigrams(ids, boundary, processes)
+    retained = counts >= minCount
+    pairs = pairs[retained]
+    counts = counts[retained]
+
+    unigrams = np.bincount(ids, minlength=numTypes)
+    numWords = len(ids) - (unigrams[boundary] if boundary is not None else 0)
+    first = pairs >> 32
+    second = pairs & 0xFFFFFFFF
+    keys = first * numTypes + second
+    scores = pmiScores(counts, unigrams[first], unigrams[second], numWords)
+
+    order = rankBigrams(vocabulary, first, second, scores, minPMI, topK)
+    return keys[order], counts[order], scores[order]
+
+
+# ------------------------------------------------------------------------
+# A function to find and mark collocations (bi-grams) in an EncodedCorpus
+# The DICTIONARY method works on ids; REGEX and FULL SCAN decode the corpus first
+# ------------------------------------------------------------------------
+def findEncodedCollocations(corpus, bigramMethod, topK=ctTopBigrams, minPMI=None, minCount=2, processes=0):
+    """
+    :param corpus: EncodedCorpus
+    :param bigramMethod: 0 = DICTIONARY, 1 = REGEX, 2 = FULL SCAN, 3 = RANKED MERGE
+    :param processes: Number of processes counting the bi-grams in parallel (0 = none)
+    :return: EncodedCorpus, with the collocations marked (sharing the vocabulary of corpus)
+    """
+    if not corpus:
+        return corpus
+
+    if bigramMethod == 3:
+        keys, counts, scores = scoreEncodedBigrams(corpus, minCount, minPMI, topK, processes)
+        logging.info("%s bi-grams selected.", '{:,}'.format(len(keys)))
+        return mergeRankedBigrams(corpus, keys)
+
+    if bigramMethod != 0:
+        if ctSentenceBoundary in corpus.index:
+            raise ValueError('The REGEX and FULL SCAN methods do not support sentences')
+        words = findCollocations(list(corpus), bigramMethod, topK, minPMI, minCount)
+        corpus.ids = array('I')
+        corpus.extend(words)
+        return corpus
+
+    vocabulary = corpus.vocabulary
+    numTypes = len(vocabulary)
+    keys, counts, scores = scoreEncodedBigrams(corpus, minCount, minPMI, topK, processes)
+    topBigrams = set(keys.tolist())
+    logging.info("%s bi-grams selected.", '{:,}'.format(len(topBigrams)))
+
+    # Same conditions as in findCollocations, precomputed once per distinct word
+    eligible = [len(word) > 1 and word not in ctPunctuationTokens for word in vocabulary]
+
+    # The sentence boundaries are always kept, and never part of a bi-gram (see loadSentenceCorpus)
+    boundary = corpus.index.get(ctSentenceBoundary)
+    if boundary is not None:
+        eligible[boundary] = False
+
+    ids = corpus.ids
+    document = array('I')
+    skipIndex = -1
+    for index in range(len(ids) - 1):
+        if index != skipIndex:
+            word = ids[index]
+            nextWord = ids[index + 1]
+            if word == boundary or (nextWord == boundary and eligible[word]):
+                document.append(word)
+            elif word != nextWord and eligible[word] and eligible[nextWord]:
+                if word * numTypes + nextWord in topBigrams:
+                    document.append(corpus.add(vocabulary[word] + '_' + vocabulary[nextWord]))
+                    skipIndex = index + 1
+                else:
+                    document.append(word)
+    if boundary is not None and len(ids) and ids[-1] == boundary:
+        document.append(boundary)
+
+    corpus.ids = document
+    return corpus
+
+
+# ------------------------------------------------------------------------
+# A function to mark ranked bi-grams in an EncodedCorpus, in a single pass over a priority queue
+# Same semantics as the FULL SCAN method: the bi-grams are applied in rank order and an earlier
+# bi-gram wins when two bi-grams overlap, but every position of the corpus is visited only once.
+# The corpus is kept as a linked list of positions: a merge removes the second word of the pair
+# and only the pairs formed with its neighbours have to be queued again
+# ------------------------------------------------------------------------
+def mergeRankedBigrams(corpus, keys):
+    """
+    :param corpus: EncodedCorpus
+    :param keys: NumPy array of ranked bi-gram keys (id1 * V + id2, V = size of the vocabulary), see scoreEncodedBigrams
+    :return: EncodedCorpus, with the collocations marked (sharing the vocabulary of corpus)
+    """
+    vocabulary = corpus.vocabulary
+    numTypes = len(vocabulary)
+
+    # The same bi-grams as the ones applied by FULL SCAN, ranked; pairs are packed as id1 << 32 | id2 from here on,
+    # because merging may add words to the vocabulary
+    eligible = [len(word) > 1 and word not in ctPunctuationTokens for word in vocabulary]
+    ranked = [(key // numTypes, key % numTypes) for key in keys.tolist()]
+    ranked = [(first, second) for first, second in ranked if first != second and eligible[first] and eligible[second]]
+    rankOf = {first << 32 | second: rank for rank, (first, second) in enumerate(ranked)}
+    if not rankOf:
+        return corpus
+
+    # Queue every position starting a ranked bi-gram, ordered by (rank, position): the positions found
+    # now are sorted once, the ones formed by the merges go to a heap
+    ids = corpusIds(corpus)
+    pairs = (ids[:-1] << 32) | ids[1:]
+    rankedPairs = np.fromiter(rankOf.keys(), dtype=np.int64, count=len(rankOf))
+    ranks = np.fromiter(rankOf.values(), dtype=np.int64, count=len(rankOf))
+    order = np.argsort(rankedPairs)
+    rankedPairs, ranks = rankedPairs[order], ranks[order]
+    found = np.minimum(np.searchsorted(rankedPairs, pairs), len(rankedPairs) - 1)
+    positions = np.flatnonzero(rankedPairs[found] == pairs)
+    ranks = ranks[found[positions]]
+    order = np.lexsort((positions, ranks))
+    queue = list(zip(ranks[order].tolist(), positions[order].tolist()))
+    heap = []
+    index = 0
+
+    # Linked list of positions; a merged (removed) position holds the word id -1
+    tokens = array('q', corpus.ids)
+    numWords = len(tokens)
+    nextPosition = array('q', range(1, numWords + 1))
+    nextPosition[-1] = -1
+    previousPosition = array('q', range(-1, numWords - 1))
+    merged = {}
+    numMerges = 0
+
+    while True:
+        if heap and (index == len(queue) or heap[0] < queue[index]):
+            rank, position = heapq.heappop(heap)
+        elif index < len(queue):
+            rank, position = queue[index]
+            index += 1
+        else:
+            break
+        first = tokens[position]
+        if first < 0:
+            continue
+        following = nextPosition[position]
+        if following < 0:
+            continue
+        pair = first << 32 | tokens[following]
+        if rankOf.get(pair) != rank:
+            # The pair at this position has changed since it was queued
+            continue
+
+        try:
+            word = merged[pair]
+        except KeyError:
+            word = merged[pair] = corpus.add(vocabulary[first] + '_' + vocabulary[tokens[following]])
+        tokens[position] = word
+        tokens[following] = -1
+        after = nextPosition[following]
+        nextPosition[position] = after
+        if after >= 0:
+            previousPosition[after] = position
+        numMerges += 1
+
+        # Queue the new pairs, if they are applied later than the current one
+        before = previousPosition[position]
+        if before >= 0:
+            newRank = rankOf.get(tokens[before] << 32 | word)
+            if newRank is not None and newRank > rank:
+                heapq.heappush(heap, (newRank, before))
+        if after >= 0:
+            newRank = rankOf.get(word << 32 | tokens[after])
+            if newRank is not None and newRank > rank:
+                heapq.heappush(heap, (newRank, position))
+
+    logging.info("%s collocations marked.", '{:,}'.format(numMerges))
+    corpus.ids = array('I', [token for token in tokens if token >= 0])
+    return corpus
+
+
+# ------------------------------------------------------------------------
+# An incremental collocation engine, for applying RANKED MERGE step after step (as byte-pair encoding does)
+# The word counts and the pair counts are kept from one step to the next, and so is the corpus, as an
+# array of positions linked to each other. A merge only updates the counts of the pairs formed with the
+# neighbours of the merged position, so the corpus is never counted again; only the positions of the
+# selected bi-grams are looked up in the array, with NumPy, at the beginning of each step
+# ------------------------------------------------------------------------
+class CollocationEngine(object):
+    """ Successive RANKED MERGE steps over an EncodedCorpus
+    """
+
+    def __init__(self, corpus, processes=0):
+        """
+        :param corpus: EncodedCorpus (its vocabulary is shared and grows with the merged words)
+        :param processes: Number of processes counting the pairs in parallel (0 = none)
+        """
+        self.vocabulary = corpus.vocabulary
+        self.encoded = corpus
+        self.processes = processes
+        ids = corpusIds(corpus)
+        self.numWords = len(ids)
+
+        # The pairs with a sentence boundary are never counted (see countBigrams), nor is the boundary a word
+        self.boundary = corpus.index.get(ctSentenceBoundary)
+
+        # Linked list of positions; a merged (removed) position holds the word id -1
+        self.tokens = array('q', corpus.ids)
+        self.nextPosition = array('q', range(1, self.numWords + 1))
+        if self.numWords:
+            self.nextPosition[-1] = -1
+        self.previousPosition = array('q', range(-1, self.numWords - 1))
+
+        self.merged = {}
+        self.eligible = []
+        self.step = 0
+        self._count(ids)
+
+    def _count(self, ids):
+        """ Count the words and the pairs of the corpus from scratch (pairs are packed as id1 << 32 | id2)
+        """
+        words, counts = np.unique(ids, return_counts=True)
+        self.unigrams = collections.Counter(dict(zip(words.tolist(), counts.tolist())))
+        pairs, counts = countBigrams(ids, self.boundary, self.processes)
+        self.pairCounts = dict(zip(pairs.tolist(), counts.tolist()))
+
+        # The pairs frequent enough to be candidates (at least minCount occurrences), kept up to date by the merges
+        self.minCount = None
+        self.frequent = set()
+
+    def _removePair(self, pair):
+        if self.boundary is not None and (pair >> 32 == self.boundary or pair & 0xFFFFFFFF == self.boundary):
+            return
+        count = self.pairCounts[pair] - 1
+        if count == self.minCount - 1:
+            self.frequent.discard(pair)
+        if count:
+            self.pairCounts[pair] = count
+        else:
+            del self.pairCounts[pair]
+
+    def _addPair(self, pair):
+        if self.boundary is not None and (pair >> 32 == self.boundary or pair & 0xFFFFFFFF == self.boundary):
+            return
+        count = self.pairCounts[pair] = self.pairCounts.get(pair, 0) + 1
+        if count == self.minCount:
+            self.frequent.add(pair)
+
+    def rank(self, topK=ctTopBigrams, minPMI=None, minCount=2):
+        """ Score and rank the current bi-grams, exactly as scoreEncodedBigrams would on the current corpus
+        :return: (first, second) NumPy arrays of the word ids of the ranked bi-grams
+        """
+        if minCount != self.minCount:
+            self.minCount = minCount
+            self.frequent = set(pair for pair, count in self.pairCounts.items() if count >= minCount)
+        numPairs = len(self.frequent)
+        pairs = np.fromiter(self.frequent, dtype=np.int64, count=numPairs)
+        counts = np.fromiter(map(self.pairCounts.__getitem__, self.frequent), dtype=np.int64, count=numPairs)
+        first = pairs >> 32
+        second = pairs & 0xFFFFFFFF
+        unigrams = np.zeros(len(self.vocabulary), dtype=np.int64)
+        unigrams[np.fromiter(self.unigrams.keys(), dtype=np.int64)] = np.fromiter(self.unigrams.values(), dtype=np.int64)
+        numWords = self.numWords - self.unigrams.get(self.boundary, 0)
+        scores = pmiScores(counts, unigrams[first], unigrams[second], numWords)
+        order = rankBigrams(self.vocabulary, first, second, scores, minPMI, topK)
+        return first[order], second[order]
+
+    def nextStep(self, topK=ctTopBigrams, minPMI=None, minCount=2):
+        """ Apply one RANKED MERGE step
+        :return: number of collocations marked
+        """
+        self.step += 1
+        vocabulary = self.vocabulary
+        tokens = self.tokens
+        nextPosition = self.nextPosition
+        previousPosition = self.previousPosition
+        unigrams = self.unigrams
+
+        # The same bi-grams as the ones applied by FULL SCAN / RANKED MERGE
+        eligible = self.eligible
+        eligible.extend(len(word) > 1 and word not in ctPunctuationTokens for word in vocabulary[len(eligible):])
+        first, second = self.rank(topK, minPMI, minCount)
+        if len(first):
+            eligible = np.array(eligible)
+            retained = (first != second) & eligible[first] & eligible[second]
+            first, second = first[retained], second[retained]
+        rankedPairs = (first << 32) | second
+        rankOf = dict(zip(rankedPairs.tolist(), range(len(rankedPairs))))
+        logging.info("Step %s: %s bi-grams selected.", self.step, '{:,}'.format(len(rankOf)))
+
+        # Queue every position starting a selected bi-gram, ordered by (rank, position): the positions found
+        # now are sorted once, the ones formed by the merges go to a heap
+        queue = []
+        if rankOf:
+            current = np.frombuffer(tokens, dtype=np.int64)
+            positions = np.flatnonzero(current >= 0)
+            pairs = (current[positions[:-1]] << 32) | current[positions[1:]]
+            order = np.argsort(rankedPairs)
+            found = np.minimum(np.searchsorted(rankedPairs[order], pairs), len(order) - 1)
+            matches = np.flatnonzero(rankedPairs[order][found] == pairs)
+            ranks = order[found[matches]]
+            positions = positions[matches]
+            order = np.lexsort((positions, ranks))
+            queue = list(zip(ranks[order].tolist(), positions[order].tolist()))
+        heap = []
+        index = 0
+
+        # Updating the counts merge by merge is worth it only when the step merges a small part of the corpus;
+        # otherwise the corpus is counted again (with NumPy) at the end of the step
+        incremental = len(queue) <= self.numWords * ctIncrementalRatio
+
+        numMerges = 0
+        while True:
+            if heap and (index == len(queue) or heap[0] < queue[index]):
+                rank, position = heapq.heappop(heap)
+            elif index < len(queue):
+                rank, position = queue[index]
+                index += 1
+            else:
+                break
+            first = tokens[position]
+            if first < 0:
+                continue
+            following = nextPosition[position]
+            if following < 0:
+                continue
+            second = tokens[following]
+            pair = first << 32 | second
+            if rankOf.get(pair) != rank:
+                # The pair at this position has changed since it was queued
+                continue
+
+            try:
+                word = self.merged[pair]
+            except KeyError:
+                word = self.merged[pair] = self.encoded.add(vocabulary[first] + '_' + vocabulary[second])
+
+            # Remove the pairs around the merged position, merge, then add the new pairs
+            # and queue them, if they are applied later than the current one
+            before = previousPosition[position]
+            after = nextPosition[following]
+            if incremental:
+                self._removePair(pair)
+                if before >= 0:
+                    self._removePair(tokens[before] << 32 | first)
+                if after >= 0:
+                    self._removePair(second << 32 | tokens[after])
+                unigrams[first] -= 1
+                unigrams[second] -= 1
+                unigrams[word] += 1
+            tokens[position] = word
+            tokens[following] = -1
+            nextPosition[position] = after
+            if after >= 0:
+                previousPosition[after] = position
+            self.numWords -= 1
+            numMerges += 1
+            if before >= 0:
+                newPair = tokens[before] << 32 | word
+                if incremental:
+                    self._addPair(newPair)
+                newRank = rankOf.get(newPair)
+                if newRank is not None and newRank > rank:
+                    heapq.heappush(heap, (newRank, before))
+            if after >= 0:
+                newPair = word << 32 | tokens[after]
+                if incremental:
+                    self._addPair(newPair)
+                newRank = rankOf.get(newPair)
+                if newRank is not None and newRank > rank:
+                    heapq.heappush(heap, (newRank, position))
+
+        if incremental:
+            for wordId in [wordId for wordId, count in unigrams.items() if count <= 0]:
+                del unigrams[wordId]
+        else:
+            current = np.frombuffer(tokens, dtype=np.int64)
+            self._count(current[current >= 0])
+        logging.info("Step %s: %s collocations marked (%s).", self.step, '{:,}'.format(numMerges),
+                     'counts updated' if incremental else 'corpus counted again')
+        return numMerges
+
+    def corpus(self):
+        """
+        :return: the current EncodedCorpus (decoded only if iterated)
+        """
+        self.encoded.ids = array('I', [token for token in self.tokens if token >= 0])
+        return self.encoded
+
+    def counts(self):
+        """
+        :return: Counter of word -> absolute frequency, in the current corpus
+        """
+        vocabulary = self.vocabulary
+        return collections.Counter({vocabulary[wordId]: count for wordId, count in self.unigrams.items()})
+
+
 # # -------------------------------------------------------------------
 # # A function to find and mark bi-grams in a corpus of text
 # # -------------------------------------------------------------------
@@ -404,13 +2750,96 @@ def findCollocations(words, bigramMethod):
 #     return sentences
 
 
+# ------------------------------------------------------------------------
+# A function to count the collocations of a dictionary by length (number of '_'), in a single pass
+# ------------------------------------------------------------------------
+def underscoreHistogram(dictionary, buckets=10):
+    """
+    :param dictionary: collection of words
+    :param buckets: number of lengths counted separately
+    :return: list of buckets + 1 counts: words with 1, 2, ... buckets '_', then words with more than buckets '_'
+    """
+    histogram = [0] * (buckets + 1)
+    for word in dictionary:
+        length = word.count('_')
+        if length > buckets:
+            histogram[buckets] += 1
+        elif length > 0:
+            histogram[length - 1] += 1
+    return histogram
+
+
+# ------------------------------------------------------------------------
+# A scheduler of collocation steps: it applies findCollocations (or the CollocationEngine, for RANKED MERGE)
+# step after step, until a step finds no new collocations, the gain of a step drops below a threshold,
+# or the maximum number of steps is reached
+# ------------------------------------------------------------------------
+def collocationSteps(words, bigramMethod, maxSteps=10, minGain=0.0, topK=ctTopBigrams, minPMI=None, minCount=2,
+                     processes=0):
+    """
+    :param words: EncodedCorpus (of sentences, or not: see loadSentenceCorpus)
+    :param bigramMethod: 0 = DICTIONARY, 1 = REGEX, 2 = FULL SCAN, 3 = RANKED MERGE
+    :param maxSteps: maximum number of steps
+    :param minGain: minimum share of new collocations among the collocations of a step, for going on
+    :param processes: Number of processes counting the bi-grams in parallel (0 = none)
+    :return: generator of (words, dictionary of collocations -> absolute frequency, statistics of the step)
+    """
+    # RANKED MERGE keeps its counts from one step to the next, instead of counting the corpus at every step
+    engine = CollocationEngine(words, processes) if bigramMethod == 3 else None
+    previous = set()
+
+    # The sentence boundaries are never merged nor dropped: every step must keep all of them
+    numSentences = np.count_nonzero(corpusIds(words) == words.index.get(ctSentenceBoundary, -1))
+
+    for step in range(1, maxSteps + 1):
+        start = time.perf_counter()
+        merges = None
+        if engine:
+            merges = engine.nextStep(topK=topK, minPMI=minPMI, minCount=minCount)
+            words = engine.corpus()
+            counts = engine.counts()
+        else:
+            words = findCollocations(words, bigramMethod, topK=topK, minPMI=minPMI, minCount=minCount,
+                                     processes=processes)
+            counts = words.counts()
+        boundaries = counts.pop(ctSentenceBoundary, 0)
+        if boundaries != numSentences:
+            raise RuntimeError('Step %s: %s sentence boundaries instead of %s' %
+                               (step, '{:,}'.format(boundaries), '{:,}'.format(numSentences)))
+
+        collocations = remapCounts(counts, lambda word: word if word.count('_') > 0 else None)
+        dictionary = buildDictionary(collocations, freqType=1) or collections.Counter()
+        newCollocations = len(dictionary.keys() - previous)
+        gain = newCollocations / len(dictionary) if dictionary else 0.0
+        previous = set(dictionary)
+
+        statistics = collections.OrderedDict([
+            ('step', step),
+            ('merges', merges),
+            ('newCollocations', newCollocations),
+            ('gain', gain),
+            ('collocations', len(dictionary)),
+            ('vocabularySize', len(counts)),
+            ('tokens', sum(counts.values())),
+            ('histogram', underscoreHistogram(dictionary)),
+            ('seconds', time.perf_counter() - start)])
+        logging.info("Step %s: %s new collocations (gain %.4f), %s tokens, %s distinct words, %.3fs.", step,
+                     '{:,}'.format(newCollocations), gain, '{:,}'.format(statistics['tokens']),
+                     '{:,}'.format(statistics['vocabularySize']), statistics['seconds'])
+        yield words, dictionary, statistics
+
+        if newCollocations == 0 or gain < minGain:
+            logging.info("Collocations converged after %s steps.", step)
+            break
+
+
 # ------------------------------------------------------------------------------------------------------------------
 # A function to count the relative frequencies of elements in an iterable (an unordered set of generic elements)
 # We'll use it to count the absolute frequencies of words in our corpus
 # ------------------------------------------------------------------------------------------------------------------
 def buildDictionary(setOfWords, freqType=0):
     """ Build dictionary of unique setOfWords, with absolute / relative frequencies
-    :param setOfWords: the corpus
+    :param setOfWords: the corpus (or a Counter of its words, e.g. returned by countWordsParallel)
     :param freqType: 0 = Relative, 1 = Absolute
     :return:
 
@@ -421,14 +2850,21 @@ def buildDictionary(setOfWords, freqType=0):
         try:
             dictionary = collections.Counter()
             # Use an auxiliary Counter to compute relative (instead of absolute) frequencies
-            dictionary_aux = collections.Counter(setOfWords)
+            if isinstance(setOfWords, collections.Counter):
+                dictionary_aux = setOfWords
+            elif isinstance(setOfWords, EncodedCorpus):
+                dictionary_aux = setOfWords.counts()
+            else:
+                dictionary_aux = collections.Counter(setOfWords)
+            total = sum(dictionary_aux.values())
             for key, value in dictionary_aux.items():
                 if value > 1:
                     if freqType == 0:
-                        dictionary[key] = value / sum(dictionary_aux.values())
+                        dictionary[key] = value / total
                     else:
                         dictionary[key] = value
-            dictionary_aux.clear()
+            if dictionary_aux is not setOfWords:
+                dictionary_aux.clear()
             logging.info("Dictionary built. %s words retained.", '{:,}'.format(len(dictionary)))
         except Exception as e:
             logging.info(repr(e))
@@ -440,6 +2876,7 @@ def buildDictionary(setOfWords, freqType=0):
 # -------------------------------------------------------------------
 def showMostFrequent(dictionary, n, type):
     """ Print most frequent n words from dictionary
+    :param dictionary: Counter, or list of (word, frequency) already sorted by frequency
     :param n: Number of most frequent n words from dictionary
     """
     if dictionary:
@@ -449,22 +2886,232 @@ def showMostFrequent(dictionary, n, type):
         elif type == 1:
             format = '\t%s. %s %s'
         logging.info('Let''s display the first %s most frequent words, along with their frequencies', n)
-        for word in enumerate(dictionary.most_common(n)):
+        mostCommon = dictionary[:n] if isinstance(dictionary, list) else dictionary.most_common(n)
+        for word in enumerate(mostCommon):
             logging.info(format, '{:,}'.format(word[0] + 1), word[1][0], word[1][1])
 
 
+# -------------------------------------------------------------------
+# A function to write a file through a temporary file, renamed only once complete:
+# with replaceFile(fpath) as temporary: ... (the temporary file is removed if writing fails)
+# -------------------------------------------------------------------
+@contextlib.contextmanager
+def replaceFile(fpath):
+    """
+    :param fpath: the file to be written
+    :return: the name of the temporary file
+    """
+    try:
+        yield fpath + '.tmp'
+        os.replace(fpath + '.tmp', fpath)
+    finally:
+        if os.path.exists(fpath + '.tmp'):
+            os.remove(fpath + '.tmp')
+
+
 # -------------------------------------------------------------------
 # A function to save a dictionary (key, value) to a file on disk
 # -------------------------------------------------------------------
-def saveToCSVFile(text, folderName, fileName, suffix):
+def saveToCSVFile(rows, folderName, fileName, suffix, delimiter='\t', bufferSize=ctCSVBufferSize, compress=False):
     """
-    :param text: text to be saved to file
+    :param rows: rows to be saved to file (any iterable, e.g. a generator, of lists / tuples of values)
     :param fileName: The sub-folder in which we'll save the file
     :param suffix: an optional suffix for the resulting dictionary file name
+    :param delimiter: the column delimiter
+    :param bufferSize: size of the write buffer, in bytes
+    :param compress: compress the file with gzip? (True/False, default = False)
     """
     fileType = 'dictionary'
-    extension = '.csv'
-    if text:
+    extension = '.csv.gz' if compress else '.csv'
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is not None:
+        fpath = os.path.join(folderName)
+        if not os.path.exists(fpath):
+            os.makedirs(fpath)
+        try:
+            fpath = os.path.join(folderName, fileName + suffix + extension)
+            logging.info("Saving %s to file " % fileType + fpath)
+            # Write to a temporary file, renamed only once complete
+            with replaceFile(fpath) as temporary:
+                if compress:
+                    f = io.TextIOWrapper(io.BufferedWriter(gzip.GzipFile(temporary, mode='wb'), bufferSize),
+                                         encoding='utf-8', newline='')
+                else:
+                    f = open(temporary, mode='w', encoding='utf-8', newline='', buffering=bufferSize)
+                with f:
+                    writer = csv.writer(f, delimiter=delimiter, lineterminator='\n')
+                    writer.writerow(first)
+                    writer.writerows(rows)
+        except Exception as e:
+            logging.info(repr(e))
+
+
+# --------------------------------------------------------------------------------------------------
+# A function to save a dictionary (word, frequency) to a binary index on disk, sorted by word:
+# header (magic, version, number of words, size of the string table), the offsets of the words in the
+# string table (uint64, one more than the words), their frequencies (float64), then the string table
+# (the UTF-8 words, one after the other), all little-endian - see FrequencyIndex for the lookups
+# --------------------------------------------------------------------------------------------------
+def saveToIndexFile(dictionary, folderName, fileName, suffix):
+    """
+    :param dictionary: dictionary (or iterable of rows) of word -> frequency
+    :param fileName: The sub-folder in which we'll save the file
+    :param suffix: an optional suffix for the resulting index file name
+    """
+    fileType = 'frequency index'
+    extension = '.idx'
+    rows = dictionary.items() if isinstance(dictionary, collections.abc.Mapping) else dictionary
+    rows = sorted((str(word).encode('utf-8'), frequency) for word, frequency in rows)
+    if rows:
+        fpath = os.path.join(folderName)
+        if not os.path.exists(fpath):
+            os.makedirs(fpath)
+        try:
+            fpath = os.path.join(folderName, fileName + suffix + extension)
+            logging.info("Saving %s (%s words) to file %s", fileType, '{:,}'.format(len(rows)), fpath)
+            offsets = np.zeros(len(rows) + 1, dtype='<u8')
+            offsets[1:] = np.cumsum([len(row[0]) for row in rows])
+            frequencies = np.array([row[1] for row in rows], dtype='<f8')
+            # Write to a temporary file, renamed only once complete
+            with replaceFile(fpath) as temporary, open(temporary, mode='wb') as f:
+                f.write(ctFrequencyIndexHeader.pack(ctFrequencyIndexMagic, ctFrequencyIndexVersion,
+                                                    len(rows), int(offsets[-1])))
+                f.write(offsets.tobytes())
+                f.write(frequencies.tobytes())
+                f.write(b''.join(row[0] for row in rows))
+        except Exception as e:
+            logging.info(repr(e))
+
+
+# --------------------------------------------------------------------------------------------------
+# The reader of a frequency index (see saveToIndexFile): the file is memory-mapped, never loaded,
+# and the words are found by binary search (their UTF-8 bytes are sorted)
+# --------------------------------------------------------------------------------------------------
+class FrequencyIndex(object):
+
+    def __init__(self, fileName):
+        """
+        :param fileName: index file (see saveToIndexFile)
+        """
+        self.fileName = fileName
+        with open(fileName, mode='rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, numWords, tableSize = ctFrequencyIndexHeader.unpack_from(self.map)
+        if magic != ctFrequencyIndexMagic or version != ctFrequencyIndexVersion:
+            self.map.close()
+            raise ValueError('%s is not a frequency index (version %s)' % (fileName, ctFrequencyIndexVersion))
+        self.size = numWords
+        self.offsets = np.frombuffer(self.map, dtype='<u8', count=numWords + 1, offset=ctFrequencyIndexHeader.size)
+        self.frequencies = np.frombuffer(self.map, dtype='<f8', count=numWords,
+                                         offset=ctFrequencyIndexHeader.size + 8 * (numWords + 1))
+        self.table = ctFrequencyIndexHeader.size + 16 * numWords + 8
+
+    def key(self, position):
+        """
+        :return: the word at this position, as UTF-8 bytes
+        """
+        return self.map[self.table + int(self.offsets[position]):self.table + int(self.offsets[position + 1])]
+
+    def word(self, position):
+        return self.key(position).decode('utf-8')
+
+    def search(self, key, after=False):
+        """ Binary search of the words
+        :param key: UTF-8 bytes
+        :param after: find the first word after all the words starting with key (instead of the first word >= key)
+        :return: position
+        """
+        low, high = 0, self.size
+        while low < high:
+            middle = (low + high) // 2
+            word = self.key(middle)
+            if (word[:len(key)] <= key) if after else (word < key):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def frequency(self, word, default=None):
+        """
+        :param word: the word to look up
+        :param default: the frequency of a word missing from the index
+        :return: the frequency of the word
+        """
+        key = word.encode('utf-8')
+        position = self.search(key)
+        if position < self.size and self.key(position) == key:
+            return float(self.frequencies[position])
+        return default
+
+    def prefix(self, prefix):
+        """
+        :param prefix: the beginning of the words
+        :return: list of (word, frequency) of the words starting with prefix, sorted by word
+        """
+        key = prefix.encode('utf-8')
+        start = self.search(key)
+        end = self.search(key, after=True) if key else self.size
+        return [(self.word(position), float(self.frequencies[position])) for position in range(start, end)]
+
+    def __getitem__(self, word):
+        frequency = self.frequency(word)
+        if frequency is None:
+            raise KeyError(word)
+        return frequency
+
+    def __contains__(self, word):
+        return self.frequency(word) is not None
+
+    def __len__(self):
+        return self.size
+
+    def close(self):
+        # The arrays are views of the map: they go first
+        self.offsets = self.frequencies = None
+        self.map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# --------------------------------------------------------------------------------------------------
+# A function to compare the frequencies of some words across the frequency indexes of several corpora
+# --------------------------------------------------------------------------------------------------
+def compareFrequencies(indexFiles, words):
+    """
+    :param indexFiles: list of index files (see saveToIndexFile)
+    :param words: list of words
+    :return: list of rows: the word, then its frequency in every index (0 if missing)
+    """
+    rows = [[word] for word in words]
+    for fileName in indexFiles:
+        try:
+            with FrequencyIndex(fileName) as index:
+                for row in rows:
+                    row.append(index.frequency(row[0], 0.0))
+        except Exception as e:
+            logging.info(repr(e))
+            for row in rows:
+                row.append(None)
+    return rows
+
+
+# -------------------------------------------------------------------
+# A function to save records (e.g. statistics) to a JSON lines file on disk
+# -------------------------------------------------------------------
+def saveToJSONFile(records, folderName, fileName, suffix):
+    """
+    :param records: list of records (dictionaries), one JSON object per line
+    :param fileName: The sub-folder in which we'll save the file
+    :param suffix: an optional suffix for the resulting file name
+    """
+    fileType = 'records'
+    extension = '.jsonl'
+    if records:
         fpath = os.path.join(folderName)
         if not os.path.exists(fpath):
             os.makedirs(fpath)
@@ -472,8 +3119,8 @@ def saveToCSVFile(text, folderName, fileName, suffix):
             fpath = os.path.join(folderName, fileName + suffix + extension)
             logging.info("Saving %s to file " % fileType + fpath)
             with open(fpath, mode='w', encoding='utf-8') as f:
-                f.write(text)
-                f.close()
+                for record in records:
+                    f.write(json.dumps(record) + '\n')
         except Exception as e:
             logging.info(repr(e))
 
@@ -481,14 +3128,15 @@ def saveToCSVFile(text, folderName, fileName, suffix):
 # -------------------------------------------------------------------
 # A function to save a corpus to a file on disk
 # -------------------------------------------------------------------
-def saveToFile(text, folderName, fileName, suffix):
+def saveToFile(text, folderName, fileName, suffix, compress=False):
     """
     :param text: text to be saved to file
     :param fileName: The sub-folder in which we'll save the file
     :param suffix: an optional suffix for the resulting dictionary file name
+    :param compress: compress the file with gzip? (True/False, default = False)
     """
     fileType = 'corpus'
-    extension = '.txt'
+    extension = '.txt.gz' if compress else '.txt'
     if text:
         fpath = os.path.join(folderName)
         if not os.path.exists(fpath):
@@ -496,12 +3144,1059 @@ def saveToFile(text, folderName, fileName, suffix):
         try:
             fpath = os.path.join(folderName, fileName + suffix + extension)
             logging.info("Saving %s to file " % fileType + fpath)
-            with open(fpath, mode='w', encoding='utf-8') as f:
-                for line in text:
-                    f.write(str(line) + ' ')
-                f.close()
+            with (gzip.open(fpath, mode='wt', encoding='utf-8') if compress
+                  else open(fpath, mode='w', encoding='utf-8')) as f:
+                # Write the words in blocks, instead of one by one
+                words = iter(text)
+                while True:
+                    block = list(itertools.islice(words, ctWriteBlockSize))
+                    if not block:
+                        break
+                    f.write(' '.join(map(str, block)) + ' ')
+        except Exception as e:
+            logging.info(repr(e))
+
+
+# --------------------------------------------------------------------------------------------------
+# The binary output of the collocation steps: a vocabulary file shared by all the steps (append-only,
+# one word per line, word id = line number) and, for every step, the word ids of its corpus
+# (uint32, little-endian), which can be memory-mapped back (see loadStep)
+# --------------------------------------------------------------------------------------------------
+def stepFiles(folderName, fileName, step=None):
+    """
+    :param folderName: The folder holding the step files
+    :param fileName: The name of the corpus
+    :param step: number of the step (None = the vocabulary file)
+    :return: path of the vocabulary file, or of the ids of a step
+    """
+    if step is None:
+        return os.path.join(folderName, fileName + '_vocabulary.txt')
+    return os.path.join(folderName, fileName + '_step_' + str(step) + '.ids')
+
+
+class StepWriter(object):
+
+    def __init__(self, folderName, fileName):
+        """
+        :param folderName: The folder in which we'll save the files (created if missing)
+        :param fileName: The name of the corpus
+        """
+        self.folderName = folderName
+        self.fileName = fileName
+        self.vocabulary = []
+        self.index = {}
+        self.source = None
+        if not os.path.exists(folderName):
+            os.makedirs(folderName)
+        open(stepFiles(folderName, fileName), mode='w', encoding='utf-8').close()
+
+    def write(self, corpus, step):
+        """
+        :param corpus: EncodedCorpus of the step
+        :param step: number of the step
+        """
+        try:
+            ids = corpusIds(corpus)
+            if corpus.vocabulary is self.source:
+                # Same vocabulary as the previous step (the collocations only append new words at its end)
+                newWords = corpus.vocabulary[len(self.vocabulary):]
+                for word in newWords:
+                    self.index[word] = len(self.vocabulary)
+                    self.vocabulary.append(word)
+            else:
+                # Another vocabulary: let's map its ids to the ids of the shared vocabulary
+                start = len(self.vocabulary)
+                mapping = np.array([self.add(word) for word in corpus.vocabulary], dtype=np.int64)
+                ids = mapping[ids]
+                newWords = self.vocabulary[start:]
+                # If both vocabularies are the same, the next steps will need no mapping
+                sameVocabulary = len(mapping) == len(self.vocabulary) and \
+                    np.array_equal(mapping, np.arange(len(mapping)))
+                self.source = corpus.vocabulary if sameVocabulary else None
+
+            fpath = stepFiles(self.folderName, self.fileName, step)
+            logging.info("Saving %s word ids (%s new words) to file %s",
+                         '{:,}'.format(len(ids)), '{:,}'.format(len(newWords)), fpath)
+            with open(stepFiles(self.folderName, self.fileName), mode='a', encoding='utf-8') as f:
+                f.write(''.join(word + '\n' for word in newWords))
+            ids.astype('<u4').tofile(fpath)
+        except Exception as e:
+            logging.info(repr(e))
+
+    def add(self, word):
+        try:
+            return self.index[word]
+        except KeyError:
+            wordId = self.index[word] = len(self.vocabulary)
+            self.vocabulary.append(word)
+            return wordId
+
+
+# --------------------------------------------------------------------------------------------------
+# Functions to read a step saved by StepWriter, and to decode it as text
+# --------------------------------------------------------------------------------------------------
+def loadStep(folderName, fileName, step):
+    """
+    :param folderName: The folder holding the step files
+    :param fileName: The name of the corpus
+    :param step: number of the step
+    :return: EncodedCorpus, whose ids are memory-mapped (read only)
+    """
+    with open(stepFiles(folderName, fileName), mode='r', encoding='utf-8') as f:
+        vocabulary = f.read().split('\n')[:-1]
+    fpath = stepFiles(folderName, fileName, step)
+    if os.path.getsize(fpath):
+        ids = np.memmap(fpath, dtype='<u4', mode='r')
+    else:
+        ids = np.zeros(0, dtype='<u4')
+    return EncodedCorpus(vocabulary, ids)
+
+
+def exportStepText(folderName, fileName, step, compress=True):
+    """ Decode a step as text (the same file as the text output of runCollocations)
+    :param folderName: The folder holding the step files
+    :param fileName: The name of the corpus
+    :param step: number of the step
+    :param compress: compress the file with gzip? (True/False, default = True)
+    """
+    corpus = loadStep(folderName, fileName, step)
+    saveToFile(text=corpus,
+               folderName=folderName,
+               fileName=fileName + '_step_' + str(step),
+               suffix='',
+               compress=compress)
+
+
+# --------------------------------------------------------------------------------------------------
+# The instrumentation of the stages of a run (load, stopwords, preprocess, stem, collocate, count, save,
+# plus cache and sentiment): wall time, CPU time, peak memory and items in / out of every stage,
+# and the optional profiling (cProfile or line_profiler) of one of them
+# --------------------------------------------------------------------------------------------------
+ctStageFunctions = {
+    'load': [loadWords, streamText, streamWords, encodeWords, countWordsParallel, countShard, EncodedCorpus.extend,
+             loadSentences, loadSentenceCorpus, encodeSentenceShard, appendCorpus, decompressBlocks, readBlocks,
+             countChunk, readText],
+    'cache': [StageCache.get, StageCache.put, saveEncodedCorpus, loadEncodedCorpus, fileHash],
+    'stopwords': [removeStopwords, remapCorpus, remapCounts],
+    'preprocess': [preProcess, remapCorpus, remapCounts],
+    'stem': [doStemming, stemStream, remapCorpus, remapCounts],
+    'collocate': [collocationSteps, findCollocations, findEncodedCollocations, scoreEncodedBigrams, rankBigrams,
+                  pmiScores, mergeRankedBigrams, CollocationEngine.nextStep, CollocationEngine.rank,
+                  underscoreHistogram, countBigrams, countPartBigrams],
+    'count': [buildDictionary, EncodedCorpus.counts],
+    'save': [saveToCSVFile, saveToIndexFile, saveToJSONFile, saveToFile, StepWriter.write, saveSentiment, saveSentimentSummary],
+    'sentiment': [scoreSentiment, scoreCorpora, LexiconMatcher.match, LexiconMatcher.scan, LexiconMatcher.candidates]
+}
+
+
+def cpuTime():
+    """
+    :return: CPU time of this process and of its terminated child processes (e.g. of a pool), in seconds
+    """
+    seconds = time.process_time()
+    if resource:
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        seconds += children.ru_utime + children.ru_stime
+    return seconds
+
+
+def peakRSS():
+    """
+    :return: peak resident set size of this process so far, in bytes (None if not available)
+    """
+    if not resource:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+class Instrumentation(object):
+
+    def __init__(self, memory=False, profileStage=None, profiler='cprofile', keepRecords=True):
+        """
+        :param memory: trace the memory allocations (tracemalloc) for the peak memory of every stage? (slower)
+        :param profileStage: the stage to be profiled (None = none), one of ctStageFunctions
+        :param profiler: 'cprofile' (functions) or 'line' (lines of the functions of the stage, needs line_profiler)
+        :param keepRecords: keep the records of the stages in records? (False for a long-running process, e.g.
+                            the query server, whose reloads would make the list grow forever)
+        """
+        if profileStage and profileStage not in ctStageFunctions:
+            raise ValueError('Unknown stage %r (expected one of %s)' % (profileStage, ', '.join(sorted(ctStageFunctions))))
+        if profiler == 'line' and not line_profiler:
+            logging.info("line_profiler is not installed, the stage %s is profiled with cProfile", profileStage)
+            profiler = 'cprofile'
+        self.memory = memory
+        self.profileStage = profileStage
+        self.profiler = profiler
+        self.profile = None
+        self.keepRecords = keepRecords
+        self.records = []
+
+    @contextlib.contextmanager
+    def stage(self, name, itemsIn=None):
+        """ Measure a stage: with instrumentation.stage('stem', len(words)) as record: ... record['itemsOut'] = ...
+        :param name: name of the stage
+        :param itemsIn: number of items (words, bytes...) going into the stage
+        :return: the record of the stage
+        """
+        record = collections.OrderedDict([('stage', name), ('itemsIn', itemsIn), ('itemsOut', None),
+                                          ('seconds', None), ('cpuSeconds', None), ('peakMemory', None),
+                                          ('peakRSS', None)])
+        if self.keepRecords:
+            self.records.append(record)
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            elif hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            else:
+                tracemalloc.stop()
+                tracemalloc.start()
+        traced = tracemalloc.get_traced_memory()[0] if self.memory else 0
+        profile = self.startProfile() if name == self.profileStage else None
+        start = time.perf_counter()
+        cpu = cpuTime()
+        try:
+            yield record
+        finally:
+            record['seconds'] = time.perf_counter() - start
+            record['cpuSeconds'] = cpuTime() - cpu
+            if profile and self.profiler == 'line':
+                profile.disable_by_count()
+            elif profile:
+                profile.disable()
+            if self.memory:
+                # The peak of the memory allocated by the stage (beyond the memory already allocated before it)
+                record['peakMemory'] = tracemalloc.get_traced_memory()[1] - traced
+            record['peakRSS'] = peakRSS()
+
+    def iterate(self, name, iterable, itemsIn=None, items=len):
+        """ Measure every item of a generator as a stage (e.g. every step of collocationSteps)
+        :param items: function returning the number of items out of an item
+        :return: generator of the items
+        """
+        iterator = iter(iterable)
+        end = object()
+        while True:
+            with self.stage(name, itemsIn) as record:
+                item = next(iterator, end)
+                if item is not end:
+                    record['itemsOut'] = itemsIn = items(item)
+            if item is end:
+                if self.keepRecords:
+                    self.records.remove(record)
+                return
+            yield item
+
+    def startProfile(self):
+        if not self.profile:
+            if self.profiler == 'line':
+                self.profile = line_profiler.LineProfiler(*ctStageFunctions[self.profileStage])
+            else:
+                self.profile = cProfile.Profile()
+        if self.profiler == 'line':
+            self.profile.enable_by_count()
+        else:
+            self.profile.enable()
+        return self.profile
+
+    def saveProfile(self, folderName, fileName):
+        """ Save the profile of the stage (as text, and as binary stats for cProfile) and start a new one
+        :param folderName: The folder in which we'll save the files
+        :param fileName: The name of the files
+        """
+        if not self.profile:
+            return
+        if not os.path.exists(folderName):
+            os.makedirs(folderName)
+        fpath = os.path.join(folderName, fileName + '_profile_' + self.profileStage)
+        logging.info("Saving the profile of stage %s to file %s.txt", self.profileStage, fpath)
+        try:
+            with open(fpath + '.txt', mode='w', encoding='utf-8') as f:
+                if self.profiler == 'line':
+                    self.profile.print_stats(stream=f)
+                else:
+                    self.profile.dump_stats(fpath + '.prof')
+                    pstats.Stats(self.profile, stream=f).sort_stats('cumulative').print_stats(ctProfileLines)
         except Exception as e:
             logging.info(repr(e))
+        self.profile = None
+
+
+def environmentInstrumentation():
+    """ The instrumentation of the interactive scripts, set from the environment (no prompts):
+    RELATIVEFREQ_PROFILE=stage (cProfile) or stage:line (line_profiler), RELATIVEFREQ_MEMORY=1 (tracemalloc)
+    :return: Instrumentation
+    """
+    profileStage, _, profiler = os.environ.get(ctProfileVariable, '').partition(':')
+    return Instrumentation(memory=os.environ.get(ctMemoryVariable, '') not in ('', '0'),
+                           profileStage=profileStage or None,
+                           profiler=profiler or 'cprofile')
+
+
+# --------------------------------------------------------------------------------------------------
+# A function to display the totals of every stage of a run (in the order of their first run)
+# --------------------------------------------------------------------------------------------------
+def stageSummary(records):
+    """
+    :param records: records of the stages (see Instrumentation)
+    """
+    totals = collections.OrderedDict()
+    for record in records:
+        total = totals.setdefault(record['stage'], collections.Counter())
+        total['runs'] += 1
+        total['seconds'] += record['seconds'] or 0
+        total['cpuSeconds'] += record['cpuSeconds'] or 0
+        total['peakMemory'] = max(total['peakMemory'], record['peakMemory'] or 0)
+        total['peakRSS'] = max(total['peakRSS'], record['peakRSS'] or 0)
+    if totals:
+        logging.info('========== STAGES ==========')
+        logging.info('{:12} {:>5} {:>12} {:>12} {:>16} {:>16}'.
+                     format('Stage', 'Runs', 'Wall (s)', 'CPU (s)', 'Peak memory', 'Peak RSS'))
+        for stage, total in totals.items():
+            logging.info('{:12} {:>5} {:>12.3f} {:>12.3f} {:>16,} {:>16,}'.
+                         format(stage, total['runs'], total['seconds'], total['cpuSeconds'], total['peakMemory'],
+                                total['peakRSS']))
+        logging.info('{:12} {:>5} {:>12.3f} {:>12.3f}'.
+                     format('Total', sum(total['runs'] for total in totals.values()),
+                            sum(total['seconds'] for total in totals.values()),
+                            sum(total['cpuSeconds'] for total in totals.values())))
+
+
+# --------------------------------------------------------------------------------------------------
+# A function to save the records of the stages of a run to disk, as JSON lines and as CSV
+# --------------------------------------------------------------------------------------------------
+def saveStageReport(records, folderName, fileName):
+    """
+    :param records: records of the stages (see Instrumentation)
+    :param folderName: The folder in which we'll save the files
+    :param fileName: The name of the files (.jsonl and .csv)
+    """
+    if records:
+        saveToJSONFile(records=records, folderName=folderName, fileName=fileName, suffix='')
+        columns = [column for column in ctStageColumns if any(column in record for record in records)]
+        saveToCSVFile(rows=itertools.chain([columns], ([record.get(column) for column in columns]
+                                                       for record in records)),
+                      folderName=folderName,
+                      fileName=fileName,
+                      suffix='')
+
+
+# --------------------------------------------------------------------------------------------------
+# A function to end the run of an interactive script: the summary of the stages, then the report
+# (and the profile, if any) saved next to the results
+# --------------------------------------------------------------------------------------------------
+def reportRun(instrumentation, folderName, fileName):
+    """
+    :param instrumentation: Instrumentation of the run
+    :param folderName: The folder of the results
+    :param fileName: The name of the report (<fileName>_run.jsonl / .csv) and of the profile
+    """
+    stageSummary(instrumentation.records)
+    saveStageReport(instrumentation.records, folderName, fileName + '_run')
+    instrumentation.saveProfile(folderName, fileName)
+
+
+# --------------------------------------------------------------------------------------------------
+# A function to find the folder of the results of a corpus: a new folder named after the corpus
+# (<folder>_corpus for a folder / pattern / manifest of corpora, never inside the folder of the corpora)
+# --------------------------------------------------------------------------------------------------
+def outputFolder(corpus):
+    """
+    :param corpus: Corpus of text, as txt file, or a folder / pattern (e.g. news/*.txt) / manifest of corpora
+    :return: folder name
+    """
+    return corpusName(corpus)
+
+
+# --------------------------------------------------------------------------------------------------
+# The resources shared by all the jobs of a run (stopwords, normalizers, stemmers, compiled lexicons):
+# every one of them is loaded or built once, the first time a job needs it
+# --------------------------------------------------------------------------------------------------
+class PipelineResources(object):
+
+    def __init__(self, stemCacheFolder=ctStemCacheFolder, lexiconCacheFolder=ctLexiconCacheFolder,
+                 stageCacheFolder=ctStageCacheFolder, stageCacheSize=ctStageCacheSize, instrumentation=None,
+                 stemCacheSize=ctStemCacheSize):
+        """
+        :param stemCacheFolder: The folder holding the stems caches (None = no reuse across runs)
+        :param stemCacheSize: maximum number of cached stems per language, in memory and on disk (None = no limit)
+        :param lexiconCacheFolder: The folder holding the compiled lexicons (None = no reuse across runs)
+        :param stageCacheFolder: The folder holding the corpora after each stage (None = no reuse across runs)
+        :param stageCacheSize: maximum size of the stage cache, in bytes
+        :param instrumentation: Instrumentation measuring the stages of the jobs (None = times only, no profiling)
+        """
+        self.instrumentation = instrumentation or Instrumentation()
+        self.stemCacheFolder = stemCacheFolder
+        self.stemCacheSize = stemCacheSize
+        self.lexiconCacheFolder = lexiconCacheFolder
+        self.stageCache = StageCache(stageCacheFolder, stageCacheSize) if stageCacheFolder else None
+        self.stopwordSets = {}
+        self.normalizers = {}
+        self.stemmers = {}
+        self.savedStems = {}
+        self.matchers = {}
+
+    def stopwords(self, fileName, normalize=False):
+        """
+        :param fileName: Stopwords file
+        :param normalize: add the pre-processed forms of the stopwords? (see loadStopwords)
+        :return: set of stopwords
+        """
+        key = (fileName, normalize)
+        if key not in self.stopwordSets:
+            self.stopwordSets[key] = loadStopwords(fileName, self.normalizer() if normalize else None)
+        return self.stopwordSets[key]
+
+    def normalizer(self, lowercase=True, unicode=True, diacritics=True, punctuation=True, digits=True):
+        """
+        :return: normalizer (see buildNormalizer), whose cache is kept from one corpus to the next
+        """
+        flags = (lowercase, unicode, diacritics, punctuation, digits)
+        if flags not in self.normalizers:
+            self.normalizers[flags] = buildNormalizer(*flags)
+        return self.normalizers[flags]
+
+    def stemmer(self, language):
+        """
+        :param language: The stemmer language
+        :return: memoized stemmer (see buildStemmer)
+        """
+        if language not in self.stemmers:
+            self.stemmers[language] = buildStemmer(language, self.stemCacheSize, self.stemCacheFolder)
+            self.savedStems[language] = 0
+        return self.stemmers[language]
+
+    def saveStems(self):
+        """ Save the stems caches which changed (new words stemmed) since they were loaded or saved """
+        if self.stemCacheFolder:
+            for language, stemWord in self.stemmers.items():
+                if stemWord.misses > self.savedStems[language]:
+                    saveStemCache(stemWord.stems, self.stemCacheFolder, language, self.stemCacheSize)
+                    self.savedStems[language] = stemWord.misses
+
+    def matcher(self, lexiconFile, exclusionsFile=None):
+        """
+        :param lexiconFile: Lexicon, as csv file
+        :param exclusionsFile: Exclusions file (None = the default exclusions)
+        :return: LexiconMatcher (see loadCompiledLexicon)
+        """
+        key = (lexiconFile, exclusionsFile)
+        if key not in self.matchers:
+            exclusions = loadWords(exclusionsFile) if exclusionsFile else ctExcluded
+            self.matchers[key] = loadCompiledLexicon(lexiconFile, exclusions, self.lexiconCacheFolder)
+        return self.matchers[key]
+
+
+# --------------------------------------------------------------------------------------------------
+# A function to apply the optional stages (stopwords, pre-processing, stemming) to a corpus
+# --------------------------------------------------------------------------------------------------
+def applyStages(words, resources, stopwords=None, preprocess=False, stemming=False, language=None):
+    """
+    :param words: EncodedCorpus (or Counter of words)
+    :param resources: PipelineResources
+    :param stopwords: Stopwords file (None = keep the stopwords)
+    :param preprocess: convert to lowercase, remove unicode characters, diacritics, punctuation, digits?
+    :param stemming: apply the Snowball stemmer?
+    :param language: The stemmer language (None = detect it from a sample of the corpus)
+    :return: the corpus, after the stages
+    """
+    instrumentation = resources.instrumentation
+    if words and stopwords and resources.stopwords(stopwords):
+        with instrumentation.stage('stopwords', len(words)) as record:
+            words = removeStopwords(words, resources.stopwords(stopwords))
+            record['itemsOut'] = len(words)
+    if words and preprocess:
+        with instrumentation.stage('preprocess', len(words)) as record:
+            words = preProcess(words, normalize=resources.normalizer())
+            record['itemsOut'] = len(words)
+    if words and stemming:
+        with instrumentation.stage('stem', len(words)) as record:
+            words = doStemming(words, language=language, stemmer=resources.stemmer)
+            resources.saveStems()
+            record['itemsOut'] = len(words)
+    return words
+
+
+# --------------------------------------------------------------------------------------------------
+# A function to load a corpus as an EncodedCorpus and apply the optional stages to it, like applyStages
+# The corpus is saved in the stage cache after every stage, so that the next runs (of any tool)
+# with the same corpus and options start from the deepest stage already computed
+# --------------------------------------------------------------------------------------------------
+def loadStages(corpus, resources, minLength=1, stopwords=None, preprocess=False, stemming=False, language=None,
+               sentences=False, processes=0):
+    """
+    :param corpus: Corpus of text, as txt file, or CorpusSource (e.g. a folder of files)
+    :param resources: PipelineResources
+    :param minLength: minimum length of the words kept when loading the corpus
+    :param sentences: load the corpus as sentences, with a boundary after every sentence (see loadSentenceCorpus)?
+    :param processes: Number of processes loading the sentences, or the files of a source, in parallel (0 = none)
+    :return: EncodedCorpus, after the stages (see applyStages for the other parameters)
+    """
+    source = corpus if isinstance(corpus, CorpusSource) else CorpusSource(corpus or '')
+    corpus = source.source
+    if not source.files:
+        logging.info("Please provide a valid file name.")
+        return []
+    stages = [('load', source.hash(), minLength) + (('sentences',) if sentences else ())]
+    if stopwords and resources.stopwords(stopwords):
+        stages.append(('stopwords', fileHash(stopwords)))
+    if preprocess:
+        stages.append(('preprocess', (True, True, True, True, True)))
+    if stemming:
+        stages.append(('stemming', language))
+    keys = [stageKey(stages[:depth + 1]) for depth in range(len(stages))]
+
+    # Let's start from the deepest stage in the cache
+    instrumentation = resources.instrumentation
+    cache = resources.stageCache
+    words = None
+    done = 0
+    if cache:
+        with instrumentation.stage('cache') as record:
+            for depth in range(len(stages), 0, -1):
+                words = cache.get(keys[depth - 1])
+                if words is not None:
+                    logging.info("Starting from the cached corpus after stage '%s'", stages[depth - 1][0])
+                    record['itemsOut'] = len(words)
+                    done = depth
+                    if source.multiple:
+                        source.provenance = next((provenance for provenance in map(cache.getProvenance,
+                                                                                   reversed(keys[:depth]))
+                                                  if provenance is not None), None)
+                    break
+
+    depth = done
+    while depth < len(stages):
+        stage = stages[depth][0]
+        if stage == 'load' and source.multiple:
+            # Let's read the files with a pool of threads, and tokenize them with a pool of processes
+            # If the stopwords stage comes next, the stopwords are dropped while tokenizing (both stages at once)
+            fused = depth + 1 < len(stages) and stages[depth + 1][0] == 'stopwords'
+            with instrumentation.stage('load', source.size) as record:
+                words = source.load(processes, minLength, resources.stopwords(stopwords) if fused else None,
+                                    sentences)
+                record['itemsOut'] = len(words)
+            if fused:
+                depth += 1
+        elif stage == 'load' and sentences:
+            # Let's split the shards of the corpus in sentences, in parallel (the stopwords stage comes after)
+            with instrumentation.stage('load', os.path.getsize(corpus)) as record:
+                words = loadSentenceCorpus(corpus, processes, minLength)
+                record['itemsOut'] = len(words)
+        elif stage == 'load':
+            # Let's stream the individual words from disk and keep them in memory as an integer-encoded corpus
+            # If the stopwords stage comes next, the stopwords are dropped while streaming (both stages at once)
+            fused = depth + 1 < len(stages) and stages[depth + 1][0] == 'stopwords'
+            stopwordSet = resources.stopwords(stopwords) if fused else None
+            with instrumentation.stage('load', os.path.getsize(corpus)) as record:
+                words = encodeWords(word for word in loadWords(corpus, stream=True, stopwords=stopwordSet)
+                                    if len(word) >= minLength)
+                record['itemsOut'] = len(words)
+            if fused:
+                depth += 1
+        elif stage == 'stopwords':
+            with instrumentation.stage('stopwords', len(words)) as record:
+                words = removeStopwords(words, resources.stopwords(stopwords))
+                record['itemsOut'] = len(words)
+        elif stage == 'preprocess':
+            with instrumentation.stage('preprocess', len(words)) as record:
+                words = preProcess(words, normalize=resources.normalizer())
+                record['itemsOut'] = len(words)
+        elif stage == 'stemming':
+            with instrumentation.stage('stem', len(words)) as record:
+                words = doStemming(words, language=language, stemmer=resources.stemmer)
+                resources.saveStems()
+                record['itemsOut'] = len(words)
+        if not words:
+            break
+        if cache:
+            with instrumentation.stage('cache', len(words)):
+                cache.put(keys[depth], words)
+                if stage == 'load' and source.provenance:
+                    cache.putProvenance(keys[depth], source.provenance)
+        depth += 1
+    return words
+
+
+# --------------------------------------------------------------------------------------------------
+# The jobs: every one runs one of the three tools on a corpus and returns a record of its run
+# The interactive scripts (RelativeFrequencies.py, Collocations.py, Sentiment.py) ask for the options,
+# Pipeline.py reads them from the command line or from a configuration file
+# --------------------------------------------------------------------------------------------------
+def runRelativeFrequencies(corpus, resources=None, processes=0, stopwords=None, preprocess=False, stemming=False,
+                           language=None):
+    """
+    :param corpus: Corpus of text, as txt file, or a folder / pattern / manifest of files (see CorpusSource)
+    :param resources: PipelineResources (None = not shared)
+    :param processes: Number of processes counting the words (or tokenizing the files) in parallel (0 = none)
+    :return: record of the run
+    """
+    resources = resources or PipelineResources()
+    instrumentation = resources.instrumentation
+    record = collections.OrderedDict([('task', 'frequencies'), ('corpus', corpus)])
+    source = CorpusSource(corpus)
+    name = source.name()
+    if processes > 0 and not source.multiple:
+        # Let's count the words of the corpus shards in parallel, then merge the counts
+        with instrumentation.stage('load', os.path.getsize(corpus) if os.path.exists(corpus) else 0) as stage:
+            words = countWordsParallel(corpus, processes)
+            words = remapCounts(words, lambda word: word if len(word) > 1 else None)
+            stage['itemsOut'] = len(words)
+        words = applyStages(words, resources, stopwords, preprocess, stemming, language)
+    else:
+        # Let's stream the individual words from disk (the corpus is never loaded in memory as text)
+        # and keep them in memory as an integer-encoded corpus (or start from the stage cache)
+        # The files of a folder / pattern / manifest are read by threads, and tokenized by the processes
+        words = loadStages(source, resources, 2, stopwords, preprocess, stemming, language, processes=processes)
+
+    # Now let's find the relative frequencies
+    with instrumentation.stage('count', len(words) if words else 0) as stage:
+        dictionary = buildDictionary(words)
+        stage['itemsOut'] = len(dictionary) if dictionary else 0
+    if dictionary:
+        # Let's display the 20 most frequent words
+        showMostFrequent(dictionary, 20, type=0)
+
+        # Let's save the dictionary to disk
+        # We create a new folder named after the corpus and store the resulting files there
+        # (as a table sorted by frequency, and as an index sorted by word, for the lookups - see FrequencyIndex)
+        # (and, for several files, the number of words read from every one of them)
+        with instrumentation.stage('save', len(dictionary)):
+            saveToCSVFile(rows=((word[0], '%.10f' % word[1]) for word in dictionary.most_common()),
+                          folderName=name,
+                          fileName=os.path.basename(name),
+                          suffix='')
+            saveToIndexFile(dictionary=dictionary,
+                            folderName=name,
+                            fileName=os.path.basename(name),
+                            suffix='')
+            source.saveProvenance(folderName=name, fileName=os.path.basename(name))
+        record['words'] = len(dictionary)
+    return record
+
+
+def runCollocations(corpus, resources=None, stopwords=None, preprocess=False, stemming=False, language=None,
+                    bigramMethod=0, topK=ctTopBigrams, minPMI=None, minCount=2, maxSteps=10, minGain=0.0,
+                    textOutput=0, sentences=False, processes=0):
+    """
+    :param corpus: Corpus of text, as txt file, or a folder / pattern / manifest of files (see CorpusSource)
+    :param resources: PipelineResources (None = not shared)
+    :param bigramMethod: 0 = DICTIONARY, 1 = REGEX, 2 = FULL SCAN, 3 = RANKED MERGE
+    :param textOutput: the text of every step is saved as binary word ids (see StepWriter), and also as:
+                       0 = nothing else, 1 = text, 2 = compressed text (gzip)
+    :param sentences: find the collocations within sentences only (DICTIONARY and RANKED MERGE)?
+    :param processes: Number of processes loading the sentences (or tokenizing the files) and counting the bi-grams
+                      in parallel (0 = none)
+    :return: record of the run
+    """
+    if sentences and bigramMethod not in [0, 3]:
+        raise ValueError('Sentences are supported by the DICTIONARY and RANKED MERGE methods only')
+    resources = resources or PipelineResources()
+    instrumentation = resources.instrumentation
+    record = collections.OrderedDict([('task', 'collocations'), ('corpus', corpus)])
+    source = CorpusSource(corpus)
+    name = source.name()
+
+    # Let's stream the individual words from disk and keep them in memory as an integer-encoded corpus
+    # (or start from the stage cache); in sentence mode, every sentence is followed by a boundary
+    # The files of a folder / pattern / manifest are appended in order (in sentence mode, every file ends a sentence)
+    words = loadStages(source, resources, 1, stopwords, preprocess, stemming, language, sentences, processes)
+    if not words:
+        return record
+    source.saveProvenance(folderName=name, fileName=os.path.basename(name))
+
+    # Results
+    results = {}
+    steps = []
+    writer = StepWriter(folderName=name, fileName=os.path.basename(name))
+
+    # Every step is measured as a 'collocate' stage, and its output files as a 'save' stage
+    for words, dictionary, statistics in instrumentation.iterate(
+            'collocate', collocationSteps(words, bigramMethod, maxSteps=maxSteps, minGain=minGain,
+                                          topK=topK, minPMI=minPMI, minCount=minCount, processes=processes),
+            itemsIn=len(words), items=lambda step: len(step[0])):
+        i = statistics['step'] - 1
+        logging.info('FINDING COLLOCATIONS ----> STEP %s' % (i + 1))
+
+        # The number of collocations by length, counted in a single pass over the dictionary
+        histogram = statistics['histogram']
+        results[i] = histogram[:10] + [histogram[10:]] if dictionary else []
+
+        # Sort the dictionary once, for both the display and the file
+        mostCommon = dictionary.most_common() if dictionary else []
+        if mostCommon:
+            # Let's display the 100 most frequent words
+            showMostFrequent(mostCommon, 100, type=1)
+
+        with instrumentation.stage('save', len(words)):
+            # Save the new text, after applying the bi-grams found in this step
+            writer.write(words, i + 1)
+            if textOutput:
+                saveToFile(text=words,
+                           folderName=name,
+                           fileName=os.path.basename(name) + '_step_' + str(i + 1),
+                           suffix='',
+                           compress=textOutput == 2)
+
+            # Let's save the statistics of every step (rewritten after each step, so that they survive an interruption)
+            steps.append(statistics)
+            saveToJSONFile(records=steps,
+                           folderName=name,
+                           fileName=os.path.basename(name) + '_steps',
+                           suffix='')
+
+            if mostCommon:
+                # Let's save the dictionary to disk
+                # We create a new folder named after the corpus and store the resulting files there
+                saveToCSVFile(rows=mostCommon,
+                              folderName=name,
+                              fileName=os.path.basename(name) + '_collocations_step_' + str(i + 1),
+                              suffix='')
+
+    logging.info('========== SUMMARY ==========')
+    for i in sorted(results):
+        logging.info('Step %s: \t%s' % (i + 1, results[i]))
+    record['steps'] = len(steps)
+    record['collocations'] = steps[-1]['collocations'] if steps else 0
+    return record
+
+
+def runSentiment(corpus, resources=None, lexicon='lexicon.csv', exclusions=None, processes=None):
+    """
+    :param corpus: Corpus of text, as txt file, or a folder / pattern (e.g. news/*.txt) / manifest of corpora
+    :param resources: PipelineResources (None = not shared)
+    :param lexicon: Lexicon, as csv file
+    :param exclusions: Exclusions file (None = the default exclusions)
+    :param processes: Number of processes scoring the corpora of a folder / pattern (None = number of CPUs)
+    :return: record of the run
+    """
+    resources = resources or PipelineResources()
+    instrumentation = resources.instrumentation
+    record = collections.OrderedDict([('task', 'sentiment'), ('corpus', corpus)])
+
+    # Let's load the lexicon, compiled for matching (compiled once, then reused from the cache)
+    matcher = resources.matcher(lexicon, exclusions)
+    if not matcher:
+        return record
+
+    source = CorpusSource(corpus)
+    if source.multiple:
+        # Batch mode: let's score all the corpora with a pool of processes, sharing the compiled lexicon
+        corpusFiles = source.files
+        with instrumentation.stage('sentiment', sum(map(os.path.getsize, corpusFiles))) as stage:
+            results = scoreCorpora(corpusFiles, matcher, processes, source=corpus)
+            stage['itemsOut'] = len(results)
+
+        logging.info('---------------------------------------------------')
+        logging.info('{:40} {:>20} {:>10}'.format('Corpus', 'Sentiment Index', 'Tokens'))
+        for item in results:
+            logging.info('{:40} {:>20.15f} {:>10.0f}'.format(item[0], item[1], item[2]))
+
+        # One table with the Sentiment Index of every corpus
+        with instrumentation.stage('save', len(results)):
+            saveSentimentSummary(results, folderName=outputFolder(corpus))
+        record['corpora'] = len(results)
+        return record
+
+    # Let's read the corpus once and match the lexicon against its distinct words
+    with instrumentation.stage('sentiment', os.path.getsize(corpus) if os.path.exists(corpus) else 0) as stage:
+        outFreq, sentimentIndex = scoreSentiment(corpus, matcher=matcher)
+        stage['itemsOut'] = len(outFreq) if outFreq else 0
+    if outFreq:
+        # Let's display the findings
+        logging.info('---------------------------------------------------')
+        logging.info('Corpus %s', corpusName(corpus))
+        logging.info('Sentiment Index = {:>20.15f}'.format(sentimentIndex))
+        logging.info('---------------------------------------------------')
+        logging.info('{:20} {:>3} {:>10} {:>10} {:>20} {}'.
+                     format('Term', 'Val', 'Abs.freq.', 'Tokens', 'Contribution', 'Occurrences'))
+        for item in matcher.lexicon:
+            logging.info('{:20} {:>3} {:>10} {:>10.0f} {:>20.15f} {}'.
+                         format(item, outFreq[item][0], outFreq[item][1], outFreq[item][2],
+                                outFreq[item][3], dict(outFreq[item][4].most_common())))
+
+        # Let's save the dictionary to disk
+        # We create a new folder named after the corpus and store the resulting files there
+        with instrumentation.stage('save', len(outFreq)):
+            saveSentiment(corpus, outFreq, sentimentIndex, matcher.lexicon)
+        record['sentimentIndex'] = sentimentIndex
+    return record
+
+
+ctTasks = {
+    'frequencies': runRelativeFrequencies,
+    'collocations': runCollocations,
+    'sentiment': runSentiment
+}
+
+
+# --------------------------------------------------------------------------------------------------
+# Functions to run a list of jobs, one after the other or with a pool of processes
+# A job is a dictionary: {'task': 'frequencies' | 'collocations' | 'sentiment', 'corpus': ..., options}
+# (the options are the parameters of runRelativeFrequencies, runCollocations or runSentiment)
+# --------------------------------------------------------------------------------------------------
+pipelineResources = None
+
+
+def initPipelineWorker(memory=False, profileStage=None, profiler='cprofile', stemCacheSize=ctStemCacheSize):
+    global pipelineResources
+    pipelineResources = PipelineResources(instrumentation=Instrumentation(memory, profileStage, profiler),
+                                          stemCacheSize=stemCacheSize)
+
+
+def runJob(job, resources=None):
+    """
+    :param job: dictionary with the task, the corpus and the options of the job
+    :param resources: PipelineResources (None = the resources of this worker process)
+    :return: record of the run, with its wall time, the records of its stages (and the error, if the job failed)
+    """
+    resources = resources or pipelineResources or PipelineResources()
+    instrumentation = resources.instrumentation
+    first = len(instrumentation.records)
+    options = dict(job)
+    task = options.pop('task', None)
+    start = time.perf_counter()
+    try:
+        if task not in ctTasks:
+            raise ValueError('Unknown task %r (expected one of %s)' % (task, ', '.join(sorted(ctTasks))))
+        record = ctTasks[task](resources=resources, **options)
+    except Exception as e:
+        logging.info(repr(e))
+        record = collections.OrderedDict([('task', task), ('corpus', job.get('corpus')), ('error', repr(e))])
+    record['seconds'] = time.perf_counter() - start
+    record['stages'] = [collections.OrderedDict([('task', task), ('corpus', job.get('corpus'))], **stage)
+                        for stage in instrumentation.records[first:]]
+    if instrumentation.profile and job.get('corpus'):
+        # The profile of every job is saved next to its results
+        instrumentation.saveProfile(outputFolder(job['corpus']), str(task))
+    logging.info('Job %s %s finished in %.3fs', task, job.get('corpus'), record['seconds'])
+    return record
+
+
+def runJobs(jobs, processes=0, memory=False, profileStage=None, profiler='cprofile', stemCacheSize=ctStemCacheSize):
+    """
+    :param jobs: list of jobs
+    :param processes: Number of processes running the jobs in parallel (0 = none, one job after the other)
+    :param memory: trace the memory allocations for the peak memory of every stage? (see Instrumentation)
+    :param profileStage: the stage to be profiled in every job (None = none)
+    :param profiler: 'cprofile' or 'line'
+    :param stemCacheSize: maximum number of cached stems per language (None = no limit, see PipelineResources)
+    :return: list of records, in the order of the jobs
+    """
+    start = time.perf_counter()
+    if processes > 1:
+        # The workers of a pool can't have their own pools: their jobs run in a single process
+        jobs = [dict(job, processes=0) if 'processes' in job or job.get('task') == 'sentiment' else job
+                for job in jobs]
+        with multiprocessing.Pool(processes, initializer=initPipelineWorker,
+                                  initargs=(memory, profileStage, profiler, stemCacheSize)) as pool:
+            records = pool.map(runJob, jobs, chunksize=1)
+    else:
+        resources = PipelineResources(instrumentation=Instrumentation(memory, profileStage, profiler),
+                                      stemCacheSize=stemCacheSize)
+        records = [runJob(job, resources) for job in jobs]
+    logging.info('%s jobs finished in %.3fs', '{:,}'.format(len(records)), time.perf_counter() - start)
+    return records
+
+
+# --------------------------------------------------------------------------------------------------
+# The statistics of a corpus, kept in memory by the query server (Server.py): the corpus is loaded
+# (after the optional stages) and counted once; the collocations, the bi-grams and the sentiment are
+# computed the first time they are asked for, then kept. When the file grows (text appended at its end),
+# only the new text is read (see refresh)
+# --------------------------------------------------------------------------------------------------
+class CorpusStatistics(object):
+
+    def __init__(self, corpus, resources, minLength=1, stopwords=None, preprocess=False, stemming=False,
+                 language=None, lexicon=None, exclusions=None):
+        """
+        :param corpus: Corpus of text, as txt file
+        :param resources: PipelineResources
+        :param minLength: minimum length of the words
+        :param lexicon: Lexicon, as csv file (None = no sentiment)
+        :param exclusions: Exclusions file (None = the default exclusions)
+        (see applyStages for the other parameters)
+        """
+        self.fileName = corpus
+        self.resources = resources
+        self.options = collections.OrderedDict([('minLength', minLength), ('stopwords', stopwords),
+                                                ('preprocess', preprocess), ('stemming', stemming),
+                                                ('language', language), ('lexicon', lexicon),
+                                                ('exclusions', exclusions)])
+        self.cache = {}
+        self.corpus = EncodedCorpus()
+        self.counts = collections.Counter()
+        self.size = 0
+        self.boundary = 0
+        self.tail = collections.Counter()
+        self.tailLength = 0
+        self.prefixHash = hashlib.sha1().hexdigest()
+        self.compression = detectCompression(corpus)
+        self.extend(os.path.getsize(corpus))
+
+    def segment(self, start, end):
+        """
+        :return: EncodedCorpus of the words between two bytes of the file, after the stages
+        """
+        minLength = self.options['minLength']
+        words = encodeWords(match.group() for chunk in streamText(self.fileName, ctChunkSize, start, end)
+                            for match in ctWordRegex.finditer(chunk.lower()) if len(match.group()) >= minLength)
+        if self.options['stemming'] and not self.options['language'] and words:
+            # The language is detected once, so that the text appended later is stemmed in the same language
+            positions = random.Random(0).sample(range(len(words)), min(ctLanguageSampleSize, len(words)))
+            self.options['language'] = detectLanguage([words.vocabulary[words.ids[position]]
+                                                       for position in positions])
+        return applyStages(words, self.resources, self.options['stopwords'], self.options['preprocess'],
+                           self.options['stemming'], self.options['language']) or EncodedCorpus()
+
+    def extend(self, size):
+        """ Read the file from the last whitespace already read up to size, and add its words
+        The trailing word of the file (no whitespace after it) may be incomplete: it is read again next time
+        A compressed file is read whole (and loaded again when it changes, see refresh)
+        """
+        if self.compression:
+            boundary = size
+            segments = [(0, None)]
+        else:
+            with open(self.fileName, mode='rb') as f:
+                f.seek(max(size - ctChunkSize, self.boundary))
+                block = f.read(size - f.tell())
+            boundary = size - len(block) + max(block.rfind(c) for c in ctWhitespaceBytes) + 1
+            boundary = max(boundary, self.boundary)
+            segments = [(self.boundary, boundary), (boundary, size)]
+
+        # The words after the previous boundary (counted last time) are replaced with the new words
+        if self.tailLength:
+            del self.corpus.ids[-self.tailLength:]
+        self.counts.subtract(self.tail)
+        self.counts += collections.Counter()
+        # The new text up to the new boundary, then the trailing word (kept apart, as the next tail)
+        for start, end in segments:
+            words = self.segment(start, end) if end is None or end > start else EncodedCorpus()
+            ids = corpusIds(words)
+            appendCorpus(self.corpus, words)
+            frequencies = np.bincount(ids, minlength=len(words.vocabulary)).tolist()
+            counts = collections.Counter({word: count for word, count in zip(words.vocabulary, frequencies) if count})
+            self.counts.update(counts)
+            self.tail, self.tailLength = counts, len(ids)
+
+        self.prefixHash = self.hashPrefix(size)
+        self.size = size
+        self.boundary = boundary
+        self.mtime = os.path.getmtime(self.fileName)
+        self.total = sum(self.counts.values())
+        self.ranked = None
+        self.cache = {}
+        logging.info("Corpus %s: %s words, %s distinct words.", self.fileName, '{:,}'.format(self.total),
+                     '{:,}'.format(len(self.counts)))
+
+    def hashPrefix(self, size):
+        """
+        :return: hash of the first bytes of the file (SHA-1, hex)
+        """
+        sha = hashlib.sha1()
+        with open(self.fileName, mode='rb') as f:
+            while size > 0:
+                block = f.read(min(ctChunkSize, size))
+                if not block:
+                    break
+                sha.update(block)
+                size -= len(block)
+        return sha.hexdigest()
+
+    def refresh(self):
+        """ Check the file: if it grew, and its old content did not change, only the new text is read;
+        if it changed in any other way, it is loaded again
+        :return: the statistics ('unchanged', 'appended' or 'reloaded'), the change
+        """
+        size = os.path.getsize(self.fileName)
+        if size == self.size and os.path.getmtime(self.fileName) == self.mtime:
+            return self, 'unchanged'
+        if size > self.size and not self.compression and self.hashPrefix(self.size) == self.prefixHash:
+            statistics = self.copy()
+            statistics.extend(size)
+            return statistics, 'appended'
+        return CorpusStatistics(self.fileName, self.resources, **self.options), 'reloaded'
+
+    def copy(self):
+        """
+        :return: a copy, which can be extended while this one keeps answering
+        """
+        statistics = object.__new__(CorpusStatistics)
+        statistics.__dict__.update(self.__dict__)
+        statistics.corpus = EncodedCorpus(ids=array('I', self.corpus.ids))
+        statistics.corpus.vocabulary = list(self.corpus.vocabulary)
+        statistics.corpus.index = dict(self.corpus.index)
+        statistics.counts = collections.Counter(self.counts)
+        statistics.options = collections.OrderedDict(self.options)
+        return statistics
+
+    def frequency(self, word):
+        """
+        :return: (absolute frequency, relative frequency) of a word
+        """
+        count = self.counts.get(word, 0)
+        return count, count / self.total if self.total else 0.0
+
+    def top(self, n):
+        """
+        :return: list of the n most frequent (word, absolute frequency)
+        """
+        if self.ranked is None:
+            self.ranked = self.counts.most_common()
+        return self.ranked[:n]
+
+    def collocations(self, bigramMethod=3, maxSteps=10, minGain=0.0, topK=ctTopBigrams, minPMI=None, minCount=2):
+        """
+        :return: (Counter of the collocations of the last step -> absolute frequency, statistics of the steps)
+        """
+        key = ('collocations', bigramMethod, maxSteps, minGain, topK, minPMI, minCount)
+        if key not in self.cache:
+            dictionary = collections.Counter()
+            steps = []
+            # A copy, since the collocations are added to the vocabulary of the corpus
+            words = EncodedCorpus(self.corpus.vocabulary, array('I', self.corpus.ids))
+            if words:
+                for words, dictionary, statistics in collocationSteps(words, bigramMethod, maxSteps, minGain,
+                                                                      topK, minPMI, minCount):
+                    steps.append(statistics)
+            self.cache[key] = dictionary.most_common(), steps
+        return self.cache[key]
+
+    def bigrams(self, minCount=2, minPMI=None, topK=None):
+        """
+        :return: list of (word1, word2, absolute frequency, PMI), by decreasing PMI
+        """
+        key = ('bigrams', minCount, minPMI, topK)
+        if key not in self.cache:
+            bigrams = []
+            if len(self.corpus) > 1:
+                vocabulary = self.corpus.vocabulary
+                numTypes = len(vocabulary)
+                keys, counts, scores = scoreEncodedBigrams(self.corpus, minCount, minPMI, topK)
+                bigrams = [(vocabulary[bigram // numTypes], vocabulary[bigram % numTypes], count, score)
+                           for bigram, count, score in zip(keys.tolist(), counts.tolist(), scores.tolist())]
+            self.cache[key] = bigrams
+        return self.cache[key]
+
+    def sentiment(self):
+        """
+        :return: (dictionary of terms -> [value, absolute frequency, tokens, contribution, occurrences],
+                 Sentiment Index), see scoreSentiment
+        """
+        if 'sentiment' not in self.cache:
+            if not self.options['lexicon']:
+                raise ValueError('No lexicon loaded')
+            matcher = self.resources.matcher(self.options['lexicon'], self.options['exclusions'])
+            self.cache['sentiment'] = scoreSentiment(self.fileName, matcher=matcher)
+        return self.cache['sentiment']
+
+    def summary(self):
+        return collections.OrderedDict([('corpus', self.fileName), ('bytes', self.size), ('words', self.total),
+                                        ('distinctWords', len(self.counts)),
+                                        ('modified', time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.mtime))),
+                                        ('options', self.options)])
 
 
 # ---------------------------------------------------------------------
@@ -555,3 +4250,19 @@ def int_option(question, default=0):
                 return answer_int
             except:
                 pass
+
+
+# ---------------------------------------------------------------------
+# A function to ask the user a question and wait for a (decimal) numeric reply
+# ---------------------------------------------------------------------
+def float_option(question, default=None):
+    while True:
+        answer = input(question)
+        if not answer:
+            return default
+        else:
+            try:
+                answer_float = float(answer)
+                return answer_float
+            except:
+                pass
@@ -0,0 +1,120 @@
+import logging, sys, os, json, argparse, inspect
+
+# Configure logging
+logging.basicConfig(stream=sys.stdout, format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
+
+# The functions used here are defined in the separate file Functions.py
+from Functions import *
+
+
+# ---------------------------------------------------------------------
+# A function to load the jobs from a configuration file (JSON)
+# ---------------------------------------------------------------------
+def loadJobs(fileName):
+    """
+    :param fileName: configuration file: a list of jobs, or {"defaults": {options}, "jobs": [jobs]}
+    :return: list of jobs (dictionaries with the task, the corpus and the options)
+    """
+    with open(fileName, mode='r', encoding='utf-8') as f:
+        config = json.load(f)
+    if isinstance(config, list):
+        config = {'jobs': config}
+    defaults = config.get('defaults', {})
+    jobs = []
+    for job in config.get('jobs', []):
+        # The defaults only go to the tasks having such an option (e.g. no stopwords for sentiment)
+        parameters = inspect.signature(ctTasks[job['task']]).parameters if job.get('task') in ctTasks else {}
+        jobs.append(dict({key: value for key, value in defaults.items() if key in parameters}, **job))
+    return jobs
+
+
+# --------------------------------------------------------
+# Here we go - this is where the actual execution starts !
+# --------------------------------------------------------
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run frequencies, collocations and sentiment jobs without prompts. '
+                                                 'The jobs come from a configuration file (--config), or a single '
+                                                 'job is described by the options below.')
+    parser.add_argument('--config', help='configuration file (JSON): a list of jobs, or '
+                                         '{"defaults": {options}, "jobs": [{"task": ..., "corpus": ..., options}]}')
+    parser.add_argument('--task', choices=sorted(ctTasks), help='task of a single job')
+    parser.add_argument('--corpus', nargs='+', default=[],
+                        help='corpus of a single job (one job per corpus): a file, or a folder, pattern '
+                             '(e.g. "news/**/*.txt") or manifest of files (frequencies, collocations: one corpus, '
+                             'sentiment: every file scored)')
+    parser.add_argument('--stopwords', help='stopwords file (default: keep the stopwords)')
+    parser.add_argument('--preprocess', action='store_true', help='convert to lowercase, remove unicode characters, '
+                                                                  'diacritics, punctuation and digits')
+    parser.add_argument('--stemming', action='store_true', help='apply the Snowball stemmer')
+    parser.add_argument('--language', help='stemmer language (default: detected from the corpus)')
+    parser.add_argument('--stem-cache-size', type=int, default=ctStemCacheSize, dest='stemCacheSize',
+                        help='maximum number of cached stems per language, in memory and on disk')
+    parser.add_argument('--method', type=int, choices=[0, 1, 2, 3], default=0, dest='bigramMethod',
+                        help='collocations: 0=DICTIONARY, 1=REGEX, 2=FULL SCAN, 3=RANKED MERGE')
+    parser.add_argument('--top-k', type=int, default=ctTopBigrams, dest='topK',
+                        help='collocations: maximum number of bi-grams applied at every step')
+    parser.add_argument('--min-pmi', type=float, default=None, dest='minPMI',
+                        help='collocations: minimum PMI of a bi-gram')
+    parser.add_argument('--min-count', type=int, default=2, dest='minCount',
+                        help='collocations: minimum frequency of a bi-gram')
+    parser.add_argument('--max-steps', type=int, default=10, dest='maxSteps', help='collocations: maximum number of steps')
+    parser.add_argument('--min-gain', type=float, default=0.0, dest='minGain',
+                        help='collocations: minimum share of new collocations for going on to the next step')
+    parser.add_argument('--text-output', type=int, choices=[0, 1, 2], default=0, dest='textOutput',
+                        help='collocations: text of every step, besides the binary word ids: '
+                             '0 = none, 1 = text, 2 = compressed text')
+    parser.add_argument('--sentences', action='store_true',
+                        help='collocations: find the bi-grams within sentences only (methods 0 and 3)')
+    parser.add_argument('--lexicon', default='lexicon.csv', help='sentiment: lexicon file')
+    parser.add_argument('--exclusions', help='sentiment: exclusions file (default: the built-in exclusions)')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='processes used inside a job (frequencies: counting, collocations: loading the sentences '
+                             'and counting the bi-grams, sentiment: scoring a folder)')
+    parser.add_argument('--jobs', type=int, default=0, help='number of jobs running in parallel (0 = one at a time)')
+    parser.add_argument('--report', help='save the records of the jobs (with their wall times) to this JSON lines file')
+    parser.add_argument('--stage-report', dest='stageReport',
+                        help='save the records of the stages of all the jobs to this file (as .jsonl and .csv)')
+    parser.add_argument('--memory', action='store_true',
+                        help='measure the peak memory of every stage (tracemalloc, slower)')
+    parser.add_argument('--profile', choices=sorted(ctStageFunctions), dest='profileStage',
+                        help='profile this stage of every job (saved next to the results of the job)')
+    parser.add_argument('--profiler', choices=['cprofile', 'line'], default='cprofile',
+                        help='profiler of --profile: cprofile (functions) or line (lines, needs line_profiler)')
+    args = parser.parse_args()
+
+    jobs = []
+    if args.config:
+        jobs = loadJobs(args.config)
+    if args.task:
+        options = {'stopwords': args.stopwords, 'preprocess': args.preprocess, 'stemming': args.stemming,
+                   'language': args.language}
+        if args.task == 'frequencies':
+            options['processes'] = args.processes or 0
+        elif args.task == 'collocations':
+            options.update(bigramMethod=args.bigramMethod, topK=args.topK, minPMI=args.minPMI,
+                           minCount=args.minCount, maxSteps=args.maxSteps, minGain=args.minGain,
+                           textOutput=args.textOutput, sentences=args.sentences, processes=args.processes or 0)
+        else:
+            options = {'lexicon': args.lexicon, 'exclusions': args.exclusions, 'processes': args.processes}
+        jobs += [dict(options, task=args.task, corpus=corpus) for corpus in args.corpus]
+    if not jobs:
+        parser.error('no jobs: use --config, or --task and --corpus')
+
+    records = runJobs(jobs, args.jobs, memory=args.memory, profileStage=args.profileStage, profiler=args.profiler,
+                      stemCacheSize=args.stemCacheSize)
+
+    logging.info('========== SUMMARY ==========')
+    for record in records:
+        logging.info('{:15} {:40} {:>10.3f}s {}'.format(record['task'] or '', record['corpus'] or '', record['seconds'],
+                                                       record.get('error', '')))
+    stages = [stage for record in records for stage in record.get('stages', [])]
+    stageSummary(stages)
+    if args.stageReport:
+        folderName, fileName = os.path.split(args.stageReport)
+        saveStageReport(stages, folderName=folderName or '.', fileName=os.path.splitext(fileName)[0])
+    if args.report:
+        folderName, fileName = os.path.split(args.report)
+        saveToJSONFile(records=records,
+                       folderName=folderName or '.',
+                       fileName=os.path.splitext(fileName)[0],
+                       suffix='')
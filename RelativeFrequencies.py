@@ -11,61 +11,51 @@ from Functions import *
 # --------------------------------------------------------
 
 # Let's ask our user to supply the corpus file name
+# (only in the main process: the worker processes counting the words in parallel import this file too)
 corpus = None
-corpus = stringOption('Corpus file? [corpus.txt]: ', None, 'corpus.txt')
+if __name__ == '__main__':
+    corpus = stringOption('Corpus file, folder, pattern (e.g. news/*.txt) or manifest? [corpus.txt]: ',
+                          None, 'corpus.txt')
 if corpus:
 
-    # Let's load the individual words in memory
-    words = []
-    words = loadWords(corpus)
-    words_aux = [word for word in words if len(word) > 1]
-    words.clear()
-    words = words_aux.copy()
-    words_aux.clear()
-
-    if words:
-
-        # Do we want to remove stopwords?
-        remove_stop = boolOption('Do you want to remove the stopwords from the corpus? ')
-        if remove_stop == 1:
-
-            # Let's ask our user to supply the stopwords file name
-            stopwords_file = None
-            stopwords_file = stringOption('Stopwords file? [stopwords.txt]: ', None, 'stopwords.txt')
-            if stopwords_file:
-
-                # Load the stopwords from the provided file
-                stopwords = None
-                stopwords = loadWords(stopwords_file)
-                if stopwords:
-                    # Remove the stopwords from the original corpus
-                    words = removeStopwords(words, stopwords)
-
-        # Do we want to apply the general pre-processing? (convert all to lowercase,
-        # remove unicode characters, remove diacritics, remove punctuation, remove digits?)
-        flagPreProcess = boolOption('Do you want to pre-process text (convert to lowercase, '
-                                    'remove unicode characters, remove diacritics, remove punctuation, remove digits) ? ')
-        if flagPreProcess == 1:
-            words = preProcess(words)
-
-        # Do we want to apply stemming?
-        flagApplyStemming = boolOption('Do you want to apply stemming (remove morphological affixes) on corpus ? ')
-        if flagApplyStemming == 1:
-            # Apply the Snowball stemmer
-            words = doStemming(words)
-
-        # Now let's find the relative frequencies
-        dictionary = None
-        dictionary = buildDictionary(words)
-        if dictionary:
-            # Let's display the 20 most frequent words
-            showMostFrequent(dictionary, 20, type=0)
-
-            # Let's save the dictionary to disk
-            # We create a new folder named after the corpus and store the resulting files there
-            # for word in dictionary.most_common():
-            #     print('{} {:0.10f}'.format(word[0], word[1]))
-            saveToCSVFile(text='\n'.join('%s\t%.10f' % (word[0], word[1]) for word in dictionary.most_common()),
-                          folderName=corpus.split('.')[0],
-                          fileName=corpus.split('.')[0],
-                          suffix='')
+    # Do we want to count the words with several processes?
+    processes = int_option('Number of processes counting the words in parallel? (0 = none, default 0) ', 0)
+
+    # Do we want to remove stopwords?
+    stopwords_file = None
+    remove_stop = boolOption('Do you want to remove the stopwords from the corpus? ')
+    if remove_stop == 1:
+
+        # Let's ask our user to supply the stopwords file name
+        stopwords_file = stringOption('Stopwords file? [stopwords.txt]: ', None, 'stopwords.txt')
+
+    # Do we want to apply the general pre-processing? (convert all to lowercase,
+    # remove unicode characters, remove diacritics, remove punctuation, remove digits?)
+    flagPreProcess = boolOption('Do you want to pre-process text (convert to lowercase, '
+                                'remove unicode characters, remove diacritics, remove punctuation, remove digits) ? ')
+
+    # Do we want to apply stemming?
+    # (the Snowball stemmer: the stems are cached on disk and reused by the next runs)
+    flagApplyStemming = boolOption('Do you want to apply stemming (remove morphological affixes) on corpus ? ')
+    stemCacheSize = ctStemCacheSize
+    if flagApplyStemming == 1:
+        stemCacheSize = int_option('Maximum number of cached stems ? (default {:,}) '.format(ctStemCacheSize),
+                                   ctStemCacheSize)
+
+    # Every stage is measured (RELATIVEFREQ_MEMORY=1 also measures its peak memory), and one stage can be
+    # profiled (RELATIVEFREQ_PROFILE=stage for cProfile, or stage:line for line_profiler)
+    resources = PipelineResources(instrumentation=environmentInstrumentation(), stemCacheSize=stemCacheSize)
+
+    # Now let's find the relative frequencies, display the 20 most frequent words and save the dictionary
+    # to disk (we create a new folder named after the corpus and store the resulting files there)
+    runRelativeFrequencies(corpus,
+                           resources=resources,
+                           processes=processes,
+                           stopwords=stopwords_file,
+                           preprocess=flagPreProcess == 1,
+                           stemming=flagApplyStemming == 1)
+
+    # Let's display the time and memory of every stage, and save them (and the profile) next to the results
+    reportRun(resources.instrumentation,
+              folderName=corpusName(corpus),
+              fileName=os.path.basename(corpusName(corpus)) + '_frequencies')
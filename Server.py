@@ -0,0 +1,287 @@
+import logging, sys, os, json, argparse, asyncio, urllib.parse
+
+# Configure logging
+logging.basicConfig(stream=sys.stdout, format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
+
+# The functions used here are defined in the separate file Functions.py
+from Functions import *
+
+# The HTTP status lines of the answers
+ctStatus = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+# --------------------------------------------------------------------------------------------------
+# The name of a corpus in the queries: the path of its file relative to its source, without extension
+# (news/a/x.txt of news -> a/x), so that two files with the same name in different folders never collide
+# --------------------------------------------------------------------------------------------------
+def corpusKey(corpusFile, source):
+    """
+    :param corpusFile: one of the corpus files of a source
+    :param source: corpus file, folder, file name pattern or manifest (see CorpusSource)
+    :return: name of the corpus
+    """
+    name = os.path.relpath(corpusName(corpusFile), corpusRoot(source))
+    if name.startswith(os.pardir):
+        name = corpusName(corpusFile)
+    return name.replace(os.sep, '/')
+
+
+# --------------------------------------------------------------------------------------------------
+# The query server: the corpora are loaded once (see CorpusStatistics), then every query is answered
+# from memory. The queries which compute something the first time (collocations, bi-grams, sentiment)
+# and the reloads run in a thread, one at a time for a corpus, so that the other clients keep being answered
+# --------------------------------------------------------------------------------------------------
+class QueryServer(object):
+
+    def __init__(self, corpora, resources, options):
+        """
+        :param corpora: list of (name, corpus file), the names being unique (see corpusKey)
+        :param resources: PipelineResources
+        :param options: the options of CorpusStatistics (stages, lexicon)
+        """
+        self.resources = resources
+        self.options = options
+        files = {}
+        for name, corpus in corpora:
+            if name in files:
+                raise ValueError('Corpus %r found twice: %s and %s' % (name, files[name], corpus))
+            files[name] = corpus
+        self.corpora = collections.OrderedDict()
+        for name, corpus in corpora:
+            self.corpora[name] = CorpusStatistics(corpus, resources, **options)
+        self.locks = {}
+        self.routes = {
+            '/corpora': self.listCorpora,
+            '/frequency': self.frequency,
+            '/top': self.top,
+            '/collocations': self.collocations,
+            '/bigrams': self.bigrams,
+            '/sentiment': self.sentiment,
+            '/reload': self.reload
+        }
+
+    def select(self, query):
+        """
+        :param query: the parameters of the query (corpus = the name of a corpus, all the corpora if missing)
+        :return: list of (name, statistics)
+        """
+        names = query.get('corpus') or list(self.corpora)
+        for name in names:
+            if name not in self.corpora:
+                raise KeyError('Unknown corpus %r (expected one of %s)' % (name, ', '.join(self.corpora)))
+        return [(name, self.corpora[name]) for name in names]
+
+    def lock(self, name):
+        # Created in the event loop of the server
+        if name not in self.locks:
+            self.locks[name] = asyncio.Lock()
+        return self.locks[name]
+
+    async def compute(self, name, function, *args):
+        """ Run a function in a thread, one at a time for a corpus
+        :return: the result of the function
+        """
+        async with self.lock(name):
+            return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+    async def listCorpora(self, query):
+        return collections.OrderedDict((name, statistics.summary()) for name, statistics in self.select(query))
+
+    async def frequency(self, query):
+        words = query.get('word', [])
+        if not words:
+            raise ValueError('Missing parameter: word')
+        answer = collections.OrderedDict()
+        for name, statistics in self.select(query):
+            answer[name] = collections.OrderedDict()
+            for word in words:
+                count, frequency = statistics.frequency(word)
+                answer[name][word] = {'count': count, 'frequency': frequency}
+        return answer
+
+    async def top(self, query):
+        n = intParameter(query, 'n', 20)
+        return collections.OrderedDict((name, statistics.top(n)) for name, statistics in self.select(query))
+
+    async def collocations(self, query):
+        n = intParameter(query, 'n', 20)
+        options = (intParameter(query, 'method', 3), intParameter(query, 'steps', 10),
+                   floatParameter(query, 'minGain', 0.0), intParameter(query, 'topK', ctTopBigrams),
+                   floatParameter(query, 'minPMI', None), intParameter(query, 'minCount', 2))
+        if options[0] not in [0, 1, 2, 3]:
+            raise ValueError('method must be 0, 1, 2 or 3')
+        answer = collections.OrderedDict()
+        for name, statistics in self.select(query):
+            collocations, steps = await self.compute(name, statistics.collocations, *options)
+            answer[name] = collections.OrderedDict([('collocations', collocations[:n]), ('steps', steps)])
+        return answer
+
+    async def bigrams(self, query):
+        n = intParameter(query, 'n', 20)
+        options = (intParameter(query, 'minCount', 2), floatParameter(query, 'minPMI', None))
+        answer = collections.OrderedDict()
+        for name, statistics in self.select(query):
+            bigrams = await self.compute(name, statistics.bigrams, *options)
+            answer[name] = bigrams[:n]
+        return answer
+
+    async def sentiment(self, query):
+        n = intParameter(query, 'n', 20)
+        answer = collections.OrderedDict()
+        for name, statistics in self.select(query):
+            outFreq, sentimentIndex = await self.compute(name, statistics.sentiment)
+            terms = sorted(outFreq.items(), key=lambda item: -abs(item[1][3]))[:n]
+            answer[name] = collections.OrderedDict([
+                ('sentimentIndex', sentimentIndex),
+                ('terms', [collections.OrderedDict([('term', term), ('value', values[0]), ('count', values[1]),
+                                                    ('contribution', values[3]),
+                                                    ('occurrences', dict(values[4].most_common()))])
+                           for term, values in terms if values[1]])])
+        return answer
+
+    async def reload(self, query):
+        answer = collections.OrderedDict()
+        for name, _ in self.select(query):
+            async with self.lock(name):
+                self.corpora[name], answer[name] = await asyncio.get_running_loop().run_in_executor(
+                    None, self.corpora[name].refresh)
+            logging.info('Corpus %s: %s', name, answer[name])
+        return answer
+
+    async def answer(self, method, target):
+        """
+        :param method: HTTP method
+        :param target: path and parameters of the query
+        :return: (HTTP status, answer)
+        """
+        url = urllib.parse.urlsplit(target)
+        if url.path not in self.routes:
+            return 404, {'error': 'Unknown query %s (expected one of %s)' % (url.path, ', '.join(self.routes))}
+        if method not in ('GET', 'POST'):
+            return 405, {'error': 'Method %s not allowed' % method}
+        try:
+            return 200, await self.routes[url.path](urllib.parse.parse_qs(url.query))
+        except KeyError as e:
+            return 404, {'error': e.args[0]}
+        except ValueError as e:
+            return 400, {'error': str(e)}
+        except Exception as e:
+            logging.info(repr(e))
+            return 500, {'error': repr(e)}
+
+    async def handle(self, reader, writer):
+        """ Answer the requests of a client (HTTP/1.1, the connection is kept open between requests) """
+        try:
+            while True:
+                line = await reader.readline()
+                if not line.strip():
+                    break
+                method, target, version = line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    header = await reader.readline()
+                    if not header.strip():
+                        break
+                    key, _, value = header.decode('latin-1').partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                if int(headers.get('content-length', 0)):
+                    await reader.readexactly(int(headers['content-length']))
+
+                start = time.perf_counter()
+                status, answer = await self.answer(method, target)
+                body = json.dumps(answer, ensure_ascii=False).encode('utf-8')
+                keepAlive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                writer.write(('%s %s %s\r\nContent-Type: application/json; charset=utf-8\r\n'
+                              'Content-Length: %s\r\nConnection: %s\r\n\r\n' %
+                              (version, status, ctStatus[status], len(body), 'keep-alive' if keepAlive else 'close')
+                              ).encode('latin-1') + body)
+                await writer.drain()
+                logging.info('%s %s %s %.1fms', method, target, status, (time.perf_counter() - start) * 1000)
+                if not keepAlive:
+                    break
+        except (ValueError, ConnectionError, asyncio.IncompleteReadError) as e:
+            logging.info(repr(e))
+        finally:
+            writer.close()
+
+    async def watch(self, seconds):
+        """ Reload the corpora whose files changed, every few seconds """
+        while True:
+            await asyncio.sleep(seconds)
+            await self.reload({})
+
+
+def intParameter(query, name, default):
+    try:
+        return int(query[name][0]) if name in query else default
+    except ValueError:
+        raise ValueError('%s must be an integer' % name)
+
+
+def floatParameter(query, name, default):
+    try:
+        return float(query[name][0]) if name in query else default
+    except ValueError:
+        raise ValueError('%s must be a number' % name)
+
+
+async def serve(server, host, port, socket, watch):
+    if socket:
+        listener = await asyncio.start_unix_server(server.handle, path=socket)
+        logging.info('Listening on %s', socket)
+    else:
+        listener = await asyncio.start_server(server.handle, host, port)
+        logging.info('Listening on http://%s:%s', host, port)
+    if watch:
+        asyncio.ensure_future(server.watch(watch))
+    async with listener:
+        await listener.serve_forever()
+
+
+# --------------------------------------------------------
+# Here we go - this is where the actual execution starts !
+# --------------------------------------------------------
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load corpora once and answer frequency, top-N, collocation and '
+                                                 'sentiment queries over HTTP (JSON), e.g. '
+                                                 '/frequency?word=casa&corpus=news, /top?n=50, '
+                                                 '/collocations?method=3&n=100, /bigrams?n=100&minCount=5, '
+                                                 '/sentiment, /corpora, /reload (after the files changed)')
+    parser.add_argument('--corpus', nargs='+', required=True, help='corpus file(s), folder, pattern or manifest')
+    parser.add_argument('--host', default='127.0.0.1', help='address of the server (default: localhost only)')
+    parser.add_argument('--port', type=int, default=8765, help='port of the server')
+    parser.add_argument('--socket', help='listen on this Unix socket, instead of a port')
+    parser.add_argument('--watch', type=float, default=0,
+                        help='reload the corpora whose files changed every so many seconds (0 = only on /reload)')
+    parser.add_argument('--min-length', type=int, default=1, dest='minLength', help='minimum length of the words')
+    parser.add_argument('--stopwords', help='stopwords file (default: keep the stopwords)')
+    parser.add_argument('--preprocess', action='store_true', help='convert to lowercase, remove unicode characters, '
+                                                                  'diacritics, punctuation and digits')
+    parser.add_argument('--stemming', action='store_true', help='apply the Snowball stemmer')
+    parser.add_argument('--language', help='stemmer language (default: detected from the corpus)')
+    parser.add_argument('--stem-cache-size', type=int, default=ctStemCacheSize, dest='stemCacheSize',
+                        help='maximum number of cached stems per language, in memory and on disk')
+    parser.add_argument('--lexicon', default='lexicon.csv', help='sentiment lexicon file (none = no sentiment)')
+    parser.add_argument('--exclusions', help='sentiment exclusions file (default: the built-in exclusions)')
+    args = parser.parse_args()
+
+    corpora = []
+    for corpus in args.corpus:
+        corpora += [(corpusKey(corpusFile, corpus), corpusFile) for corpusFile in CorpusSource(corpus).files]
+    if not corpora:
+        parser.error('no corpus found')
+
+    lexicon = args.lexicon if args.lexicon and os.path.exists(args.lexicon) else None
+    # The stages of every reload are not kept: the server runs for a long time
+    resources = PipelineResources(instrumentation=Instrumentation(keepRecords=False), stemCacheSize=args.stemCacheSize)
+    try:
+        server = QueryServer(corpora, resources, {'minLength': args.minLength, 'stopwords': args.stopwords,
+                                                  'preprocess': args.preprocess, 'stemming': args.stemming,
+                                                  'language': args.language, 'lexicon': lexicon,
+                                                  'exclusions': args.exclusions})
+    except ValueError as e:
+        parser.error(str(e))
+    try:
+        asyncio.run(serve(server, args.host, args.port, args.socket, args.watch))
+    except KeyboardInterrupt:
+        logging.info('Server stopped')